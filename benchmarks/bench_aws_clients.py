@@ -0,0 +1,42 @@
+"""Measure worker boot time and per-request AWS client construction.
+
+Boot time is how long a fresh interpreter takes to import server.py, which is
+what each gunicorn worker pays before serving. No AWS calls are made:
+
+    python -m benchmarks.bench_aws_clients
+"""
+import os
+import sys
+import time
+import statistics
+import subprocess
+import boto3
+from services.utils.aws_clients import get_client
+
+BOOT_RUNS = 5
+CLIENT_RUNS = 50
+
+def measure_boot():
+    env = {**os.environ, 'PROACTIVE_TOKEN_REFRESH': 'false'}
+    code = 'import time; start = time.perf_counter(); import server; print(time.perf_counter() - start)'
+    timings = []
+    for _ in range(BOOT_RUNS):
+        output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+def measure(build):
+    start = time.perf_counter()
+    for _ in range(CLIENT_RUNS):
+        build()
+    return (time.perf_counter() - start) / CLIENT_RUNS
+
+def main():
+    print(f"worker boot (import server): {measure_boot() * 1000:.0f} ms")
+    per_call = measure(lambda: boto3.client('cognito-idp', region_name='us-east-1'))
+    get_client('cognito-idp', region_name='us-east-1')
+    cached = measure(lambda: get_client('cognito-idp', region_name='us-east-1'))
+    print(f"cognito-idp client per request: {per_call * 1000:.2f} ms new, {cached * 1000:.4f} ms shared")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Compare DynamoDB bytes read and written per request for the two connections layouts.
+
+Read bytes are what comes back to the application after projection. DynamoDB
+bills a GetItem on the size of the whole item, so only the per_app layout
+lowers read capacity; projections lower payload and deserialization cost.
+
+Runs against moto, so it needs no AWS account:
+
+    python -m benchmarks.bench_connections_layout
+"""
+import boto3
+from moto import mock_aws
+from services.utils.connections_store import UserItemStore, AppItemStore
+from services.utils.dynamo_utils import estimate_size
+
+USER_ID = 'bench_user'
+APPS = ['spotify', 'gmail', 'github', 'slack', 'notion', 'dropbox']
+
+def _tokens(app_name):
+    return {
+        'access_token': f'{app_name}-' + 'a' * 200,
+        'refresh_token': f'{app_name}-' + 'r' * 120,
+        'expires_at': 1900000000
+    }
+
+class MeteredTable:
+    """Adds up the estimated size of the items a table reads and writes"""
+
+    def __init__(self, table):
+        self.table = table
+        self.read_bytes = 0
+        self.write_bytes = 0
+
+    def reset(self):
+        self.read_bytes = 0
+        self.write_bytes = 0
+
+    def _item_size(self, key):
+        item = self.table.get_item(Key=key, ConsistentRead=True).get('Item')
+        return estimate_size(item) if item else 0
+
+    def get_item(self, **kwargs):
+        response = self.table.get_item(**kwargs)
+        self.read_bytes += estimate_size(response.get('Item', {}))
+        return response
+
+    def query(self, **kwargs):
+        response = self.table.query(**kwargs)
+        self.read_bytes += sum(estimate_size(item) for item in response.get('Items', []))
+        return response
+
+    def scan(self, **kwargs):
+        response = self.table.scan(**kwargs)
+        self.read_bytes += sum(estimate_size(item) for item in response.get('Items', []))
+        return response
+
+    def put_item(self, **kwargs):
+        self.write_bytes += estimate_size(kwargs['Item'])
+        return self.table.put_item(**kwargs)
+
+    def update_item(self, **kwargs):
+        # Writes are billed on the larger of the item before and after the update
+        before = self._item_size(kwargs['Key'])
+        response = self.table.update_item(**kwargs)
+        self.write_bytes += max(before, self._item_size(kwargs['Key']))
+        return response
+
+    def delete_item(self, **kwargs):
+        self.write_bytes += self._item_size(kwargs['Key'])
+        return self.table.delete_item(**kwargs)
+
+def _create_tables():
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    user_table = dynamodb.create_table(
+        TableName='link-connections-table',
+        KeySchema=[{'AttributeName': 'userId', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'userId', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    app_table = dynamodb.create_table(
+        TableName='link-app-connections-table',
+        KeySchema=[
+            {'AttributeName': 'userId', 'KeyType': 'HASH'},
+            {'AttributeName': 'appName', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'userId', 'AttributeType': 'S'},
+            {'AttributeName': 'appName', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return MeteredTable(user_table), MeteredTable(app_table)
+
+def _measure(table, operation):
+    table.reset()
+    operation()
+    return table.read_bytes, table.write_bytes
+
+def _run(store, table):
+    for app_name in APPS[:-1]:
+        store.add_app(USER_ID, app_name, _tokens(app_name))
+
+    refreshed = {**_tokens('spotify'), 'access_token': 'spotify-' + 'b' * 200}
+    return {
+        'list connected apps': _measure(table, lambda: store.get_connected_apps(USER_ID)),
+        'get app headers': _measure(table, lambda: store.get_app_tokens(USER_ID, 'spotify')),
+        'connect app': _measure(table, lambda: store.add_app(USER_ID, APPS[-1], _tokens(APPS[-1]))),
+        'refresh token': _measure(table, lambda: store.store_refreshed_tokens(
+            USER_ID, 'spotify', refreshed, _tokens('spotify')['access_token'])),
+        'remove app': _measure(table, lambda: store.remove_app(USER_ID, APPS[-1]))
+    }
+
+def main():
+    with mock_aws():
+        user_table, app_table = _create_tables()
+        before = _run(UserItemStore(user_table), user_table)
+        after = _run(AppItemStore(app_table), app_table)
+
+    print(f"{len(APPS) - 1} connected apps, bytes per request (read / write)")
+    print(f"{'operation':<22}{'per_user':>18}{'per_app':>18}")
+    for operation, (read_bytes, write_bytes) in before.items():
+        app_read, app_write = after[operation]
+        print(f"{operation:<22}{f'{read_bytes} / {write_bytes}':>18}{f'{app_read} / {app_write}':>18}")
+
+if __name__ == '__main__':
+    main()
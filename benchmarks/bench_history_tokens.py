@@ -0,0 +1,42 @@
+"""Estimated input tokens of the history sent with each turn, before and after budgeted history.
+
+Replays sample transcripts (in the client's history format) turn by turn and
+compares the old prompt, the last 5 turns flattened into the user message,
+with alternating messages trimmed to HISTORY_TOKEN_BUDGET:
+
+    python -m benchmarks.bench_history_tokens
+"""
+import os
+import json
+from services.utils.conversation import history_messages, pairs_to_turns, message_tokens, estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+
+TRANSCRIPTS = os.path.join(os.path.dirname(__file__), 'transcripts', 'sample_chats.json')
+
+def flattened_tokens(prompt, history):
+    if history:
+        history_text = "\n".join([f"User: {msg['user']}\nAssistant: {msg['assistant']}" for msg in history[-5:]])
+        prompt = f"Previous conversation:\n{history_text}\n\nCurrent message: {prompt}"
+    return MESSAGE_OVERHEAD_TOKENS + estimate_tokens(prompt)
+
+def budgeted_tokens(prompt, history):
+    messages = history_messages(pairs_to_turns(history))
+    return sum(message_tokens(message) for message in messages) + MESSAGE_OVERHEAD_TOKENS + estimate_tokens(prompt)
+
+def main():
+    with open(TRANSCRIPTS) as f:
+        transcripts = json.load(f)
+
+    for name, turns in transcripts.items():
+        print(f"{name}: estimated input tokens per turn (last 5 flattened -> budgeted messages)")
+        before_total = after_total = 0
+        for index, turn in enumerate(turns):
+            history = turns[:index]
+            before = flattened_tokens(turn['user'], history)
+            after = budgeted_tokens(turn['user'], history)
+            before_total += before
+            after_total += after
+            print(f"  turn {index + 1:>2}: {before:>6} -> {after:>6}")
+        print(f"  total:   {before_total:>6} -> {after_total:>6} ({(after_total - before_total) / before_total:+.0%})\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Latency of simple commands answered by the intent router vs by the model, and the
+router's hit rate over the labelled prompts of eval_tool_pruning.
+
+Bedrock is stubbed with a fixed latency per converse call and the tool with
+its own, so the saving is the two model round trips a routed prompt skips:
+
+    python -m benchmarks.bench_intent_router
+"""
+import os
+import io
+import json
+import time
+import contextlib
+from unittest.mock import MagicMock, patch
+
+os.environ.setdefault('PROACTIVE_TOKEN_REFRESH', 'false')
+
+from services.bedrock_agent_service import BedrockAgent
+from services.utils.tools.app_manager import AppManager
+from services.utils.agent_metrics import agent_metrics
+from benchmarks.eval_tool_pruning import PROMPTS
+
+CONVERSE_LATENCY = 0.6
+TOOL_LATENCY = 0.2
+RUNS = 5
+
+def converse(**request):
+    time.sleep(CONVERSE_LATENCY)
+    if request['messages'][-1]['content'][0].get('toolResult'):
+        content = [{'text': 'Here are your playlists.'}]
+    else:
+        content = [{'toolUse': {'toolUseId': 't1', 'name': 'spotify_get_user_playlists', 'input': {}}}]
+    stop_reason = 'tool_use' if 'toolUse' in content[0] else 'end_turn'
+    return {'output': {'message': {'role': 'assistant', 'content': content}}, 'stopReason': stop_reason, 'usage': {}}
+
+def make_agent(intent_routing):
+    app_manager = AppManager(MagicMock())
+    app_manager.call_app_tool = lambda *args: time.sleep(TOOL_LATENCY) or 'Road Trip\nWorkout'
+    agent = BedrockAgent(app_manager)
+    agent.client = MagicMock()
+    agent.client.converse.side_effect = converse
+    agent.intent_routing = intent_routing
+    return agent
+
+def main():
+    agent_metrics.clear()
+    tools = AppManager(MagicMock()).get_user_tools(connected_apps=['spotify', 'gmail'])
+    # The agent logs a line per turn; keep the report readable
+    with patch('services.bedrock_agent_service.get_request_user_id', return_value='bench_user'), contextlib.redirect_stdout(io.StringIO()):
+        for intent_routing in (False, True):
+            agent = make_agent(intent_routing)
+            for _ in range(RUNS):
+                agent.call_bedrock('List my playlists', tools=tools)
+
+    paths = agent_metrics.snapshot()
+    print(f"'List my playlists', {CONVERSE_LATENCY * 1000:.0f} ms per converse call, {TOOL_LATENCY * 1000:.0f} ms tool")
+    print(f"  model:  {paths['tool']['avg_latency_ms']:>6.0f} ms, {paths['tool']['converse_calls'] // RUNS} converse calls")
+    print(f"  router: {paths['router']['avg_latency_ms']:>6.0f} ms, {paths['router']['converse_calls'] // RUNS} converse calls")
+    print(f"  saved per hit: {agent.intent_router.stats()['saved_ms_per_hit']:.0f} ms")
+
+    with open(PROMPTS) as f:
+        cases = json.load(f)
+    router = make_agent(True).intent_router
+    routed = [case['prompt'] for case in cases if router.match(case['prompt'], tools)]
+    print(f"\nrouted {len(routed)}/{len(cases)} labelled prompts ({len(routed) / len(cases):.0%}):")
+    for prompt in routed:
+        print(f"  {prompt}")
+
+if __name__ == '__main__':
+    main()
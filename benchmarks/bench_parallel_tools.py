@@ -0,0 +1,47 @@
+"""Wall-clock time of one agent step that asks for several tools, run serially vs in parallel.
+
+Tools are stubbed with a fixed latency and Bedrock with an instant client:
+
+    python -m benchmarks.bench_parallel_tools
+"""
+import os
+import time
+from unittest.mock import MagicMock, patch
+
+os.environ.setdefault('PROACTIVE_TOKEN_REFRESH', 'false')
+
+from services.bedrock_agent_service import BedrockAgent
+from services.utils.tool_executor import ToolExecutor
+
+TOOL_LATENCY = 0.3
+
+def converse_response(content):
+    stop_reason = 'tool_use' if any('toolUse' in block for block in content) else 'end_turn'
+    return {'output': {'message': {'role': 'assistant', 'content': content}}, 'stopReason': stop_reason, 'usage': {}}
+
+def run_step(tool_count, per_user_limit):
+    app_manager = MagicMock()
+    app_manager.call_app_tool.side_effect = lambda *args: time.sleep(TOOL_LATENCY) or 'result'
+    agent = BedrockAgent(app_manager)
+    agent.tool_executor = ToolExecutor(max_workers=8, per_user_limit=per_user_limit)
+    agent.client = MagicMock()
+    agent.client.converse.side_effect = [
+        converse_response([{'toolUse': {'toolUseId': f't{i}', 'name': 'spotify_get_artist_info', 'input': {}}} for i in range(tool_count)]),
+        converse_response([{'text': 'done'}])
+    ]
+
+    start = time.perf_counter()
+    with patch('services.bedrock_agent_service.get_request_user_id', return_value='bench_user'):
+        agent.call_bedrock('prompt')
+    return time.perf_counter() - start
+
+def main():
+    print(f"tools in one step, {TOOL_LATENCY * 1000:.0f} ms each")
+    print(f"{'tools':<8}{'serial':>12}{'parallel':>12}")
+    for tool_count in (1, 2, 4):
+        serial = run_step(tool_count, per_user_limit=1)
+        parallel = run_step(tool_count, per_user_limit=4)
+        print(f"{tool_count:<8}{serial * 1000:>9.0f} ms{parallel * 1000:>9.0f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Turn latency with and without speculative prefetch, and the predicted waste
+rate over the labelled prompts of eval_tool_pruning.
+
+Bedrock and the tool are stubbed with fixed latencies; with prefetch the tool
+runs during the first converse call instead of after it:
+
+    python -m benchmarks.bench_prefetch
+
+The waste rate counts a prefetched call as used when the prompt's labelled
+tools include it (or, for a token load, any tool of that app). Labels carry no
+arguments, so a list call the model makes with another max_results would
+still miss in production.
+"""
+import io
+import os
+import json
+import time
+import contextlib
+from unittest.mock import MagicMock, patch
+
+os.environ.setdefault('PROACTIVE_TOKEN_REFRESH', 'false')
+
+from services.bedrock_agent_service import BedrockAgent
+from services.utils.tools.app_manager import AppManager
+from services.utils.agent_metrics import agent_metrics
+from benchmarks.eval_tool_pruning import PROMPTS
+
+CONVERSE_LATENCY = 0.6
+TOOL_LATENCY = 0.3
+RUNS = 5
+
+def converse(**request):
+    time.sleep(CONVERSE_LATENCY)
+    if request['messages'][-1]['content'][0].get('toolResult'):
+        content = [{'text': 'You have Road Trip and Workout.'}]
+    else:
+        content = [{'toolUse': {'toolUseId': 't1', 'name': 'spotify_get_user_playlists', 'input': {}}}]
+    stop_reason = 'tool_use' if 'toolUse' in content[0] else 'end_turn'
+    return {'output': {'message': {'role': 'assistant', 'content': content}}, 'stopReason': stop_reason, 'usage': {}}
+
+def turn_latency(prefetch):
+    app_manager = AppManager(MagicMock())
+    app_manager.call_app_tool = lambda *args: time.sleep(TOOL_LATENCY) or 'Road Trip\nWorkout'
+    agent = BedrockAgent(app_manager)
+    agent.client = MagicMock()
+    agent.client.converse.side_effect = converse
+    agent.prefetch = prefetch
+    tools = app_manager.get_user_tools(connected_apps=['spotify', 'gmail'])
+
+    agent_metrics.clear()
+    with patch('services.bedrock_agent_service.get_request_user_id', return_value='bench_user'), contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(RUNS):
+            agent.call_bedrock('What playlists do I have?', tools=tools)
+    return agent_metrics.snapshot()['tool']['avg_latency_ms']
+
+def main():
+    print(f"'What playlists do I have?', {CONVERSE_LATENCY * 1000:.0f} ms per converse call, {TOOL_LATENCY * 1000:.0f} ms tool")
+    print(f"  without prefetch: {turn_latency(False):>6.0f} ms")
+    print(f"  with prefetch:    {turn_latency(True):>6.0f} ms")
+
+    with open(PROMPTS) as f:
+        cases = json.load(f)
+    app_manager = AppManager(MagicMock())
+    prefetcher = BedrockAgent(app_manager).prefetcher
+    tools = app_manager.get_user_tools(connected_apps=['spotify', 'gmail'])
+
+    started = used = 0
+    for case in cases:
+        calls = prefetcher.predict(case['prompt'], tools)[:prefetcher.max_calls]
+        apps = {tool_name.split('_')[0] for tool_name in case['tools']}
+        started += len(calls)
+        used += sum(1 for name, args in calls if name in case['tools'] or (name == 'headers' and args in apps))
+    print(f"\n{len(cases)} labelled prompts: {started} prefetches, {used} used, waste rate {(started - used) / started:.0%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Estimated input tokens per turn of a long session, with and without rolling summaries.
+
+Replays a sample transcript, repeated to SESSION_TURNS turns, through a
+SessionStore and compares the history sent with each prompt:
+
+    full        every earlier turn, as clients sending their own history did
+    budgeted    the newest turns that fit HISTORY_TOKEN_BUDGET (older ones are lost)
+    summarized  the rolling summary plus the turns after it
+
+No model is called: the summary stands in at SESSION_SUMMARY_MAX_TOKENS, its
+worst case, and the tokens the summary calls themselves read are reported too.
+
+    python -m benchmarks.bench_session_summary
+"""
+import os
+import json
+from benchmarks.bench_history_tokens import TRANSCRIPTS
+from services.bedrock_agent_service import SESSION_SUMMARY_MAX_TOKENS
+from services.utils.conversation import history_messages, pairs_to_turns, message_tokens, estimate_tokens, truncate_text, MESSAGE_OVERHEAD_TOKENS
+from services.utils.session_store import SessionStore
+
+SESSION_TURNS = int(os.getenv('SESSION_TURNS', 40))
+
+def input_tokens(prompt, turns, summary=None, token_budget=None):
+    messages = history_messages(turns, token_budget=token_budget)
+    tokens = sum(message_tokens(message) for message in messages) + MESSAGE_OVERHEAD_TOKENS + estimate_tokens(prompt)
+    return tokens + (estimate_tokens(summary) if summary else 0)
+
+def main():
+    with open(TRANSCRIPTS) as f:
+        transcript = json.load(f)['inbox_and_playlists']
+    pairs = [transcript[i % len(transcript)] for i in range(SESSION_TURNS)]
+
+    store = SessionStore(max_turns=SESSION_TURNS)
+    summary_input = []
+
+    def summarizer(summary, turns):
+        text = "\n".join(message['content'][0]['text'] for turn in turns for message in turn)
+        summary_input.append(estimate_tokens((summary or '') + text))
+        return truncate_text((summary or '') + text, SESSION_SUMMARY_MAX_TOKENS)
+
+    print(f"{SESSION_TURNS} turns: estimated input tokens per turn (full / budgeted / summarized)")
+    totals = [0, 0, 0]
+    for index, pair in enumerate(pairs):
+        summary, turns = store.get_session('bench', 'session')
+        row = [
+            input_tokens(pair['user'], pairs_to_turns(pairs[:index]), token_budget=10 ** 9),
+            input_tokens(pair['user'], pairs_to_turns(pairs[:index])),
+            input_tokens(pair['user'], turns, summary)
+        ]
+        totals = [total + tokens for total, tokens in zip(totals, row)]
+        print(f"  turn {index + 1:>2}: {row[0]:>6} {row[1]:>6} {row[2]:>6}")
+
+        store.append_turn('bench', 'session', pairs_to_turns([pair])[0])
+        future = store.maybe_summarize('bench', 'session', summarizer)
+        if future:
+            future.result()
+
+    print(f"  total:   {totals[0]:>6} {totals[1]:>6} {totals[2]:>6}")
+    print(f"  summary calls: {len(summary_input)}, {sum(summary_input)} input tokens off the request path")
+
+if __name__ == '__main__':
+    main()
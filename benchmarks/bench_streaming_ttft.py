@@ -0,0 +1,55 @@
+"""Time to first token of call_bedrock vs stream_bedrock against a stubbed Bedrock client.
+
+The stub produces TOKENS tokens TOKEN_DELAY seconds apart, the same pace for
+converse (which only returns once all are done) and converse_stream:
+
+    python -m benchmarks.bench_streaming_ttft
+"""
+import os
+import time
+from unittest.mock import MagicMock
+
+os.environ.setdefault('PROACTIVE_TOKEN_REFRESH', 'false')
+
+from services.bedrock_agent_service import BedrockAgent
+
+TOKENS = 60
+TOKEN_DELAY = 0.02
+
+class StubBedrock:
+    def _words(self):
+        return [f'word{i} ' for i in range(TOKENS)]
+
+    def converse(self, **kwargs):
+        time.sleep(TOKENS * TOKEN_DELAY)
+        return {'output': {'message': {'role': 'assistant', 'content': [{'text': ''.join(self._words())}]}}, 'usage': {}}
+
+    def converse_stream(self, **kwargs):
+        def events():
+            for word in self._words():
+                time.sleep(TOKEN_DELAY)
+                yield {'contentBlockDelta': {'contentBlockIndex': 0, 'delta': {'text': word}}}
+            yield {'messageStop': {'stopReason': 'end_turn'}}
+        return {'stream': events()}
+
+def main():
+    agent = BedrockAgent(MagicMock())
+    agent.client = StubBedrock()
+    agent.format_pass = False
+
+    start = time.perf_counter()
+    agent.call_bedrock('Hello')
+    blocking = time.perf_counter() - start
+
+    start = time.perf_counter()
+    events = agent.stream_bedrock('Hello')
+    next(events)
+    ttft = time.perf_counter() - start
+    list(events)
+    total = time.perf_counter() - start
+
+    print(f"/generate         first token after {blocking * 1000:.0f} ms")
+    print(f"/generate/stream  first token after {ttft * 1000:.0f} ms, done after {total * 1000:.0f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Offline evaluation of ToolSelector: how often the pruned tool set still has
+the tools a prompt needs, and how many toolConfig tokens it saves.
+
+Each labelled prompt in transcripts/tool_prompts.json lists the tools a good
+answer calls. A miss means the model would have to call request_more_tools
+and pay for one extra converse call.
+
+    python -m benchmarks.eval_tool_pruning
+"""
+import os
+import json
+from unittest.mock import MagicMock
+from services.utils.conversation import estimate_tokens
+from services.utils.tools.app_manager import AppManager
+from services.utils.tool_selector import ToolSelector
+
+PROMPTS = os.path.join(os.path.dirname(__file__), 'transcripts', 'tool_prompts.json')
+
+def main():
+    with open(PROMPTS) as f:
+        cases = json.load(f)
+
+    app_manager = AppManager(MagicMock())
+    tools = app_manager.get_user_tools(connected_apps=list(app_manager.app_tools))
+    selector = ToolSelector(app_manager.app_keywords())
+    full_tokens = estimate_tokens(json.dumps(tools))
+
+    hits = 0
+    pruned_tokens = 0
+    for case in cases:
+        offered = selector.select(case['prompt'], case.get('context', ''), tools)
+        names = {tool['toolSpec']['name'] for tool in offered}
+        hit = set(case['tools']) <= names
+        hits += hit
+        tokens = estimate_tokens(json.dumps(offered))
+        pruned_tokens += tokens
+        print(f"  {'ok  ' if hit else 'MISS'} {len(offered):>2} tools {tokens:>4} tokens  {case['prompt']}")
+
+    print(f"\n{len(cases)} prompts, {len(tools)} tools ({full_tokens} estimated tokens) per prompt without pruning")
+    print(f"  needed tools offered: {hits}/{len(cases)} ({hits / len(cases):.0%}); misses fall back to the full set")
+    print(f"  toolConfig tokens:    {full_tokens * len(cases)} -> {pruned_tokens} "
+          f"({(pruned_tokens - full_tokens * len(cases)) / (full_tokens * len(cases)):+.0%})")
+
+if __name__ == '__main__':
+    main()
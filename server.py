@@ -1,13 +1,20 @@
-from flask import Flask, request, jsonify, abort, make_response
+from flask import Flask, Response, request, jsonify, abort, make_response, stream_with_context
 from flask_cors import CORS
 from services.utils.user_cache import user_tools_cache
+from services.utils.token_refresher import token_refresh_scheduler
 from services.utils.cognito_utils import get_user_from_token
+from services.utils.request_context import get_request_context, request_cached
+from services.utils.session_store import session_store, InvalidSessionError
+from services.utils.usage_tracker import usage_tracker
+from services.utils.agent_metrics import agent_metrics
+from services.utils.connections_store import connections_table
 from services.utils.tools.app_manager import AppManager
 from services.bedrock_agent_service import BedrockAgent
 from services.connections_db_service import connections_bp
 from services.apps_sso_service import sso_service_bp
-import boto3
 import os
+import hmac
+import json
 
 app = Flask(__name__)
 
@@ -17,25 +24,59 @@ app.register_blueprint(sso_service_bp)
 
 CORS(app, supports_credentials=True, origins='*', allow_headers=["Content-Type", "Authorization"])
 
-dynamodb = boto3.resource('dynamodb', region_name=os.getenv('AWS_REGION', 'us-east-1'))
-table = dynamodb.Table('link-connections-table')
-
-app_manager = AppManager(table)
+app_manager = AppManager(connections_table)
 agent = BedrockAgent(app_manager)
 
+# Refresh provider tokens of active users in the background before they expire
+if os.getenv('PROACTIVE_TOKEN_REFRESH', 'true').lower() == 'true':
+    token_refresh_scheduler.start(app_manager.app_tools)
+
 @app.errorhandler(429)
 def ratelimit_handler(e):
-    return make_response(jsonify({
+    response = make_response(jsonify({
         "error": "Rate limit exceeded. Please wait and try again."
     }), 429)
+    if getattr(e, 'retry_after', None):
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
 
 @app.before_request
 def check_auth():
-    if request.path == '/generate' and request.method == 'POST':
+    if request.path in ('/generate', '/generate/stream') and request.method == 'POST':
         auth = request.headers.get('Authorization')
         if not auth or not auth.startswith('Bearer '):
             abort(401, 'Missing or invalid Authorization header')
 
+def get_request_tools(auth_header):
+    """Authenticate the request's user and return their tools, from the cache when possible"""
+    user_id = get_user_from_token(auth_header)
+    get_request_context().set_user(user_id, auth_header)
+    if usage_tracker.over_budget(user_id):
+        abort(429, retry_after=usage_tracker.retry_after(user_id))
+    tools = user_tools_cache.get_user_tools(user_id)
+    if tools is None:
+        tools = app_manager.get_user_tools(user_id)
+        user_tools_cache.set_user_tools(user_id, tools)
+    return tools
+
+def get_session(data, user_id):
+    """The request's session id, summary and stored turns, or Nones when the client sends its own history.
+
+    An empty session_id starts a new session; the id is returned with the answer.
+    """
+    if 'session_id' not in data:
+        return None, None, None
+    session_id = data['session_id'] or session_store.new_session_id()
+    summary, turns = session_store.get_session(user_id, session_id)
+    return session_id, summary, turns
+
+def save_session_turn(user_id, session_id):
+    turn = request_cached('agent_turn', lambda: None)
+    if turn:
+        session_store.append_turn(user_id, session_id, turn)
+        # Summarizing runs on a background thread, after the answer is ready
+        session_store.maybe_summarize(user_id, session_id, lambda summary, turns: agent.summarize_conversation(summary, turns, user_id))
+
 @app.route('/generate', methods=['POST', 'OPTIONS'])
 def generate():
     if request.method == 'OPTIONS':
@@ -48,25 +89,96 @@ def generate():
     
     data = request.json
     
+    auth_header = request.headers.get('Authorization')
+
     if data.get("reset"):
-        agent.current_persona = None
+        # Only the caller's own session is cleared; without a session id there is nothing stored
+        if data.get('session_id'):
+            try:
+                session_store.reset(get_user_from_token(auth_header), data['session_id'])
+            except InvalidSessionError as e:
+                return jsonify({'error': str(e)}), 400
         return jsonify({"message": "Persona reset"})
 
     user_message = data.get('prompt', '')
     conversation_history = data.get('history', [])
-    auth_header = request.headers.get('Authorization')
+    tools = get_request_tools(auth_header)
+    user_id = get_request_context().user_id
 
-    user_id = get_user_from_token(auth_header)
-    tools = user_tools_cache.get_user_tools(user_id)
-    if not tools:
-        tools = app_manager.get_user_tools(user_id)
-        user_tools_cache.set_user_tools(user_id, tools)
+    try:
+        session_id, summary, turns = get_session(data, user_id)
+    except InvalidSessionError as e:
+        return jsonify({'error': str(e)}), 400
 
     try:
-        result = agent.call_bedrock(user_message, conversation_history, auth_header, tools)
+        if session_id is None:
+            result = agent.call_bedrock(user_message, conversation_history, auth_header, tools)
+        else:
+            result = agent.call_bedrock(user_message, None, auth_header, tools, turns=turns, summary=summary)
+            save_session_turn(user_id, session_id)
+            result = {**result, 'session_id': session_id}
         response = jsonify(result)
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response
     except Exception as e:
         print(f"Error in generate endpoint: {e}")
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_stream():
+    """Server-sent events version of /generate: token, tool_start, tool_end and done events"""
+    data = request.json
+    user_message = data.get('prompt', '')
+    conversation_history = data.get('history', [])
+    auth_header = request.headers.get('Authorization')
+    tools = get_request_tools(auth_header)
+    user_id = get_request_context().user_id
+
+    try:
+        session_id, summary, turns = get_session(data, user_id)
+    except InvalidSessionError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def events():
+        try:
+            if session_id is None:
+                agent_events = agent.stream_bedrock(user_message, conversation_history, auth_header, tools)
+            else:
+                agent_events = agent.stream_bedrock(user_message, None, auth_header, tools, turns=turns, summary=summary)
+            for event in agent_events:
+                if event['type'] == 'done' and session_id is not None:
+                    save_session_turn(user_id, session_id)
+                    event = {**event, 'session_id': session_id}
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            print(f"Error in generate stream endpoint: {e}")
+            yield f"event: error\ndata: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Usage, cost and latency counters of this worker; needs METRICS_TOKEN as a bearer token"""
+    metrics_token = os.getenv('METRICS_TOKEN')
+    if not metrics_token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {metrics_token}'):
+        abort(401, 'Invalid metrics token')
+
+    user_id = request.args.get('user_id')
+    if user_id:
+        return jsonify({'user_id': user_id, 'usage': usage_tracker.user_snapshot(user_id)})
+
+    return jsonify({
+        'usage': usage_tracker.snapshot(),
+        'agent_paths': agent_metrics.snapshot(),
+        'intent_router': agent.intent_router.stats(),
+        'prefetch': agent.prefetcher.stats(),
+        'sessions': session_store.stats(),
+        'user_tools_cache': user_tools_cache.stats()
+    })
@@ -1,29 +1,90 @@
 import os
-import boto3
+import json
+import time
+import uuid
 from typing import List
+from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
 from dotenv import load_dotenv
-from services.utils.cognito_utils import get_user_from_token
+from services.utils.request_context import get_request_context, get_request_user_id, set_request_cached
+from services.utils.usage_tracker import usage_tracker
+from services.utils.aws_clients import LazyClient
+from services.utils.agent_metrics import agent_metrics, add_usage, AgentTrace
+from services.utils.tool_executor import tool_executor
+from services.utils.conversation import history_messages, pairs_to_turns
+from services.utils.tool_selector import ToolSelector, TOOL_PRUNING, MORE_TOOLS_NAME, context_text
+from services.utils.intent_router import IntentRouter, INTENT_ROUTING
+from services.utils.prefetch import Prefetcher, PREFETCH
 
 load_dotenv()
 
+# Bounds on the tool loop of a single turn
+AGENT_MAX_ITERATIONS = int(os.getenv('AGENT_MAX_ITERATIONS', 5))
+AGENT_DEADLINE_SECONDS = float(os.getenv('AGENT_DEADLINE_SECONDS', 45))
+AGENT_TOKEN_BUDGET = int(os.getenv('AGENT_TOKEN_BUDGET', 20000))
+
+SYSTEM_PROMPT = (
+    "You are Link, a personal assistant for the user's connected apps, such as Spotify and Gmail. "
+    "Use the available tools to act for the user, and answer clearly and concisely."
+)
+# Marks the end of a prefix Bedrock may serve from its prompt cache
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+LIMIT_REACHED_MESSAGE = "Sorry, I couldn't finish that request. Try asking for one thing at a time."
+# Streamed between the text of two model steps, e.g. a preamble before a tool call and the answer
+STEP_SEPARATOR = "\n\n"
+FORMAT_PROMPT = "Please format this response nicely. Don't mention that you are formatting anything"
+SUMMARY_PROMPT = (
+    "Update the summary of this conversation between a user and Link, their assistant for Spotify and Gmail. "
+    "Keep names, playlists, emails, decisions and open requests the user may refer back to. "
+    "Reply with the summary only, in at most {max_words} words."
+)
+# Upper bound on a rolling session summary
+SESSION_SUMMARY_MAX_TOKENS = int(os.getenv('SESSION_SUMMARY_MAX_TOKENS', 400))
+
 class BedrockAgent:
     def __init__(self, app_manager):
-        self.client = boto3.client('bedrock-runtime', region_name='us-east-1')
-        self.model_id = 'anthropic.claude-3-haiku-20240307-v1:0'
+        self.client = LazyClient('bedrock-runtime', region_name='us-east-1', read_timeout=60)
+        self.model_id = os.getenv('BEDROCK_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
         self.app_manager = app_manager
         self.bedrock_guardrail_id = os.getenv('BEDROCK_GUARD_RAIL_ID')
         self.bedrock_guardrail_version = os.getenv('BEDROCK_GUARD_RAIL_VERSION')
+        # Ask the model to reformat every answer in an extra converse call (previous behaviour)
+        self.format_pass = os.getenv('BEDROCK_FORMAT_PASS', 'false').lower() == 'true'
+        # Answer tools with a fixed output, like "Track added to playlist", without a second converse call
+        self.local_templates = os.getenv('LOCAL_TOOL_TEMPLATES', 'false').lower() == 'true'
+        # Checkpoint the tool specs and system prompt in Bedrock's prompt cache; the model must support caching
+        self.prompt_cache = os.getenv('BEDROCK_PROMPT_CACHE', 'false').lower() == 'true'
+        self.tool_pruning = TOOL_PRUNING
+        self.tool_selector = ToolSelector(app_manager.app_keywords())
+        self.intent_routing = INTENT_ROUTING
+        self.intent_router = IntentRouter(app_manager.intent_patterns())
+        self.prefetch = PREFETCH
+        self.prefetcher = Prefetcher(app_manager)
+        self.max_iterations = AGENT_MAX_ITERATIONS
+        self.deadline_seconds = AGENT_DEADLINE_SECONDS
+        self.token_budget = AGENT_TOKEN_BUDGET
+        self.tool_executor = tool_executor
 
-    def call_bedrock(self, prompt: str, conversation_history: List = None, auth_header: str = None, tools: List = None) -> str:
-        if conversation_history:
-            history_text = "\n".join([f"User: {msg['user']}\nAssistant: {msg['assistant']}" for msg in conversation_history[-5:]])
-            prompt = f"Previous conversation:\n{history_text}\n\nCurrent message: {prompt}"
+    def _request_body(self, messages, tools, system=None):
+        """Converse arguments, with the unchanging parts first: tools, then the system prompt.
 
-        messages = [{"role": "user", "content": [{"text": prompt}]}]
+        With prompt caching on, a cache point closes the tools and the static
+        system prompt, so per-turn text like the session summary (`system`) comes
+        after it and doesn't invalidate the cached prefix. Another one ends the
+        messages, so the next step of a tool loop, the format pass and the next
+        turn of a session read the conversation so far from the cache.
+        """
+        system_blocks = [{"text": SYSTEM_PROMPT}]
+        if self.prompt_cache:
+            system_blocks.append(CACHE_POINT)
+            # On a copy: the messages are also kept for the next step and the session
+            messages = messages[:-1] + [{**messages[-1], "content": messages[-1]["content"] + [CACHE_POINT]}]
+        if system:
+            system_blocks.append({"text": system})
 
         request_body = {
             "modelId": self.model_id,
             "messages": messages,
+            "system": system_blocks,
             "guardrailConfig": {
                 "guardrailIdentifier": self.bedrock_guardrail_id,
                 "guardrailVersion": self.bedrock_guardrail_version,
@@ -32,39 +93,363 @@ class BedrockAgent:
         }
 
         if tools:
-            request_body["toolConfig"] = {"tools": tools}
+            request_body["toolConfig"] = {"tools": tools + [CACHE_POINT] if self.prompt_cache else tools}
+        return request_body
 
-        response = self.client.converse(**request_body)
+    def _converse(self, messages, tools, usage, system=None):
+        response = self.client.converse(**self._request_body(messages, tools, system))
+        add_usage(usage, response)
+        return response
+
+    def _converse_stream(self, messages, tools, usage, system=None):
+        """Yield the text deltas of one converse_stream call and return the message like converse would"""
+        response = self.client.converse_stream(**self._request_body(messages, tools, system))
+        blocks = {}
+        stop_reason = None
+        metrics = {}
+
+        for event in response['stream']:
+            if 'contentBlockStart' in event:
+                start = event['contentBlockStart']['start']
+                if 'toolUse' in start:
+                    blocks[event['contentBlockStart']['contentBlockIndex']] = {'toolUse': {**start['toolUse'], 'input': ''}}
+            elif 'contentBlockDelta' in event:
+                index = event['contentBlockDelta']['contentBlockIndex']
+                delta = event['contentBlockDelta']['delta']
+                if 'text' in delta:
+                    blocks.setdefault(index, {'text': ''})['text'] += delta['text']
+                    yield delta['text']
+                elif 'toolUse' in delta:
+                    blocks[index]['toolUse']['input'] += delta['toolUse']['input']
+            elif 'messageStop' in event:
+                stop_reason = event['messageStop']['stopReason']
+            elif 'metadata' in event:
+                add_usage(usage, event['metadata'])
+                metrics = event['metadata'].get('metrics', metrics)
+
+        content = [blocks[index] for index in sorted(blocks)]
+        for block in content:
+            if 'toolUse' in block:
+                block['toolUse']['input'] = json.loads(block['toolUse']['input'] or '{}')
+        return {'output': {'message': {'role': 'assistant', 'content': content}}, 'stopReason': stop_reason, 'metrics': metrics}
+
+    def _initial_messages(self, prompt, conversation_history, turns=None):
+        """Earlier turns as alternating messages, trimmed to the history token budget, then the prompt.
+
+        `turns` are stored session turns; without them the client's history pairs are used.
+        """
+        if turns is None:
+            turns = pairs_to_turns(conversation_history)
+        messages = history_messages(turns)
+        messages.append({"role": "user", "content": [{"text": prompt}]})
+        return messages
+
+    def _call_tool(self, tool_use, user_id, prefetch=None):
+        """Run one toolUse block and return its toolResult block and its trace entry"""
+        start = time.perf_counter()
+        call = {'name': tool_use['name'], 'toolUseId': tool_use['toolUseId'], 'status': 'success'}
+        tool_result = {"toolUseId": tool_use['toolUseId']}
+        try:
+            prefetched = prefetch.take(tool_use['name'], tool_use['input']) if prefetch else None
+            if prefetched is not None:
+                call['prefetched'] = True
+                result = prefetched.result()
+            else:
+                result = self.app_manager.call_app_tool(tool_use['name'], tool_use['input'], user_id)
+            tool_result["content"] = [{"text": result}]
+        except Exception as e:
+            # Let the model see the failure and answer (or try something else) instead of failing the turn
+            print(f"Error calling {tool_use['name']}: {e}")
+            call['status'] = 'error'
+            tool_result["content"] = [{"text": f"Error: {e}"}]
+            tool_result["status"] = 'error'
+        call['latency_ms'] = round((time.perf_counter() - start) * 1000)
+        return tool_result, call
+
+    def _call_tools(self, tool_uses, user_id, step, trace, prefetch=None):
+        """Run all toolUse blocks of a step concurrently, yielding tool_start/tool_end events.
+
+        Returns the toolResult blocks in the order the model asked for them. Calls
+        still running, or still waiting for a per-user slot, at the turn's deadline
+        are answered with an error result.
+        """
+        futures = {}
+        submitted = {}
+        for index, tool_use in enumerate(tool_uses):
+            yield {'type': 'tool_start', 'name': tool_use['name'], 'toolUseId': tool_use['toolUseId'], 'step': step['step']}
+            try:
+                # Waiting for a free per-user slot counts against the turn's deadline too
+                future = self.tool_executor.submit(user_id, self._call_tool, tool_use, user_id, prefetch,
+                                                   timeout=max(self.deadline_seconds - trace.elapsed(), 0))
+            except FuturesTimeoutError:
+                continue
+            futures[future] = index
+            submitted[index] = future
 
-        message_content = response['output']['message']['content']
-        tool_use = next((c.get('toolUse') for c in message_content if 'toolUse' in c), None)
+        tool_results = [None] * len(tool_uses)
+        calls = [None] * len(tool_uses)
+        try:
+            for future in as_completed(futures, timeout=max(self.deadline_seconds - trace.elapsed(), 0)):
+                index = futures[future]
+                tool_results[index], calls[index] = future.result()
+                yield {'type': 'tool_end', 'name': calls[index]['name'], 'toolUseId': calls[index]['toolUseId'], 'step': step['step'],
+                       'status': calls[index]['status'], 'latency_ms': calls[index]['latency_ms']}
+        except FuturesTimeoutError:
+            pass
 
-        if tool_use:
-            tool_name = tool_use['name']
-            tool_args = tool_use['input']
-            user_id = get_user_from_token(auth_header)
+        for index, tool_use in enumerate(tool_uses):
+            if tool_results[index] is None:
+                if index in submitted:
+                    submitted[index].cancel()
+                tool_results[index] = {"toolUseId": tool_use['toolUseId'], "content": [{"text": "Error: timed out"}], "status": 'error'}
+                calls[index] = {'name': tool_use['name'], 'toolUseId': tool_use['toolUseId'], 'status': 'timeout',
+                                'latency_ms': round(trace.elapsed() * 1000)}
+                yield {'type': 'tool_end', 'name': tool_use['name'], 'toolUseId': tool_use['toolUseId'], 'step': step['step'],
+                       'status': 'timeout', 'latency_ms': calls[index]['latency_ms']}
 
-            tool_result = self.app_manager.call_app_tool(tool_name, tool_args, user_id)
+        step['tool_calls'].extend(calls)
+        return tool_results
+
+    def _run_route(self, route, auth_header, trace):
+        """Run the one tool a routed prompt needs, yielding its events.
+
+        Returns the toolUse and toolResult blocks and the locally formatted
+        answer, which is None when the model should answer after all.
+        """
+        tool_name, tool_args = route
+        tool_use = {'toolUseId': f"router-{uuid.uuid4().hex[:12]}", 'name': tool_name, 'input': tool_args}
+        yield {'type': 'tool_start', 'name': tool_name, 'toolUseId': tool_use['toolUseId'], 'step': 0}
+        tool_result, call = self._call_tool(tool_use, get_request_user_id(auth_header))
+        yield {'type': 'tool_end', 'name': tool_name, 'toolUseId': tool_use['toolUseId'], 'step': 0,
+               'status': call['status'], 'latency_ms': call['latency_ms']}
+        trace.route = call
+
+        completion = None
+        if call['status'] == 'success':
+            completion = self.app_manager.format_intent_result(tool_name, tool_args, tool_result['content'][0]['text'])
+        self.intent_router.record(tool_name, completion is not None)
+        return tool_use, tool_result, completion
+
+    def _start_streamed_part(self, streamed, part):
+        """Add a part of streamed text, yielding the separator token when text was streamed before it"""
+        if streamed:
+            yield {'type': 'token', 'text': STEP_SEPARATOR}
+        streamed.append(part)
+
+    def _end_model_call(self, trace, step, response, step_usage, usage, stage):
+        """Close a step's model call: trace it, add it to the turn's usage and account for it per user"""
+        step['stage'] = stage
+        trace.end_model_call(step, response, step_usage)
+        add_usage(usage, {'usage': step_usage})
+        context = get_request_context()
+        usage_tracker.record(context.user_id if context else None, stage, step_usage, step['bedrock_latency_ms'])
+
+    def _limit_reached(self, trace):
+        if len(trace.steps) > self.max_iterations:
+            return 'max_iterations'
+        if trace.elapsed() > self.deadline_seconds:
+            return 'deadline'
+        if trace.tokens() >= self.token_budget:
+            return 'token_budget'
+        return None
+
+    def _run(self, prompt, conversation_history, auth_header, tools, stream, turns=None, summary=None):
+        """Converse until the model stops asking for tools or a bound is hit, yielding events.
+
+        Each model step runs every toolUse block it returned concurrently and
+        sends all the results back in one message. Yields 'token' events (streaming only),
+        'tool_start' and 'tool_end' events, and finally a 'done' event. The turn's
+        messages, ending with the last step's answer, are left in the request cache
+        as 'agent_turn' for the session store.
+        """
+        trace = AgentTrace()
+        usage = {}
+        # Streamed text per model step (plus locally made answers), so steps can be told apart
+        streamed = []
+        first_token_at = None
+        messages = self._initial_messages(prompt, conversation_history, turns)
+        system = f"Summary of the earlier conversation:\n{summary}" if summary else None
+        turn_start = len(messages) - 1
+        completion = None
+        path = 'direct'
+
+        route = self.intent_router.match(prompt, tools) if self.intent_routing and tools else None
+        if route:
+            tool_use, tool_result, completion = yield from self._run_route(route, auth_header, trace)
+            # Kept either way: when the result can't be formatted locally the model answers
+            # from it instead of calling the provider again
             messages.append({"role": "assistant", "content": [{"toolUse": tool_use}]})
-            messages.append({
-                "role": "user",
-                "content": [{
-                    "toolResult": {
-                        "toolUseId": tool_use['toolUseId'],
-                        "content": [{"text": tool_result}]
-                    }
-                }]
-            })
-
-        messages.append({"role": "user", "content": [{"text": "Please format this response nicely. Don't mention that you are formatting anything"}]})
-        response = self.client.converse(
-            modelId=self.model_id, 
-            messages=messages, 
-            toolConfig={"tools": tools},
-            guardrailConfig={
-                "guardrailIdentifier": self.bedrock_guardrail_id,
-                "guardrailVersion": self.bedrock_guardrail_version,
-                "trace": "enabled"
-            })
+            messages.append({"role": "user", "content": [{"toolResult": tool_result}]})
+            if completion is not None:
+                path = 'router'
+                trace.stop_reason = 'router'
+            else:
+                path = 'tool'
+
+        prefetch = None
+        if self.prefetch and tools and completion is None:
+            # Runs while the first converse call is in flight
+            prefetch = self.prefetcher.start(prompt, tools, get_request_user_id(auth_header))
+
+        offered = tools
+        if self.tool_pruning and tools:
+            offered = self.tool_selector.select(prompt, context_text(messages[:turn_start]), tools)
+            if route and not any(tool['toolSpec']['name'] == route[0] for tool in offered):
+                # The conversation already holds a call of the routed tool
+                offered = [tool for tool in tools if tool['toolSpec']['name'] == route[0]] + offered
+            trace.tools = {'offered': len(offered), 'total': len(tools), 'fallback': False}
+
+        # A prompt answered by the intent router never reaches the model
+        while completion is None:
+            step = trace.start_step()
+            step_usage = {}
+            if stream:
+                model_stream = self._converse_stream(messages, offered, step_usage, system)
+                step_parts = []
+                while True:
+                    try:
+                        text = next(model_stream)
+                    except StopIteration as done:
+                        response = done.value
+                        break
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    if not step_parts:
+                        yield from self._start_streamed_part(streamed, step_parts)
+                    step_parts.append(text)
+                    yield {'type': 'token', 'text': text}
+            else:
+                response = self._converse(messages, offered, step_usage, system)
+            self._end_model_call(trace, step, response, step_usage, usage, 'tool_followup' if path == 'tool' else 'first')
+
+            content = response['output']['message']['content']
+            tool_uses = [c['toolUse'] for c in content if 'toolUse' in c]
+            if response.get('stopReason') != 'tool_use' or not tool_uses:
+                trace.stop_reason = response.get('stopReason')
+                break
+
+            limit = self._limit_reached(trace)
+            if limit:
+                # The model still wants tools but this turn is out of budget
+                trace.stop_reason = limit
+                text = self._text(content)
+                completion = f"{text}\n\n{LIMIT_REACHED_MESSAGE}" if text else LIMIT_REACHED_MESSAGE
+                break
+
+            if offered is not tools and any(tool_use['name'] == MORE_TOOLS_NAME for tool_use in tool_uses):
+                # The pruned set wasn't enough: drop this step and ask again with every tool
+                offered = tools
+                trace.tools['fallback'] = True
+                continue
+
+            path = 'tool'
+            user_id = get_request_user_id(auth_header)
+            tool_results = yield from self._call_tools(tool_uses, user_id, step, trace, prefetch)
+
+            messages.append({"role": "assistant", "content": content})
+            messages.append({"role": "user", "content": [{"toolResult": tool_result} for tool_result in tool_results]})
+
+            if self.local_templates and len(tool_uses) == 1 and not (self.format_pass and not stream):
+                tool_use = tool_uses[0]
+                completion = self.app_manager.render_tool_result(tool_use['name'], tool_use['input'], tool_results[0]['content'][0]['text'])
+                if completion is not None:
+                    path = 'template'
+                    trace.stop_reason = 'template'
+                    break
+
+        if prefetch is not None:
+            trace.prefetch = self.prefetcher.finish(prefetch)
+        turn_messages = messages[turn_start:]
+
+        if self.format_pass and not stream and completion is None:
+            messages.append({"role": "assistant", "content": content})
+            messages.append({"role": "user", "content": [{"text": FORMAT_PROMPT}]})
+            step = trace.start_step()
+            step_usage = {}
+            response = self._converse(messages, offered, step_usage, system)
+            self._end_model_call(trace, step, response, step_usage, usage, 'format')
+            content = response['output']['message']['content']
+            path += '_formatted'
+
+        if stream:
+            if completion is not None:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                if trace.stop_reason in ('template', 'router'):
+                    # A locally made answer follows any model text as a part of its own
+                    yield from self._start_streamed_part(streamed, [completion])
+                    yield {'type': 'token', 'text': completion}
+                else:
+                    # Limit notice: only the part the client hasn't seen of the last step's text is sent
+                    text = self._text(content)
+                    unsent = completion[len(text):]
+                    if text:
+                        streamed[-1].append(unsent)
+                    else:
+                        yield from self._start_streamed_part(streamed, [unsent])
+                    yield {'type': 'token', 'text': unsent}
+            else:
+                # Text of earlier steps (a preamble, or a step dropped by the tool fallback) isn't the answer
+                completion = self._text(content)
+            path = 'stream_' + path
+        elif completion is None:
+            completion = self._text(content)
+
+        if completion:
+            set_request_cached('agent_turn', turn_messages + [{"role": "assistant", "content": [{"text": completion}]}])
+
+        ttft_ms = (first_token_at - trace.start) * 1000 if first_token_at is not None else None
+        self._record(path, trace, usage, ttft_ms)
+        # Streaming clients get back exactly the text they were sent
+        yield {'type': 'done', 'completion': STEP_SEPARATOR.join(''.join(part) for part in streamed) if stream else completion}
+
+    def call_bedrock(self, prompt: str, conversation_history: List = None, auth_header: str = None, tools: List = None,
+                     turns: List = None, summary: str = None) -> str:
+        for event in self._run(prompt, conversation_history, auth_header, tools, stream=False, turns=turns, summary=summary):
+            pass
+        return {'completion': event['completion']}
+
+    def stream_bedrock(self, prompt: str, conversation_history: List = None, auth_header: str = None, tools: List = None,
+                       turns: List = None, summary: str = None):
+        """Like call_bedrock, but yield events as the answer is produced.
+
+        Events are dicts with a 'type' of 'token' (a text delta), 'tool_start',
+        'tool_end' or 'done' (the full completion). BEDROCK_FORMAT_PASS does not
+        apply: streamed text can't be reformatted after it has been sent.
+        """
+        return self._run(prompt, conversation_history, auth_header, tools, stream=True, turns=turns, summary=summary)
+
+    def summarize_conversation(self, summary: str, turns: List, user_id: str = None) -> str:
+        """Fold stored session turns into the previous rolling summary with one converse call.
+
+        Runs off the request path (see SessionStore.maybe_summarize), so it is
+        recorded under its own 'summary' metrics path.
+        """
+        start = time.perf_counter()
+        transcript = "\n".join(
+            f"{message['role'].capitalize()}: {self._text(message['content'])}"
+            for turn in turns for message in turn
+        )
+        previous = f"Current summary:\n{summary}\n\n" if summary else ""
+        prompt = SUMMARY_PROMPT.format(max_words=SESSION_SUMMARY_MAX_TOKENS * 3 // 4)
+        request_body = self._request_body([{"role": "user", "content": [{"text": f"{previous}New messages:\n{transcript}"}]}], None, prompt)
+        request_body["inferenceConfig"] = {"maxTokens": SESSION_SUMMARY_MAX_TOKENS}
+        response = self.client.converse(**request_body)
+        agent_metrics.record('summary', (time.perf_counter() - start) * 1000, response.get('usage'), converse_calls=1)
+        usage_tracker.record(user_id, 'summary', response.get('usage'), response.get('metrics', {}).get('latencyMs'))
+        return self._text(response['output']['message']['content'])
+
+    def _record(self, path, trace, usage, ttft_ms=None):
+        latency_ms = trace.elapsed() * 1000
+        converse_calls = len(trace.steps)
+        agent_metrics.record(path, latency_ms, usage, converse_calls, ttft_ms)
+        set_request_cached('agent_trace', trace.to_dict())
+        ttft = f" ttft_ms={ttft_ms:.0f}" if ttft_ms is not None else ""
+        print(f"Bedrock path={path} converse_calls={converse_calls} latency_ms={latency_ms:.0f}{ttft} "
+              f"input_tokens={usage.get('inputTokens', 0)} output_tokens={usage.get('outputTokens', 0)} "
+              f"cache_read_tokens={usage.get('cacheReadInputTokens', 0)} cache_write_tokens={usage.get('cacheWriteInputTokens', 0)} "
+              f"trace={json.dumps(trace.to_dict())}")
 
-        return {'completion': response['output']['message']['content'][0]['text']}
\ No newline at end of file
+    @staticmethod
+    def _text(content):
+        return "\n".join(c['text'] for c in content if 'text' in c)
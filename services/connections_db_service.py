@@ -1,24 +1,27 @@
 from flask import Blueprint, request, jsonify
 from services.utils.cognito_utils import get_user_from_token
-import boto3
 from botocore.exceptions import ClientError
 from datetime import datetime, timezone
 from services.utils.user_cache import user_tools_cache
+from services.utils.token_cache import provider_token_cache
 from services.utils.tool_utils import get_user_tools
-import os
+from services.utils.connections_store import get_connections_store, connections_table, ConcurrentUpdateError
 
 connections_bp = Blueprint('connections_bp', __name__)
 
-dynamodb = boto3.resource('dynamodb', region_name=os.getenv('AWS_REGION', 'us-east-1'))
-table = dynamodb.Table('link-connections-table')
+table = connections_table
+
+def refresh_user_tools(user_id, connected_apps):
+    """Replace the user's cached tools with the ones for their new set of connected apps"""
+    user_tools_cache.invalidate(user_id)
+    user_tools_cache.set_user_tools(user_id, get_user_tools(connected_apps))
 
 @connections_bp.route('/api/user/get_connections', methods=['GET'])
 def get_user_connections():
     user_id = get_user_from_token(request.headers.get('Authorization'))
     try:
-        response = table.get_item(Key={'userId': user_id})
-        connected_apps = response.get('Item', {}).get('connectedApps', [])
-        user_tools_cache.set_user_tools(user_id, get_user_tools(connected_apps))
+        connected_apps = get_connections_store(table).get_connected_apps(user_id)
+        refresh_user_tools(user_id, connected_apps)
         return jsonify(connected_apps)
     except Exception as e:
         print(e)
@@ -27,28 +30,21 @@ def get_user_connections():
 @connections_bp.route('/api/connect/<app_name>', methods=['POST'])
 def connect_app(app_name, auth_header, tokens=None):
     user_id = get_user_from_token(auth_header)
-
-    response = table.get_item(Key={'userId': user_id})
-    current_apps = response.get('Item', {}).get('connectedApps', [])
-    app_tokens = response.get('Item', {}).get('appTokens', {})
-
-    if app_name.lower() not in current_apps:
-        current_apps.append(app_name.lower())
+    app_name = app_name.lower()
 
     # Store tokens if provided
+    app_token = None
     if tokens:
-        app_tokens[app_name.lower()] = {
+        app_token = {
             'access_token': tokens.get('access_token'),
             'refresh_token': tokens.get('refresh_token'),
             'expires_at': int(datetime.now(timezone.utc).timestamp() + tokens.get('expires_in', 3600))
         }
 
-    table.put_item(Item={
-        'userId': user_id,
-        'connectedApps': current_apps,
-        'appTokens': app_tokens,
-        'updatedAt': datetime.now(timezone.utc).isoformat()
-    })
+    user_tools_cache.invalidate(user_id)
+    provider_token_cache.invalidate(user_id, app_name)
+    current_apps = get_connections_store(table).add_app(user_id, app_name, app_token)
+    refresh_user_tools(user_id, current_apps)
 
     return jsonify({'success': True})
 
@@ -57,21 +53,12 @@ def remove_app(app_name):
     user_id = get_user_from_token(request.headers.get('Authorization'))
     
     try:
-        # Get current connections
-        response = table.get_item(Key={'userId': user_id})
-        current_apps = response.get('Item', {}).get('connectedApps', [])
-        
-        # Remove app if connected
-        if app_name.lower() in current_apps:
-            current_apps.remove(app_name.lower())
-        
-        # Update DynamoDB
-        table.put_item(Item={
-            'userId': user_id,
-            'connectedApps': current_apps,
-            'updatedAt': datetime.now(timezone.utc).isoformat()
-        })
+        user_tools_cache.invalidate(user_id)
+        provider_token_cache.invalidate(user_id, app_name.lower())
+        current_apps = get_connections_store(table).remove_app(user_id, app_name.lower())
+        refresh_user_tools(user_id, current_apps)
         
         return jsonify({'success': True})
-    except ClientError as e:
-        return jsonify({'error': 'Failed to disconnect'}), 500
\ No newline at end of file
+    except (ClientError, ConcurrentUpdateError) as e:
+        print(f"Error in remove_app: {e}")
+        return jsonify({'error': 'Failed to disconnect'}), 500
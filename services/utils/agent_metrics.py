@@ -0,0 +1,132 @@
+import time
+import threading
+
+class AgentMetrics:
+    """Latency and token totals per response path of the Bedrock agent.
+
+    A path names how a turn was answered, e.g. 'direct' for a single converse
+    call or 'tool' for a tool call followed by one more converse call.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = {}
+
+    def record(self, path, latency_ms, usage=None, converse_calls=0, ttft_ms=None):
+        usage = usage or {}
+        with self.lock:
+            stats = self.paths.setdefault(path, {
+                'requests': 0,
+                'converse_calls': 0,
+                'latency_ms': 0.0,
+                'max_latency_ms': 0.0,
+                'input_tokens': 0,
+                'output_tokens': 0,
+                'cache_read_tokens': 0,
+                'cache_write_tokens': 0,
+                'streamed': 0,
+                'ttft_ms': 0.0
+            })
+            stats['requests'] += 1
+            stats['converse_calls'] += converse_calls
+            stats['latency_ms'] += latency_ms
+            stats['max_latency_ms'] = max(stats['max_latency_ms'], latency_ms)
+            stats['input_tokens'] += usage.get('inputTokens', 0)
+            stats['output_tokens'] += usage.get('outputTokens', 0)
+            stats['cache_read_tokens'] += usage.get('cacheReadInputTokens', 0)
+            stats['cache_write_tokens'] += usage.get('cacheWriteInputTokens', 0)
+            if ttft_ms is not None:
+                stats['streamed'] += 1
+                stats['ttft_ms'] += ttft_ms
+
+    def snapshot(self):
+        """Totals and per-request averages for each path"""
+        with self.lock:
+            snapshot = {}
+            for path, stats in self.paths.items():
+                requests = stats['requests']
+                # inputTokens only counts the uncached part of the prompt
+                prompt_tokens = stats['input_tokens'] + stats['cache_read_tokens'] + stats['cache_write_tokens']
+                snapshot[path] = {
+                    **stats,
+                    'avg_latency_ms': stats['latency_ms'] / requests,
+                    'avg_input_tokens': stats['input_tokens'] / requests,
+                    'avg_output_tokens': stats['output_tokens'] / requests,
+                    'cache_read_ratio': stats['cache_read_tokens'] / prompt_tokens if prompt_tokens else 0.0
+                }
+                if stats['streamed']:
+                    snapshot[path]['avg_ttft_ms'] = stats['ttft_ms'] / stats['streamed']
+            return snapshot
+
+    def clear(self):
+        with self.lock:
+            self.paths.clear()
+
+def add_usage(total, response):
+    """Add a converse response's token usage to a running total"""
+    for key, value in response.get('usage', {}).items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+class AgentTrace:
+    """Structured record of one agent turn: every model call, the tools it asked for and their latency"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.steps = []
+        self.stop_reason = None
+        # Tools offered after pruning, out of the user's total, and whether the model asked for the rest
+        self.tools = None
+        # The tool call of a prompt answered by the intent router
+        self.route = None
+        # Speculative tool calls started for the turn and how many the model used
+        self.prefetch = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def start_step(self):
+        step = {
+            'step': len(self.steps) + 1,
+            'model_latency_ms': 0,
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'cache_read_tokens': 0,
+            'cache_write_tokens': 0,
+            'bedrock_latency_ms': None,
+            'stop_reason': None,
+            'tool_calls': []
+        }
+        step['_start'] = time.perf_counter()
+        self.steps.append(step)
+        return step
+
+    def end_model_call(self, step, response, usage):
+        step['model_latency_ms'] = round((time.perf_counter() - step.pop('_start')) * 1000)
+        step['input_tokens'] = usage.get('inputTokens', 0)
+        step['output_tokens'] = usage.get('outputTokens', 0)
+        step['cache_read_tokens'] = usage.get('cacheReadInputTokens', 0)
+        step['cache_write_tokens'] = usage.get('cacheWriteInputTokens', 0)
+        # Bedrock's own latency for the call, without network and client time
+        step['bedrock_latency_ms'] = response.get('metrics', {}).get('latencyMs')
+        step['stop_reason'] = response.get('stopReason')
+
+    def tokens(self):
+        return sum(step['input_tokens'] + step['output_tokens'] for step in self.steps)
+
+    def to_dict(self):
+        trace = {
+            'stop_reason': self.stop_reason,
+            'latency_ms': round(self.elapsed() * 1000),
+            'tokens': self.tokens(),
+            'steps': self.steps
+        }
+        if self.tools is not None:
+            trace['tools'] = self.tools
+        if self.route is not None:
+            trace['route'] = self.route
+        if self.prefetch is not None:
+            trace['prefetch'] = self.prefetch
+        return trace
+
+agent_metrics = AgentMetrics()
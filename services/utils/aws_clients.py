@@ -0,0 +1,116 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
+
+# botocore settings shared by every client; per-service overrides go through get_client(**config)
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', 50))
+AWS_CONNECT_TIMEOUT = float(os.getenv('AWS_CONNECT_TIMEOUT', 2))
+AWS_READ_TIMEOUT = float(os.getenv('AWS_READ_TIMEOUT', 10))
+AWS_MAX_ATTEMPTS = int(os.getenv('AWS_MAX_ATTEMPTS', 3))
+
+class AWSClientFactory:
+    """Builds boto3 clients and resources on first use and reuses them.
+
+    boto3 sessions are not thread-safe, so creation is serialised behind a lock;
+    the clients themselves are safe to share between threads. A forked worker
+    starts with an empty cache so it never reuses its parent's connections.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.session = None
+        self.clients = {}
+        self.resources = {}
+        self.tables = {}
+        self.pid = os.getpid()
+
+    def _check_process(self):
+        if self.pid != os.getpid():
+            self.reset()
+
+    def _session(self):
+        if self.session is None:
+            self.session = boto3.session.Session()
+        return self.session
+
+    def config(self, **overrides):
+        settings = {
+            'max_pool_connections': AWS_MAX_POOL_CONNECTIONS,
+            'connect_timeout': AWS_CONNECT_TIMEOUT,
+            'read_timeout': AWS_READ_TIMEOUT,
+            'retries': {'max_attempts': AWS_MAX_ATTEMPTS, 'mode': 'standard'}
+        }
+        settings.update(overrides)
+        return Config(**settings)
+
+    def client(self, service_name, region_name=None, **config):
+        self._check_process()
+        key = (service_name, region_name or AWS_REGION, tuple(sorted(config.items())))
+        client = self.clients.get(key)
+        if client is None:
+            with self.lock:
+                client = self.clients.get(key)
+                if client is None:
+                    client = self._session().client(service_name, region_name=key[1], config=self.config(**config))
+                    self.clients[key] = client
+        return client
+
+    def resource(self, service_name, region_name=None):
+        self._check_process()
+        key = (service_name, region_name or AWS_REGION)
+        resource = self.resources.get(key)
+        if resource is None:
+            with self.lock:
+                resource = self.resources.get(key)
+                if resource is None:
+                    resource = self._session().resource(service_name, region_name=key[1], config=self.config())
+                    self.resources[key] = resource
+        return resource
+
+    def table(self, table_name, region_name=None):
+        self._check_process()
+        key = (table_name, region_name or AWS_REGION)
+        table = self.tables.get(key)
+        if table is None:
+            table = self.resource('dynamodb', region_name).Table(table_name)
+            self.tables[key] = table
+        return table
+
+class LazyClient:
+    """Stands in for a client until its first call"""
+
+    def __init__(self, service_name, region_name=None, **config):
+        self.service_name = service_name
+        self.region_name = region_name
+        self.config = config
+
+    def __getattr__(self, name):
+        return getattr(aws_clients.client(self.service_name, self.region_name, **self.config), name)
+
+class LazyTable:
+    """Stands in for a DynamoDB Table until its first call"""
+
+    def __init__(self, table_name, region_name=None):
+        self.table_name = table_name
+        self.region_name = region_name
+
+    def __getattr__(self, name):
+        return getattr(aws_clients.table(self.table_name, self.region_name), name)
+
+aws_clients = AWSClientFactory()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=aws_clients.reset)
+
+def get_client(service_name, region_name=None, **config):
+    """Shared client for a service, e.g. get_client('bedrock-runtime', read_timeout=60)"""
+    return aws_clients.client(service_name, region_name, **config)
+
+def get_table(table_name, region_name=None):
+    """DynamoDB Table that connects on first use"""
+    return LazyTable(table_name, region_name)
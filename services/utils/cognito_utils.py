@@ -1,25 +1,148 @@
-import boto3
+import os
+import time
+import threading
+import jwt
+import requests
 from flask import abort
 from botocore.exceptions import ClientError
+from services.utils.aws_clients import get_client
 
-def get_user_from_token(auth_header):
-    """Get user from Cognito using the access token"""
-    if not auth_header or not auth_header.startswith('Bearer '):
-        print("Error: Missing or invalid Authorization header")
-        abort(401, description="Missing token")
-    
-    access_token = auth_header.replace('Bearer ', '')
-    
+COGNITO_REGION = os.getenv('COGNITO_REGION', os.getenv('AWS_REGION', 'us-east-1'))
+COGNITO_USER_POOL_ID = os.getenv('COGNITO_USER_POOL_ID')
+COGNITO_APP_CLIENT_ID = os.getenv('COGNITO_APP_CLIENT_ID')
+
+# Minimum number of seconds between two JWKS downloads triggered by an unknown key id
+JWKS_REFRESH_INTERVAL = 60
+
+class JWKSUnavailableError(Exception):
+    """Raised when the signing keys cannot be downloaded from Cognito"""
+
+class CognitoJWKS:
+    """Caches the public signing keys of a Cognito user pool.
+
+    The key set is downloaded once and only fetched again when a token is signed
+    with a key id that is not in the cache (i.e. Cognito rotated its keys).
+    """
+
+    def __init__(self, jwks_url, refresh_interval=JWKS_REFRESH_INTERVAL):
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh_interval
+        self.keys = {}
+        self.last_fetched = None
+        self.lock = threading.Lock()
+
+    def _fetch(self):
+        try:
+            response = requests.get(self.jwks_url, timeout=5)
+        except requests.RequestException as e:
+            raise JWKSUnavailableError(str(e))
+
+        if response.status_code != 200:
+            raise JWKSUnavailableError(f"JWKS request failed: {response.status_code}")
+
+        self.keys = {
+            jwk['kid']: jwt.PyJWK(jwk).key
+            for jwk in response.json().get('keys', [])
+        }
+        self.last_fetched = time.monotonic()
+
+    def get_key(self, kid):
+        key = self.keys.get(kid)
+        if key is not None:
+            return key
+
+        with self.lock:
+            key = self.keys.get(kid)
+            if key is not None:
+                return key
+
+            # Unknown key id: refetch unless we just did, so garbage tokens can't hammer Cognito
+            recently_fetched = self.last_fetched is not None and time.monotonic() - self.last_fetched < self.refresh_interval
+            if not recently_fetched:
+                self._fetch()
+
+            return self.keys.get(kid)
+
+class CognitoTokenVerifier:
+    """Verifies Cognito access tokens locally against the user pool's JWKS"""
+
+    def __init__(self, user_pool_id, client_id, region=COGNITO_REGION, jwks=None):
+        if not client_id:
+            raise ValueError("An app client id is required to verify access tokens")
+        self.issuer = f"https://cognito-idp.{region}.amazonaws.com/{user_pool_id}"
+        self.client_id = client_id
+        self.jwks = jwks or CognitoJWKS(f"{self.issuer}/.well-known/jwks.json")
+
+    def verify(self, access_token):
+        """Return the claims of a valid access token, raise jwt.InvalidTokenError otherwise"""
+        kid = jwt.get_unverified_header(access_token).get('kid')
+        key = self.jwks.get_key(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key: {kid}")
+
+        claims = jwt.decode(
+            access_token,
+            key,
+            algorithms=['RS256'],
+            issuer=self.issuer,
+            options={'require': ['exp', 'iss', 'sub', 'client_id', 'token_use'], 'verify_aud': False}
+        )
+
+        if claims['token_use'] != 'access':
+            raise jwt.InvalidTokenError("Token is not an access token")
+
+        if claims['client_id'] != self.client_id:
+            raise jwt.InvalidTokenError("Token was issued for a different client")
+
+        return claims
+
+def create_token_verifier(user_pool_id=COGNITO_USER_POOL_ID, client_id=COGNITO_APP_CLIENT_ID):
+    """Local verifier for the configured user pool, or None to validate tokens through Cognito"""
+    if not user_pool_id:
+        return None
+    if not client_id:
+        print("Warning: COGNITO_APP_CLIENT_ID is not set, validating tokens through Cognito get_user instead of locally")
+        return None
+    return CognitoTokenVerifier(user_pool_id, client_id)
+
+token_verifier = create_token_verifier()
+
+def _get_user_from_cognito(access_token):
+    """Remote validation through Cognito's GetUser API"""
     try:
-        cognito = boto3.client('cognito-idp', region_name='us-east-1')
-        
+        cognito = get_client('cognito-idp', region_name=COGNITO_REGION)
+
         # Cognito validates the token and returns user info
         response = cognito.get_user(AccessToken=access_token)
-        
+
         # Get the user ID from the response
         user_id = response['Username']  # This is the Cognito user ID
         return user_id
-        
+
     except ClientError as e:
         print(e.response['Error']['Message'])
-        abort(401, description="Invalid token")
\ No newline at end of file
+        abort(401, description="Invalid token")
+
+def get_user_from_token(auth_header):
+    """Get user from the access token, verifying it locally when a user pool is configured"""
+    if not auth_header or not auth_header.startswith('Bearer '):
+        print("Error: Missing or invalid Authorization header")
+        abort(401, description="Missing token")
+
+    access_token = auth_header.replace('Bearer ', '')
+
+    if token_verifier is None:
+        return _get_user_from_cognito(access_token)
+
+    try:
+        claims = token_verifier.verify(access_token)
+    except JWKSUnavailableError as e:
+        # Keys can't be loaded right now, let Cognito validate the token instead
+        print(f"JWKS unavailable, falling back to Cognito get_user: {e}")
+        return _get_user_from_cognito(access_token)
+    except jwt.InvalidTokenError as e:
+        print(f"Invalid access token: {e}")
+        abort(401, description="Invalid token")
+
+    # Access tokens carry the same value that get_user returns as Username
+    return claims.get('username') or claims['sub']
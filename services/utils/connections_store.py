@@ -0,0 +1,405 @@
+import os
+from datetime import datetime, timezone
+from boto3.dynamodb.types import TypeDeserializer
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from services.utils.aws_clients import get_table
+from services.utils.request_context import request_cached, set_request_cached, clear_request_cached
+
+# 'per_user' keeps one item per user in link-connections-table, 'per_app' stores
+# one item per (userId, appName) in APP_CONNECTIONS_TABLE
+CONNECTIONS_TABLE_LAYOUT = os.getenv('CONNECTIONS_TABLE_LAYOUT', 'per_user')
+APP_CONNECTIONS_TABLE = os.getenv('APP_CONNECTIONS_TABLE', 'link-app-connections-table')
+
+connections_table = get_table('link-connections-table')
+app_connections_table = get_table(APP_CONNECTIONS_TABLE)
+
+# Conditional writes retried before giving up on a heavily contended item
+MAX_WRITE_ATTEMPTS = 5
+
+deserializer = TypeDeserializer()
+
+class ConcurrentUpdateError(Exception):
+    """Raised when a conditional write keeps losing to concurrent writers"""
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def _error_code(error):
+    return error.response.get('Error', {}).get('Code')
+
+def _old_item(error):
+    """The item as it was when a conditional write failed (ReturnValuesOnConditionCheckFailure=ALL_OLD)"""
+    raw_item = error.response.get('Item') or {}
+    return {key: deserializer.deserialize(value) for key, value in raw_item.items()}
+
+class UserItemStore:
+    """Original layout: one item per user holding connectedApps and every app's tokens"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def get_connected_apps(self, user_id):
+        """Read only connectedApps, leaving every app's tokens in the table"""
+        def load():
+            response = self.table.get_item(Key={'userId': user_id}, ProjectionExpression='connectedApps')
+            return response.get('Item', {}).get('connectedApps', [])
+
+        return request_cached(('connected_apps', user_id), load)
+
+    def get_app_tokens(self, user_id, app_name):
+        """Read only this app's token map"""
+        return request_cached(('app_tokens', user_id, app_name), lambda: self._read_app_tokens(user_id, app_name))
+
+    def get_app_tokens_consistent(self, user_id, app_name):
+        return self._read_app_tokens(user_id, app_name, consistent=True)
+
+    def _read_app_tokens(self, user_id, app_name, consistent=False):
+        response = self.table.get_item(
+            Key={'userId': user_id},
+            ProjectionExpression='appTokens.#app',
+            ExpressionAttributeNames={'#app': app_name},
+            ConsistentRead=consistent
+        )
+        return response.get('Item', {}).get('appTokens', {}).get(app_name)
+
+    def _clear_cached(self, user_id, app_name):
+        clear_request_cached(('connected_apps', user_id))
+        clear_request_cached(('app_tokens', user_id, app_name))
+
+    def add_app(self, user_id, app_name, app_token=None):
+        """Add an app and its tokens to the user's item and return the connected apps.
+
+        Normally a single conditional update_item. If the item isn't in the shape we
+        assumed (app already connected, no appTokens map yet) the write is retried
+        against the state DynamoDB reports back.
+        """
+        state = None
+        has_token_map = True
+
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            already_connected = state is not None and app_name in state.get('connectedApps', [])
+            if state is not None:
+                has_token_map = 'appTokens' in state
+
+            set_clauses = ['updatedAt = :now', 'version = if_not_exists(version, :zero) + :one']
+            names = {}
+            values = {':now': _now(), ':zero': 0, ':one': 1, ':app': app_name}
+
+            if already_connected:
+                condition = 'contains(connectedApps, :app)'
+            else:
+                set_clauses.append('connectedApps = list_append(if_not_exists(connectedApps, :empty), :app_list)')
+                values.update({':empty': [], ':app_list': [app_name]})
+                condition = 'NOT contains(connectedApps, :app)'
+
+            if app_token is not None:
+                if has_token_map:
+                    set_clauses.append('appTokens.#app = :token')
+                    names['#app'] = app_name
+                    values[':token'] = app_token
+                else:
+                    set_clauses.append('appTokens = :token_map')
+                    values[':token_map'] = {app_name: app_token}
+                    condition += ' AND attribute_not_exists(appTokens)'
+
+            request = {
+                'Key': {'userId': user_id},
+                'UpdateExpression': 'SET ' + ', '.join(set_clauses),
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': values,
+                'ReturnValues': 'UPDATED_NEW',
+                'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+            }
+            if names:
+                request['ExpressionAttributeNames'] = names
+
+            try:
+                attributes = self.table.update_item(**request)['Attributes']
+                self._clear_cached(user_id, app_name)
+                return attributes['connectedApps'] if 'connectedApps' in attributes else state['connectedApps']
+            except ClientError as e:
+                if _error_code(e) == 'ConditionalCheckFailedException':
+                    state = _old_item(e)
+                elif _error_code(e) == 'ValidationException' and has_token_map and app_token is not None:
+                    # appTokens.<app> can't be set while the item has no appTokens map
+                    state, has_token_map = None, False
+                else:
+                    raise
+
+        raise ConcurrentUpdateError(f"Could not connect {app_name} for {user_id}")
+
+    def remove_app(self, user_id, app_name):
+        """Remove an app and its tokens from the user's item and return the connected apps.
+
+        The list index of the app has to be known to remove it, so this reads the
+        connections and then writes conditioned on the item's version, retrying
+        with the item returned by a failed condition check.
+        """
+        response = self.table.get_item(
+            Key={'userId': user_id},
+            ProjectionExpression='connectedApps, version, appTokens.#app',
+            ExpressionAttributeNames={'#app': app_name}
+        )
+        state = response.get('Item', {})
+
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            current_apps = state.get('connectedApps', [])
+            has_token = app_name in state.get('appTokens', {})
+            if app_name not in current_apps and not has_token:
+                return current_apps
+
+            remove_paths = []
+            names = {}
+            if app_name in current_apps:
+                remove_paths.append(f'connectedApps[{current_apps.index(app_name)}]')
+            if has_token:
+                remove_paths.append('appTokens.#app')
+                names['#app'] = app_name
+
+            version = state.get('version')
+            values = {':now': _now(), ':next_version': (version or 0) + 1}
+            if version is None:
+                condition = 'attribute_not_exists(version)'
+            else:
+                condition = 'version = :version'
+                values[':version'] = version
+
+            request = {
+                'Key': {'userId': user_id},
+                'UpdateExpression': f"REMOVE {', '.join(remove_paths)} SET updatedAt = :now, version = :next_version",
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': values,
+                'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+            }
+            if names:
+                request['ExpressionAttributeNames'] = names
+
+            try:
+                self.table.update_item(**request)
+                self._clear_cached(user_id, app_name)
+                return [app for app in current_apps if app != app_name]
+            except ClientError as e:
+                if _error_code(e) != 'ConditionalCheckFailedException':
+                    raise
+                state = _old_item(e)
+
+        raise ConcurrentUpdateError(f"Could not remove {app_name} for {user_id}")
+
+    def store_refreshed_tokens(self, user_id, app_name, app_tokens, stale_access_token):
+        """Write only this app's token map if the stale token is still the stored one.
+
+        Returns the update_item response, or None when another writer got there first.
+        """
+        try:
+            response = self.table.update_item(
+                Key={'userId': user_id},
+                UpdateExpression='SET appTokens.#svc = :tokens',
+                ConditionExpression='appTokens.#svc.access_token = :stale_token',
+                ExpressionAttributeNames={'#svc': app_name},
+                ExpressionAttributeValues={':tokens': app_tokens, ':stale_token': stale_access_token},
+                ReturnConsumedCapacity='TOTAL'
+            )
+        except ClientError as e:
+            if _error_code(e) != 'ConditionalCheckFailedException':
+                raise
+            return None
+
+        set_request_cached(('app_tokens', user_id, app_name), app_tokens)
+        return response
+
+    def acquire_refresh_lock(self, lock, user_id, app_name):
+        return lock.acquire(self.table, {'userId': user_id}, f'lock_{app_name}')
+
+    def release_refresh_lock(self, lock, user_id, app_name, lease_id):
+        lock.release(self.table, {'userId': user_id}, f'lock_{app_name}', lease_id)
+
+    def get_refresh_state(self, lock, user_id, app_name):
+        """Consistent read of only this app's tokens and refresh lock: (tokens, lock still held)"""
+        item = self.table.get_item(
+            Key={'userId': user_id},
+            ProjectionExpression='appTokens.#app, #lock',
+            ExpressionAttributeNames={'#app': app_name, '#lock': f'lock_{app_name}'},
+            ConsistentRead=True
+        ).get('Item', {})
+        return item.get('appTokens', {}).get(app_name), lock.is_held(item.get(f'lock_{app_name}'))
+
+class AppItemStore:
+    """Per-app layout: partition key userId, sort key appName, one small item per connected app.
+
+    Reads fetch only the rows they need and connect, remove and refresh only
+    touch their own row. Users still stored in the original layout are
+    migrated the first time they are looked up (see migrate_user).
+    """
+
+    def __init__(self, table, legacy_store=None):
+        self.table = table
+        self.legacy_store = legacy_store
+
+    def _query_apps(self, user_id, consistent=False):
+        apps = []
+        request = {
+            'KeyConditionExpression': Key('userId').eq(user_id),
+            'ProjectionExpression': 'appName',
+            'ConsistentRead': consistent
+        }
+        while True:
+            response = self.table.query(**request)
+            apps.extend(item['appName'] for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return apps
+            request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def get_connected_apps(self, user_id):
+        def load():
+            apps = self._query_apps(user_id)
+            if not apps and self.migrate_user(user_id):
+                apps = self._query_apps(user_id, consistent=True)
+            return apps
+
+        return request_cached(('connected_apps', user_id), load)
+
+    def get_app_tokens(self, user_id, app_name):
+        def load():
+            item = self._get_row(user_id, app_name)
+            if item is None and self.migrate_user(user_id):
+                item = self._get_row(user_id, app_name, consistent=True)
+            return item.get('tokens') if item else None
+
+        return request_cached(('app_tokens', user_id, app_name), load)
+
+    def get_app_tokens_consistent(self, user_id, app_name):
+        item = self._get_row(user_id, app_name, consistent=True)
+        return item.get('tokens') if item else None
+
+    def _get_row(self, user_id, app_name, consistent=False):
+        # appName is projected too so an existing row without tokens still reads as found
+        return self.table.get_item(
+            Key={'userId': user_id, 'appName': app_name},
+            ProjectionExpression='appName, tokens',
+            ConsistentRead=consistent
+        ).get('Item')
+
+    def add_app(self, user_id, app_name, app_token=None):
+        self.migrate_user(user_id)
+
+        values = {':now': _now()}
+        update_expression = 'SET updatedAt = :now'
+        if app_token is not None:
+            update_expression += ', tokens = :tokens'
+            values[':tokens'] = app_token
+
+        self.table.update_item(
+            Key={'userId': user_id, 'appName': app_name},
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=values
+        )
+        if app_token is not None:
+            set_request_cached(('app_tokens', user_id, app_name), app_token)
+        return self._connected_apps_after_write(user_id)
+
+    def remove_app(self, user_id, app_name):
+        self.migrate_user(user_id)
+        self.table.delete_item(Key={'userId': user_id, 'appName': app_name})
+        set_request_cached(('app_tokens', user_id, app_name), None)
+        return self._connected_apps_after_write(user_id)
+
+    def _connected_apps_after_write(self, user_id):
+        apps = self._query_apps(user_id, consistent=True)
+        set_request_cached(('connected_apps', user_id), apps)
+        return apps
+
+    def store_refreshed_tokens(self, user_id, app_name, app_tokens, stale_access_token):
+        """Write the app's new tokens if the stale token is still the stored one.
+
+        Returns the update_item response, or None when another writer got there first.
+        """
+        try:
+            response = self.table.update_item(
+                Key={'userId': user_id, 'appName': app_name},
+                UpdateExpression='SET tokens = :tokens, updatedAt = :now',
+                ConditionExpression='tokens.access_token = :stale_token',
+                ExpressionAttributeValues={':tokens': app_tokens, ':stale_token': stale_access_token, ':now': _now()},
+                ReturnConsumedCapacity='TOTAL'
+            )
+        except ClientError as e:
+            if _error_code(e) != 'ConditionalCheckFailedException':
+                raise
+            return None
+
+        set_request_cached(('app_tokens', user_id, app_name), app_tokens)
+        return response
+
+    def acquire_refresh_lock(self, lock, user_id, app_name):
+        return lock.acquire(self.table, {'userId': user_id, 'appName': app_name}, 'refreshLock')
+
+    def release_refresh_lock(self, lock, user_id, app_name, lease_id):
+        lock.release(self.table, {'userId': user_id, 'appName': app_name}, 'refreshLock', lease_id)
+
+    def get_refresh_state(self, lock, user_id, app_name):
+        """Consistent read of the app row's tokens and refresh lock: (tokens, lock still held)"""
+        item = self.table.get_item(
+            Key={'userId': user_id, 'appName': app_name},
+            ProjectionExpression='tokens, refreshLock',
+            ConsistentRead=True
+        ).get('Item', {})
+        return item.get('tokens'), lock.is_held(item.get('refreshLock'))
+
+    def migrate_user(self, user_id):
+        """Copy a user's item from the original layout into per-app rows.
+
+        Rows that already exist are never overwritten, and the original item is
+        flagged so it is only migrated once. Returns True if anything was copied.
+        """
+        if self.legacy_store is None:
+            return False
+
+        legacy_table = self.legacy_store.table
+        # Runs on every connect, remove and empty lookup: check the flag without reading the user's tokens.
+        # The flag is only ever set, so a stale read at worst falls through to the full read below
+        flag = legacy_table.get_item(Key={'userId': user_id}, ProjectionExpression='userId, migratedToPerApp').get('Item')
+        if not flag or flag.get('migratedToPerApp'):
+            return False
+
+        item = legacy_table.get_item(Key={'userId': user_id}, ConsistentRead=True).get('Item')
+        if not item or item.get('migratedToPerApp'):
+            return False
+
+        app_tokens = item.get('appTokens', {})
+        for app_name in item.get('connectedApps', []):
+            row = {'userId': user_id, 'appName': app_name, 'updatedAt': item.get('updatedAt', _now())}
+            if app_name in app_tokens:
+                row['tokens'] = app_tokens[app_name]
+            try:
+                self.table.put_item(Item=row, ConditionExpression='attribute_not_exists(appName)')
+            except ClientError as e:
+                if _error_code(e) != 'ConditionalCheckFailedException':
+                    raise
+
+        legacy_table.update_item(
+            Key={'userId': user_id},
+            UpdateExpression='SET migratedToPerApp = :now',
+            ExpressionAttributeValues={':now': _now()}
+        )
+        return bool(item.get('connectedApps'))
+
+def migrate_all_users(app_store):
+    """Migrate every user of the original table, e.g. before switching CONNECTIONS_TABLE_LAYOUT"""
+    legacy_table = app_store.legacy_store.table
+    migrated = 0
+    request = {'ProjectionExpression': 'userId'}
+    while True:
+        response = legacy_table.scan(**request)
+        for item in response.get('Items', []):
+            migrated += app_store.migrate_user(item['userId'])
+        if 'LastEvaluatedKey' not in response:
+            return migrated
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def get_connections_store(table=None):
+    """Store for the configured layout, with `table` as the original link-connections-table"""
+    if table is None:
+        table = connections_table
+    if CONNECTIONS_TABLE_LAYOUT != 'per_app':
+        return UserItemStore(table)
+    return AppItemStore(app_connections_table, legacy_store=UserItemStore(table))
@@ -0,0 +1,120 @@
+import os
+import json
+
+# Estimated tokens of earlier turns sent with each prompt, and the most any one message may use
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', 1000))
+HISTORY_MAX_MESSAGE_TOKENS = int(os.getenv('HISTORY_MAX_MESSAGE_TOKENS', 300))
+
+# Rough average for English text; only used to budget, never to bill
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# compact_turn stores tool results as text starting with one of these
+TOOL_RESULT_LABELS = ('[Tool result]', '[Tool error]')
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def truncate_text(text, max_tokens):
+    """Keep the start and end of a long text, with a marker saying how much was cut"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+
+    head = max_chars * 2 // 3
+    tail = max_chars - head
+    return f"{text[:head]}\n[... {len(text) - head - tail} characters truncated ...]\n{text[len(text) - tail:]}"
+
+def _block_texts(block):
+    if 'text' in block:
+        yield block['text']
+    elif 'toolResult' in block:
+        for item in block['toolResult'].get('content', []):
+            if 'text' in item:
+                yield item['text']
+    elif 'toolUse' in block:
+        yield str(block['toolUse'].get('input', ''))
+
+def message_tokens(message):
+    return MESSAGE_OVERHEAD_TOKENS + sum(estimate_tokens(text) for block in message['content'] for text in _block_texts(block))
+
+def truncate_message(message, max_tokens):
+    """Copy of a message with every long text, including tool results, truncated"""
+    content = []
+    for block in message['content']:
+        if 'text' in block:
+            block = {**block, 'text': truncate_text(block['text'], max_tokens)}
+        elif 'toolResult' in block:
+            tool_result = block['toolResult']
+            block = {'toolResult': {
+                **tool_result,
+                'content': [
+                    {**item, 'text': truncate_text(item['text'], max_tokens)} if 'text' in item else item
+                    for item in tool_result.get('content', [])
+                ]
+            }}
+        content.append(block)
+    return {**message, 'content': content}
+
+def pairs_to_turns(conversation_history):
+    """Turns from the client's [{'user': ..., 'assistant': ...}] history, each a user and an assistant message"""
+    turns = []
+    for entry in conversation_history or []:
+        user_text = entry.get('user')
+        assistant_text = entry.get('assistant')
+        # Bedrock rejects empty text blocks, and a turn without an answer can't alternate
+        if not user_text or not assistant_text:
+            continue
+        turns.append([
+            {'role': 'user', 'content': [{'text': user_text}]},
+            {'role': 'assistant', 'content': [{'text': assistant_text}]}
+        ])
+    return turns
+
+def history_messages(turns, token_budget=None, max_message_tokens=None):
+    """The most recent turns that fit in the token budget, flattened into alternating messages.
+
+    Each turn starts with a user message and ends with an assistant message, so
+    whole turns are kept or dropped together. Long messages are truncated first.
+    """
+    token_budget = HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+    max_message_tokens = HISTORY_MAX_MESSAGE_TOKENS if max_message_tokens is None else max_message_tokens
+
+    selected = []
+    used = 0
+    for turn in reversed(turns):
+        turn = [truncate_message(message, max_message_tokens) for message in turn]
+        cost = sum(message_tokens(message) for message in turn)
+        if used + cost > token_budget:
+            break
+        selected.append(turn)
+        used += cost
+
+    return [message for turn in reversed(selected) for message in turn]
+
+def _flatten_block(block):
+    if 'toolUse' in block:
+        tool_use = block['toolUse']
+        return {'text': f"[Called {tool_use['name']} with {json.dumps(tool_use.get('input', {}))}]"}
+    if 'toolResult' in block:
+        tool_result = block['toolResult']
+        text = "\n".join(item['text'] for item in tool_result.get('content', []) if 'text' in item)
+        label = TOOL_RESULT_LABELS[1] if tool_result.get('status') == 'error' else TOOL_RESULT_LABELS[0]
+        return {'text': f"{label}\n{text}"}
+    return block
+
+def is_tool_result_text(text):
+    return text.startswith(TOOL_RESULT_LABELS)
+
+def compact_turn(messages, max_message_tokens=None):
+    """A finished turn as text-only messages, ready to be stored and sent back as history.
+
+    toolUse and toolResult blocks become text, so earlier tool results stay in
+    context without the request needing a toolConfig for tools the user may
+    no longer have, and every message is truncated to the per-message budget.
+    """
+    max_message_tokens = HISTORY_MAX_MESSAGE_TOKENS if max_message_tokens is None else max_message_tokens
+    return [
+        truncate_message({'role': message['role'], 'content': [_flatten_block(block) for block in message['content']]}, max_message_tokens)
+        for message in messages
+    ]
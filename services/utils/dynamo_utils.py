@@ -0,0 +1,23 @@
+from decimal import Decimal
+
+def estimate_size(value):
+    """Approximate the number of bytes DynamoDB bills for a value.
+
+    Follows the published sizing rules: strings and binary by length, numbers
+    by significant digits, and 3 bytes of overhead per map or list plus 1 per
+    element. Map keys count like attribute names.
+    """
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (int, float, Decimal)):
+        digits = len(Decimal(str(value)).normalize().as_tuple().digits)
+        return (digits + 1) // 2 + 1
+    if isinstance(value, dict):
+        return 3 + sum(estimate_size(k) + estimate_size(v) + 1 for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 3 + sum(estimate_size(v) + 1 for v in value)
+    return len(str(value).encode('utf-8'))
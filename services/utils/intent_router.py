@@ -0,0 +1,97 @@
+import os
+import re
+import threading
+from services.utils.agent_metrics import agent_metrics
+
+# Answer prompts that map onto a single tool without calling the model
+INTENT_ROUTING = os.getenv('INTENT_ROUTING', 'false').lower() == 'true'
+
+NUMBER_WORDS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10}
+# Largest count a routed prompt may ask for, e.g. "show my last 50 emails" goes to the model
+MAX_ROUTED_RESULTS = 20
+
+POLITE_PREFIX = re.compile(r'^(?:(?:hey|hi|ok|okay) )?(?:link )?(?:please |can you |could you |would you |will you )*')
+POLITE_SUFFIX = re.compile(r'(?: (?:please|thanks|thank you|for me|now))+$')
+
+def normalize(prompt):
+    text = prompt.lower().replace("'", "").replace("’", "")
+    text = re.sub(r'[^a-z0-9]+', ' ', text).strip()
+    text = POLITE_PREFIX.sub('', text)
+    return POLITE_SUFFIX.sub('', text).strip()
+
+def _argument(value):
+    if value.isdigit():
+        return int(value)
+    return NUMBER_WORDS.get(value, value)
+
+class IntentRouter:
+    """Maps prompts like "list my playlists" straight onto one tool call.
+
+    Only prompts that a pattern matches in full (after dropping politeness
+    like "please" or "can you") are routed, and only to tools the user has.
+    Anything else, or a tool result the app can't format, goes to the model.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = {
+            tool_name: [re.compile(pattern) for pattern in tool_patterns]
+            for tool_name, tool_patterns in patterns.items()
+        }
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.fallthroughs = 0
+        self.routes = {}
+
+    def match(self, prompt, tools):
+        """(tool name, tool arguments) for a prompt the router can answer, or None"""
+        with self.lock:
+            self.requests += 1
+
+        text = normalize(prompt)
+        names = {tool['toolSpec']['name'] for tool in tools}
+        for tool_name, patterns in self.patterns.items():
+            if tool_name not in names:
+                continue
+            for pattern in patterns:
+                match = pattern.fullmatch(text)
+                if match is None:
+                    continue
+                args = {key: _argument(value) for key, value in match.groupdict().items() if value is not None}
+                if any(isinstance(value, int) and not 0 < value <= MAX_ROUTED_RESULTS for value in args.values()):
+                    return None
+                return tool_name, args
+        return None
+
+    def record(self, tool_name, answered):
+        """Count a routed prompt: answered locally, or handed to the model after the tool ran"""
+        with self.lock:
+            route = self.routes.setdefault(tool_name, {'hits': 0, 'fallthroughs': 0})
+            if answered:
+                self.hits += 1
+                route['hits'] += 1
+            else:
+                self.fallthroughs += 1
+                route['fallthroughs'] += 1
+
+    def stats(self):
+        """Hit rate, and the latency saved per hit compared with a model-answered tool turn"""
+        paths = agent_metrics.snapshot()
+        with self.lock:
+            stats = {
+                'requests': self.requests,
+                'hits': self.hits,
+                'fallthroughs': self.fallthroughs,
+                'hit_rate': self.hits / self.requests if self.requests else 0.0,
+                'routes': {tool_name: dict(route) for tool_name, route in self.routes.items()}
+            }
+        for prefix in ('', 'stream_'):
+            routed, tool = paths.get(f'{prefix}router'), paths.get(f'{prefix}tool')
+            if routed and tool:
+                stats[f'{prefix}saved_ms_per_hit'] = tool['avg_latency_ms'] - routed['avg_latency_ms']
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.requests = self.hits = self.fallthroughs = 0
+            self.routes = {}
@@ -0,0 +1,124 @@
+import os
+import json
+import threading
+from services.utils.tool_executor import tool_executor
+from services.utils.tool_selector import terms
+
+# Start likely tool calls while the first converse call is in flight
+PREFETCH = os.getenv('PREFETCH', 'false').lower() == 'true'
+# Most speculative calls one turn may start, provider token loads included
+PREFETCH_MAX_CALLS = int(os.getenv('PREFETCH_MAX_CALLS', 2))
+
+def _key(tool_name, tool_args):
+    return tool_name, json.dumps(tool_args or {}, sort_keys=True)
+
+class Prefetch:
+    """The speculative calls of one turn, keyed by tool name and arguments"""
+
+    def __init__(self):
+        self.futures = {}
+        self.used = set()
+        self.lock = threading.Lock()
+
+    def take(self, tool_name, tool_args):
+        """The prefetched call for exactly this tool call, or None"""
+        app = tool_name.split('_')[0]
+        key = _key(tool_name, tool_args)
+        with self.lock:
+            # A tool call of the app used the token a header warm-up loaded
+            if ('headers', app) in self.futures:
+                self.used.add(('headers', app))
+            future = self.futures.get(key)
+            if future is None or future.cancelled():
+                return None
+            self.used.add(key)
+            return future
+
+    def cancel(self):
+        """Cancel the calls that haven't started; returns how many were cancelled"""
+        with self.lock:
+            return sum(1 for key, future in self.futures.items() if key not in self.used and future.cancel())
+
+class Prefetcher:
+    """Guesses the tool data a prompt will need and loads it while the model thinks.
+
+    A read-only tool in an app's prefetch_rules is called when the prompt uses
+    one of its words, e.g. the user's playlists when "playlist" is mentioned.
+    For other apps the prompt mentions (AppTool.keywords), only the provider
+    token is loaded. Calls go through the tool executor without waiting for a
+    free per-user slot, at most max_calls per turn, and the ones the model
+    didn't ask for are cancelled or counted as wasted when the turn ends.
+    """
+
+    def __init__(self, app_manager, executor=None, max_calls=PREFETCH_MAX_CALLS):
+        self.app_manager = app_manager
+        self.executor = executor or tool_executor
+        self.max_calls = max_calls
+        self.rules = {
+            tool_name: (terms(' '.join(words)), args)
+            for tool_name, (words, args) in app_manager.prefetch_rules().items()
+        }
+        self.app_terms = {app: terms(' '.join(words)) for app, words in app_manager.app_keywords().items()}
+        self.lock = threading.Lock()
+        self.counts = {'turns': 0, 'started': 0, 'used': 0, 'wasted': 0, 'cancelled': 0, 'over_budget': 0}
+
+    def predict(self, prompt, tools):
+        """(tool name, arguments) calls worth making for a prompt; ('headers', app) loads only a token"""
+        prompt_terms = terms(prompt)
+        names = {tool['toolSpec']['name'] for tool in tools}
+        calls = [
+            (tool_name, args) for tool_name, (words, args) in self.rules.items()
+            if tool_name in names and prompt_terms & words
+        ]
+        apps = {tool_name.split('_')[0] for tool_name in names}
+        covered = {tool_name.split('_')[0] for tool_name, _ in calls}
+        calls += [('headers', app) for app in sorted(apps - covered) if prompt_terms & self.app_terms.get(app, set())]
+        return calls
+
+    def start(self, prompt, tools, user_id):
+        prefetch = Prefetch()
+        calls = self.predict(prompt, tools)
+        for tool_name, args in calls[:self.max_calls]:
+            if tool_name == 'headers':
+                future = self.executor.try_submit(user_id, self.app_manager.warm_app_headers, args, user_id)
+                key = ('headers', args)
+            else:
+                future = self.executor.try_submit(user_id, self.app_manager.call_app_tool, tool_name, args, user_id)
+                key = _key(tool_name, args)
+            if future is None:
+                # The user's tool slots are busy; never queue behind real work
+                break
+            prefetch.futures[key] = future
+
+        with self.lock:
+            self.counts['turns'] += 1
+            self.counts['started'] += len(prefetch.futures)
+            self.counts['over_budget'] += len(calls) - len(prefetch.futures)
+        return prefetch
+
+    def finish(self, prefetch):
+        """Cancel what the turn didn't use and count it; returns the turn's summary for its trace"""
+        cancelled = prefetch.cancel()
+        used = len(prefetch.used & set(prefetch.futures))
+        wasted = len(prefetch.futures) - used - cancelled
+        with self.lock:
+            self.counts['used'] += used
+            self.counts['wasted'] += wasted
+            self.counts['cancelled'] += cancelled
+        return {
+            'started': [key[0] if key[0] != 'headers' else f"headers:{key[1]}" for key in prefetch.futures],
+            'used': used,
+            'wasted': wasted,
+            'cancelled': cancelled
+        }
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        # Calls that ran (or were running) and whose result nobody read
+        counts['waste_rate'] = counts['wasted'] / counts['started'] if counts['started'] else 0.0
+        return counts
+
+    def clear(self):
+        with self.lock:
+            self.counts = dict.fromkeys(self.counts, 0)
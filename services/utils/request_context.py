@@ -0,0 +1,83 @@
+from flask import g, has_app_context, current_app
+from services.utils.cognito_utils import get_user_from_token
+
+class RequestContext:
+    """Per-request state shared by the server, the Bedrock agent and the app tools.
+
+    Holds the resolved user id and the connection records read for it, so a
+    single request authenticates once and reads each record once.
+    """
+
+    def __init__(self):
+        self.auth_header = None
+        self.user_id = None
+        self.values = {}
+
+    def set_user(self, user_id, auth_header=None):
+        self.user_id = user_id
+        self.auth_header = auth_header
+
+    def get_user_id(self, auth_header):
+        if self.user_id is None or auth_header != self.auth_header:
+            self.set_user(get_user_from_token(auth_header), auth_header)
+        return self.user_id
+
+    def get_value(self, key, loader):
+        if key not in self.values:
+            self.values[key] = loader()
+        return self.values[key]
+
+    def set_value(self, key, value):
+        self.values[key] = value
+
+    def clear_value(self, key):
+        self.values.pop(key, None)
+
+def get_request_context():
+    """Return the context of the current request, or None outside of a Flask app context"""
+    if not has_app_context():
+        return None
+
+    if 'link_context' not in g:
+        g.link_context = RequestContext()
+    return g.link_context
+
+def get_request_user_id(auth_header):
+    """Resolve the user id of an Authorization header at most once per request"""
+    context = get_request_context()
+    if context is None:
+        return get_user_from_token(auth_header)
+    return context.get_user_id(auth_header)
+
+def request_cached(key, loader):
+    """Return loader() computed at most once per request for the given key"""
+    context = get_request_context()
+    if context is None:
+        return loader()
+    return context.get_value(key, loader)
+
+def set_request_cached(key, value):
+    """Keep the request's copy of a record in sync after a write"""
+    context = get_request_context()
+    if context is not None:
+        context.set_value(key, value)
+
+def clear_request_cached(key):
+    """Drop a record from the request's cache so the next read goes back to DynamoDB"""
+    context = get_request_context()
+    if context is not None:
+        context.clear_value(key)
+
+def run_in_request_context(fn):
+    """Wrap fn so it sees the current request's context when it runs on another thread"""
+    if not has_app_context():
+        return fn
+
+    app = current_app._get_current_object()
+    context = get_request_context()
+
+    def run(*args, **kwargs):
+        with app.app_context():
+            g.link_context = context
+            return fn(*args, **kwargs)
+    return run
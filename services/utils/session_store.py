@@ -0,0 +1,154 @@
+import os
+import re
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from services.utils.user_cache import MemoryCacheBackend, SQLiteCacheBackend
+from services.utils.conversation import compact_turn
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Once a session has keep + batch turns, the oldest batch is folded into its rolling summary
+SESSION_SUMMARY = os.getenv('SESSION_SUMMARY', 'true').lower() == 'true'
+SESSION_SUMMARY_KEEP_TURNS = int(os.getenv('SESSION_SUMMARY_KEEP_TURNS', 4))
+SESSION_SUMMARY_BATCH_TURNS = int(os.getenv('SESSION_SUMMARY_BATCH_TURNS', 4))
+SESSION_SUMMARY_WORKERS = int(os.getenv('SESSION_SUMMARY_WORKERS', 2))
+
+class InvalidSessionError(ValueError):
+    """Raised for a session id that is not a short url-safe token"""
+
+class SessionStore:
+    """Conversation turns kept server-side per user and session id.
+
+    Clients send only their new message and a session id; the server rebuilds
+    the context from the stored turns. Sessions live in an LRU backend (see
+    user_cache), expire `ttl` seconds after their last turn and keep at most
+    `max_turns` turns, each already compacted and truncated for history.
+
+    Older turns can be folded into a rolling summary in the background, so a
+    long session is sent as its summary plus the last `keep_turns` turns.
+    """
+
+    def __init__(self, max_sessions=2048, ttl=3600, max_turns=20, backend=None,
+                 summarize=SESSION_SUMMARY, keep_turns=SESSION_SUMMARY_KEEP_TURNS, batch_turns=SESSION_SUMMARY_BATCH_TURNS):
+        self.backend = backend or MemoryCacheBackend(max_sessions)
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.summarize = summarize
+        self.keep_turns = keep_turns
+        self.batch_turns = batch_turns
+        self.lock = threading.Lock()
+        self.pool = None
+        self.summarizing = set()
+        self.summaries = 0
+        self.summary_errors = 0
+
+    @staticmethod
+    def new_session_id():
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def _key(user_id, session_id):
+        if not isinstance(session_id, str) or not SESSION_ID_PATTERN.match(session_id):
+            raise InvalidSessionError("session_id must be 1-64 letters, digits, '-' or '_'")
+        # Keyed by user too, so a session id is useless to anyone but its owner
+        return f"{user_id}:{session_id}"
+
+    def _empty(self):
+        # `offset` counts the turns dropped from the front, so a summary knows which turns it covers;
+        # `started` tells a session apart from one reset and restarted under the same id
+        return {'turns': [], 'summary': None, 'offset': 0, 'started': self.new_session_id()}
+
+    def get_session(self, user_id, session_id):
+        """The session's rolling summary (or None) and the turns after it"""
+        session = self.backend.get(self._key(user_id, session_id)) or self._empty()
+        return session.get('summary'), session['turns']
+
+    def get_turns(self, user_id, session_id):
+        return self.get_session(user_id, session_id)[1]
+
+    def append_turn(self, user_id, session_id, messages):
+        key = self._key(user_id, session_id)
+        with self.lock:
+            session = self.backend.get(key) or self._empty()
+            turns = session['turns'] + [compact_turn(messages)]
+            dropped = max(0, len(turns) - self.max_turns)
+            self.backend.set(key, {**session, 'turns': turns[dropped:], 'offset': session.get('offset', 0) + dropped}, self.ttl)
+
+    def reset(self, user_id, session_id):
+        self.backend.delete(self._key(user_id, session_id))
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=SESSION_SUMMARY_WORKERS, thread_name_prefix='summary')
+            return self.pool
+
+    def maybe_summarize(self, user_id, session_id, summarizer):
+        """Start folding old turns into the summary in the background; returns the Future or None.
+
+        summarizer(summary, turns) returns the new summary text. At most one
+        summary per session runs at a time, and a failed one keeps the turns.
+        """
+        if not self.summarize:
+            return None
+
+        key = self._key(user_id, session_id)
+        session = self.backend.get(key)
+        if session is None or len(session['turns']) < self.keep_turns + self.batch_turns:
+            return None
+
+        with self.lock:
+            if key in self.summarizing:
+                return None
+            self.summarizing.add(key)
+        return self._get_pool().submit(self._summarize, key, session, summarizer)
+
+    def _summarize(self, key, session, summarizer):
+        try:
+            old_turns = session['turns'][:-self.keep_turns]
+            summary = summarizer(session.get('summary'), old_turns)
+            covered = session.get('offset', 0) + len(old_turns)
+
+            with self.lock:
+                # Turns may have been added meanwhile; drop only the ones this summary covers
+                current = self.backend.get(key)
+                if current is None or current.get('started') != session.get('started') or current.get('summary') != session.get('summary'):
+                    return
+                drop = max(0, covered - current.get('offset', 0))
+                self.backend.set(key, {
+                    **current,
+                    'turns': current['turns'][drop:],
+                    'summary': summary,
+                    'offset': current.get('offset', 0) + drop
+                }, self.ttl)
+                self.summaries += 1
+        except Exception as e:
+            print(f"Error summarizing session: {e}")
+            self.summary_errors += 1
+        finally:
+            with self.lock:
+                self.summarizing.discard(key)
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'size': self.backend.size(),
+            'max_size': self.backend.max_size,
+            'evictions': self.backend.evictions,
+            'summaries': self.summaries,
+            'summary_errors': self.summary_errors
+        }
+
+def create_session_backend():
+    max_sessions = int(os.getenv('SESSION_STORE_SIZE', 2048))
+    if os.getenv('SESSION_STORE_BACKEND', 'memory') == 'sqlite':
+        default_path = '/dev/shm/link_sessions.db' if os.path.isdir('/dev/shm') else '/tmp/link_sessions.db'
+        return SQLiteCacheBackend(os.getenv('SESSION_STORE_PATH', default_path), max_sessions, table='sessions')
+    return MemoryCacheBackend(max_sessions)
+
+session_store = SessionStore(
+    ttl=int(os.getenv('SESSION_TTL', 3600)),
+    max_turns=int(os.getenv('SESSION_MAX_TURNS', 20)),
+    backend=create_session_backend()
+)
@@ -0,0 +1,98 @@
+import os
+import time
+import uuid
+import threading
+from botocore.exceptions import ClientError
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key within one process.
+
+    The first caller runs the function; callers that arrive while it is running
+    wait for it and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+
+class DynamoDBLock:
+    """Short-lived lease stored on an existing item, used to coordinate work across processes.
+
+    The lease is a top-level attribute taken with a conditional update_item, so
+    only one worker holds it until it is released or expires.
+    """
+
+    def __init__(self, ttl=30, poll_interval=0.2):
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+    def acquire(self, table, key, name):
+        """Return a lease id, or None if another worker holds the lock `name` on the item at `key`"""
+        lease_id = uuid.uuid4().hex
+        now = int(time.time())
+        try:
+            table.update_item(
+                Key=key,
+                UpdateExpression='SET #lock = :lease',
+                ConditionExpression='attribute_exists(userId) AND (attribute_not_exists(#lock) OR #lock.expires_at < :now)',
+                ExpressionAttributeNames={'#lock': name},
+                ExpressionAttributeValues={':lease': {'owner': lease_id, 'expires_at': now + self.ttl}, ':now': now}
+            )
+            return lease_id
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return None
+            raise
+
+    def is_held(self, lease):
+        """Whether a lease read back from the item (None when absent) is still in force"""
+        return lease is not None and lease['expires_at'] >= int(time.time())
+
+    def release(self, table, key, name, lease_id):
+        try:
+            table.update_item(
+                Key=key,
+                UpdateExpression='REMOVE #lock',
+                ConditionExpression='#lock.#owner = :owner',
+                ExpressionAttributeNames={'#lock': name, '#owner': 'owner'},
+                ExpressionAttributeValues={':owner': lease_id}
+            )
+        except ClientError as e:
+            # Lease expired and was taken over by another worker
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+
+refresh_flights = SingleFlight()
+# Opt-in: SingleFlight already covers one process, and in the per_user layout the lease
+# costs two extra writes of the user's whole item on every refresh
+refresh_lock = DynamoDBLock() if os.getenv('TOKEN_REFRESH_LOCK', 'false').lower() == 'true' else None
@@ -0,0 +1,63 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# Cached access tokens are dropped this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = int(os.getenv('PROVIDER_TOKEN_EXPIRY_MARGIN', 60))
+
+class ProviderTokenCache:
+    """Thread-safe in-process cache of provider access tokens keyed by (user_id, service_name).
+
+    A token is served until TOKEN_EXPIRY_MARGIN seconds before its expires_at,
+    after which callers go back to DynamoDB (and refresh it if needed).
+    """
+
+    def __init__(self, max_size=4096, expiry_margin=TOKEN_EXPIRY_MARGIN):
+        self.max_size = max_size
+        self.expiry_margin = expiry_margin
+        self.tokens = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id, service_name):
+        entry = self.get_entry(user_id, service_name)
+        return entry[0] if entry else None
+
+    def get_entry(self, user_id, service_name):
+        """Return (access_token, expires_at) while the token is usable, otherwise None"""
+        key = (user_id, service_name)
+        with self.lock:
+            entry = self.tokens.get(key)
+            if entry is None:
+                return None
+
+            if time.time() >= entry[1] - self.expiry_margin:
+                del self.tokens[key]
+                return None
+
+            self.tokens.move_to_end(key)
+            return entry
+
+    def set(self, user_id, service_name, access_token, expires_at):
+        key = (user_id, service_name)
+        with self.lock:
+            self.tokens[key] = (access_token, expires_at)
+            self.tokens.move_to_end(key)
+
+            while len(self.tokens) > self.max_size:
+                self.tokens.popitem(last=False)
+
+    def invalidate(self, user_id, service_name=None):
+        with self.lock:
+            if service_name is not None:
+                self.tokens.pop((user_id, service_name), None)
+                return
+
+            for key in [key for key in self.tokens if key[0] == user_id]:
+                del self.tokens[key]
+
+    def clear(self):
+        with self.lock:
+            self.tokens.clear()
+
+provider_token_cache = ProviderTokenCache()
@@ -0,0 +1,128 @@
+import os
+import time
+import random
+import threading
+
+class TokenRefreshScheduler:
+    """Refreshes provider tokens of recently active users before they expire.
+
+    AppTool.get_app_headers reports every token it serves through `track`. A
+    daemon thread periodically refreshes the tracked tokens that are within
+    `lead_time` seconds of expiring, so the request path rarely has to refresh
+    inline. Each token gets a random offset inside `spread` seconds, runs are
+    capped at `max_refreshes_per_run` and spaced `min_spacing` seconds apart so
+    refreshes don't burst against the provider.
+    """
+
+    def __init__(self, lead_time=300, spread=120, active_window=1800, interval=30,
+                 max_refreshes_per_run=10, min_spacing=0.5, max_tracked=10000):
+        self.lead_time = lead_time
+        self.spread = spread
+        self.active_window = active_window
+        self.interval = interval
+        self.max_refreshes_per_run = max_refreshes_per_run
+        self.min_spacing = min_spacing
+        self.max_tracked = max_tracked
+        self.app_tools = {}
+        self.tracked = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.refreshed = 0
+        self.failed = 0
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def track(self, user_id, service_name, expires_at=None):
+        """Record that a user used a token; pass expires_at whenever it is known"""
+        if not self.running:
+            return
+
+        key = (user_id, service_name)
+        now = time.time()
+        with self.lock:
+            if expires_at is None:
+                if key in self.tracked:
+                    self.tracked[key]['last_active'] = now
+                return
+
+            if key not in self.tracked and len(self.tracked) >= self.max_tracked:
+                self._prune(now)
+                if len(self.tracked) >= self.max_tracked:
+                    return
+
+            self.tracked[key] = {
+                'refresh_at': float(expires_at) - self.lead_time - random.uniform(0, self.spread),
+                'last_active': now
+            }
+
+    def _prune(self, now):
+        for key in [key for key, entry in self.tracked.items() if now - entry['last_active'] > self.active_window]:
+            del self.tracked[key]
+
+    def due(self, now=None):
+        """Tokens that should be refreshed now, soonest first, at most max_refreshes_per_run"""
+        now = now or time.time()
+        with self.lock:
+            self._prune(now)
+            due = sorted(
+                (entry['refresh_at'], key) for key, entry in self.tracked.items()
+                if entry['refresh_at'] <= now
+            )
+        return [key for _, key in due[:self.max_refreshes_per_run]]
+
+    def run_once(self):
+        for i, (user_id, service_name) in enumerate(self.due()):
+            if self.stop_event.is_set():
+                return
+            if i:
+                self.stop_event.wait(self.min_spacing)
+
+            with self.lock:
+                self.tracked.pop((user_id, service_name), None)
+
+            app_tool = self.app_tools.get(service_name)
+            if app_tool is None:
+                continue
+
+            try:
+                # Every worker runs a scheduler: a token another worker already refreshed is only tracked again
+                refreshed = app_tool.refresh_user_tokens(user_id, lead_time=self.lead_time)
+            except Exception as e:
+                print(f"Error refreshing {service_name} token for {user_id}: {e}")
+                refreshed = None
+
+            if refreshed:
+                self.refreshed += 1
+                self.track(user_id, service_name, refreshed['expires_at'])
+            else:
+                self.failed += 1
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval * random.uniform(0.8, 1.2)):
+            self.run_once()
+
+    def start(self, app_tools):
+        """Start refreshing tokens for the given {service_name: AppTool} mapping"""
+        self.app_tools = app_tools
+        if self.running:
+            return
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='token-refresh-scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.thread = None
+        with self.lock:
+            self.tracked.clear()
+
+token_refresh_scheduler = TokenRefreshScheduler(
+    lead_time=int(os.getenv('TOKEN_REFRESH_LEAD_TIME', 300)),
+    interval=int(os.getenv('TOKEN_REFRESH_INTERVAL', 30))
+)
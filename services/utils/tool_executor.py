@@ -0,0 +1,94 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from services.utils.request_context import run_in_request_context
+
+# Threads shared by every request for running tool calls
+TOOL_MAX_WORKERS = int(os.getenv('TOOL_MAX_WORKERS', 8))
+# Tool calls one user may have in flight at once, across all of their requests
+TOOL_PER_USER_CONCURRENCY = int(os.getenv('TOOL_PER_USER_CONCURRENCY', 3))
+
+class ToolExecutor:
+    """Runs tool calls on a bounded thread pool with a per-user concurrency limit.
+
+    The limit is taken before a call is queued, so a user with many calls
+    waits for their own calls to finish instead of filling the pool and
+    starving other users, and provider rate limits see at most
+    per_user_limit requests from one user at a time.
+    """
+
+    def __init__(self, max_workers=TOOL_MAX_WORKERS, per_user_limit=TOOL_PER_USER_CONCURRENCY):
+        self.max_workers = max_workers
+        self.per_user_limit = per_user_limit
+        self.lock = threading.Lock()
+        self.pool = None
+        self.user_slots = {}
+
+    def _slots(self, user_id):
+        with self.lock:
+            slots = self.user_slots.get(user_id)
+            if slots is None:
+                slots = self.user_slots[user_id] = [threading.BoundedSemaphore(self.per_user_limit), 0]
+            slots[1] += 1
+            return slots
+
+    def _release(self, user_id, slots):
+        slots[0].release()
+        self._forget(user_id, slots)
+
+    def _forget(self, user_id, slots):
+        with self.lock:
+            slots[1] -= 1
+            # Forget users with nothing in flight so the map doesn't grow with every user ever seen
+            if slots[1] == 0:
+                self.user_slots.pop(user_id, None)
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='tool')
+            return self.pool
+
+    def submit(self, user_id, fn, *args, timeout=None):
+        """Queue fn(*args) for user_id, blocking while the user is at their limit; returns a Future.
+
+        Raises concurrent.futures.TimeoutError if no slot frees up within timeout seconds.
+        """
+        slots = self._slots(user_id)
+        if not slots[0].acquire(timeout=timeout):
+            self._forget(user_id, slots)
+            raise FuturesTimeoutError(f"no free tool slot for {user_id} within {timeout}s")
+        return self._submit(user_id, slots, fn, args)
+
+    def try_submit(self, user_id, fn, *args):
+        """Like submit, but return None instead of waiting when the user is at their limit"""
+        slots = self._slots(user_id)
+        if not slots[0].acquire(blocking=False):
+            self._forget(user_id, slots)
+            return None
+        return self._submit(user_id, slots, fn, args)
+
+    def _submit(self, user_id, slots, fn, args):
+        task = run_in_request_context(fn)
+
+        def run():
+            # Released before the result is set, so a caller that saw the result can reuse the slot
+            try:
+                return task(*args)
+            finally:
+                self._release(user_id, slots)
+
+        def release_cancelled(future):
+            # A call cancelled while still queued never runs, so it gives its slot back here
+            if future.cancelled():
+                self._release(user_id, slots)
+
+        try:
+            future = self._get_pool().submit(run)
+        except Exception:
+            self._release(user_id, slots)
+            raise
+        future.add_done_callback(release_cancelled)
+        return future
+
+tool_executor = ToolExecutor()
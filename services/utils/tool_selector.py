@@ -0,0 +1,82 @@
+import os
+import re
+from services.utils.conversation import is_tool_result_text
+
+# Send only the tools of the apps a prompt is about, with a way back to the full set
+TOOL_PRUNING = os.getenv('TOOL_PRUNING', 'false').lower() == 'true'
+# Earlier user messages read along with the prompt, for follow-ups like "and the second one?"
+TOOL_PRUNING_CONTEXT_MESSAGES = int(os.getenv('TOOL_PRUNING_CONTEXT_MESSAGES', 2))
+
+MORE_TOOLS_NAME = 'request_more_tools'
+MORE_TOOLS_SPEC = {
+    "toolSpec": {
+        "name": MORE_TOOLS_NAME,
+        "description": "Call this only when none of the other tools can do what the user asked. All of the user's tools then become available.",
+        "inputSchema": {"json": {"type": "object", "properties": {}}}
+    }
+}
+
+STOPWORDS = {
+    'a', 'about', 'all', 'an', 'and', 'any', 'are', 'as', 'ask', 'at', 'be', 'by', 'can', 'do', 'for', 'from',
+    'get', 'has', 'have', 'how', 'i', 'if', 'in', 'is', 'it', 'its', 'just', 'like', 'many', 'me', 'most', 'my',
+    'not', 'of', 'on', 'only', 'or', 'please', 'some', 'that', 'the', 'this', 'to', 'use', 'user', 'want',
+    'what', 'when', 'with', 'you', 'your'
+}
+
+def _stem(word):
+    # Enough to match "playlists" with "playlist" and "emails" with "email"
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+def terms(text):
+    return {_stem(word) for word in re.findall(r'[a-z0-9]+', text.lower())} - STOPWORDS
+
+class ToolSelector:
+    """Picks the tools a prompt is likely to need, so toolConfig carries only those.
+
+    An app is picked when the prompt or the recent user messages use one of
+    its words: the app name, its keywords (AppTool.keywords) or a word from its
+    tool specs that none of the user's other apps use. All tools of a picked
+    app are sent, plus MORE_TOOLS_SPEC so the model can ask for the rest.
+    Pure Python, no model call.
+    """
+
+    def __init__(self, app_keywords=None):
+        self.app_keywords = {app: {_stem(word) for word in words} for app, words in (app_keywords or {}).items()}
+        self.spec_terms = {}
+
+    def _tool_terms(self, tool):
+        spec = tool['toolSpec']
+        key = (spec['name'], spec.get('description', ''))
+        if key not in self.spec_terms:
+            properties = spec.get('inputSchema', {}).get('json', {}).get('properties', {})
+            self.spec_terms[key] = terms(' '.join([spec['name'].replace('_', ' '), spec.get('description', ''), *properties]))
+        return self.spec_terms[key]
+
+    def select(self, prompt, context, tools):
+        """The tools to offer for a prompt; `tools` itself when nothing can be left out"""
+        apps = {}
+        for tool in tools:
+            apps.setdefault(tool['toolSpec']['name'].split('_')[0], []).append(tool)
+        app_terms = {app: set().union(*(self._tool_terms(tool) for tool in app_tools)) for app, app_tools in apps.items()}
+        prompt_terms = terms(prompt) | terms(context)
+
+        selected = []
+        for app, app_tools in apps.items():
+            shared = set().union(set(), *(other for other_app, other in app_terms.items() if other_app != app))
+            vocabulary = {app} | self.app_keywords.get(app, set()) | (app_terms[app] - shared)
+            if prompt_terms & vocabulary:
+                selected.extend(app_tools)
+
+        if len(selected) == len(tools):
+            return tools
+        return selected + [MORE_TOOLS_SPEC]
+
+def context_text(messages, count=TOOL_PRUNING_CONTEXT_MESSAGES):
+    """Text of the last `count` user messages before the prompt, leaving out stored tool results"""
+    user_texts = [
+        block['text'] for message in messages if message['role'] == 'user'
+        for block in message['content'] if 'text' in block and not is_tool_result_text(block['text'])
+    ]
+    return '\n'.join(user_texts[-count:]) if count else ''
@@ -1,20 +1,8 @@
-from services.utils.tools.spotify_tools import SpotifyAppTool
-from services.utils.tools.gmail_tools import GmailAppTool
-import boto3
-import os
-
-dynamodb = boto3.resource('dynamodb', region_name=os.getenv('AWS_REGION', 'us-east-1'))
-table = dynamodb.Table('link-connections-table')
+from services.utils.tools.app_manager import AppManager
+from services.utils.connections_store import connections_table as table
 
 def get_user_tools(connected_apps):
-    tools = []
-    
-    if 'spotify' in connected_apps:
-        spotify_app_tool = SpotifyAppTool(table)
-        tools.extend(spotify_app_tool.get_tools())
-    
-    if 'gmail' in connected_apps:
-        gmail_app_tool = GmailAppTool(table)
-        tools.extend(gmail_app_tool.get_tools())
-    
-    return tools
\ No newline at end of file
+    """The tools of the connected apps, built (and ordered) the same way the agent's AppManager does"""
+    if not connected_apps:
+        return []
+    return AppManager(table).get_user_tools(connected_apps=connected_apps)
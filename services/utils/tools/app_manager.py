@@ -1,5 +1,6 @@
 from services.utils.tools.spotify_tools import SpotifyAppTool
 from services.utils.tools.gmail_tools import GmailAppTool
+from services.utils.connections_store import get_connections_store
 
 class AppManager():
     def __init__(self, table):
@@ -10,8 +11,7 @@ class AppManager():
         }
 
     def _get_connected_apps(self, user_id):
-        response = self.table.get_item(Key={'userId': user_id})
-        return response.get('Item', {}).get('connectedApps', [])
+        return get_connections_store(self.table).get_connected_apps(user_id)
     
     def _get_user_tools_by_id(self, user_id):
         connected_apps = self._get_connected_apps(user_id)
@@ -23,8 +23,9 @@ class AppManager():
         for app_name, app_tool in self.app_tools.items():
             if app_name in connected_apps:
                 tools.extend(app_tool.get_tools())
-        
-        return tools
+
+        # The same apps must always give the same list, byte for byte, or Bedrock's prompt cache misses
+        return sorted(tools, key=lambda tool: tool['toolSpec']['name'])
 
     def get_user_tools(self, user_id=None, connected_apps=None):
         """Get tools for a user by user ID or connected apps"""
@@ -41,4 +42,33 @@ class AppManager():
             raise ValueError(f"{service_name} is not a supported app")
         
         service_tool = self.app_tools[service_name]
-        return service_tool.call_tool(tool_name, tool_args, user_id)
\ No newline at end of file
+        return service_tool.call_tool(tool_name, tool_args, user_id)
+
+    def app_keywords(self):
+        """Extra words per app for ToolSelector"""
+        return {app_name: app_tool.keywords for app_name, app_tool in self.app_tools.items()}
+
+    def intent_patterns(self):
+        """Fast-path patterns of every app, by tool name, for IntentRouter"""
+        return {tool_name: patterns for app_tool in self.app_tools.values() for tool_name, patterns in app_tool.intent_patterns.items()}
+
+    def prefetch_rules(self):
+        """Speculative tool calls of every app, by tool name, for Prefetcher"""
+        return {tool_name: rule for app_tool in self.app_tools.values() for tool_name, rule in app_tool.prefetch_rules.items()}
+
+    def warm_app_headers(self, app_name, user_id):
+        """Load (and refresh if needed) the user's provider token ahead of a tool call"""
+        return self.app_tools[app_name].get_app_headers(user_id)
+
+    def format_intent_result(self, tool_name, tool_args, tool_result):
+        service_tool = self.app_tools.get(tool_name.split('_')[0])
+        if service_tool is None:
+            return None
+        return service_tool.format_intent_result(tool_name, tool_args, tool_result)
+
+    def render_tool_result(self, tool_name, tool_args, tool_result):
+        """Render a tool result locally when the tool has a template for it, otherwise None"""
+        service_tool = self.app_tools.get(tool_name.split('_')[0])
+        if service_tool is None:
+            return None
+        return service_tool.render_result(tool_name, tool_args, tool_result)
\ No newline at end of file
@@ -1,9 +1,10 @@
 import requests
-import boto3
 import time
-import os
-
-dynamodb = boto3.resource('dynamodb', region_name=os.getenv('AWS_REGION', 'us-east-1'))
+from services.utils.connections_store import get_connections_store
+from services.utils.token_cache import provider_token_cache, TOKEN_EXPIRY_MARGIN
+from services.utils.token_refresher import token_refresh_scheduler
+from services.utils.single_flight import refresh_flights, refresh_lock
+from services.utils.dynamo_utils import estimate_size
 
 class AppTool():
     def __init__(self, table):
@@ -15,6 +16,15 @@ class AppTool():
         self.client_secret = None
         self.refresh_url = None
         self.service_name = None
+        # (tool name, tool result) -> reply template filled from the tool arguments
+        self.result_templates = {}
+        # Words that show a prompt is about this app, beyond those in its tool specs
+        self.keywords = set()
+        # tool name -> regexes matching a whole, normalised prompt that needs only that tool;
+        # named groups become tool arguments (see IntentRouter)
+        self.intent_patterns = {}
+        # read-only tool name -> (words that predict the model will call it, arguments to prefetch it with)
+        self.prefetch_rules = {}
 
     def get_tools(self):
         """Return a list of tools for the specific app service you are implementing"""
@@ -22,34 +32,149 @@ class AppTool():
 
     def call_tool(self, tool_name, tool_args, user_id):
         return None
+
+    def render_result(self, tool_name, tool_args, tool_result):
+        """Reply for a tool result with a fixed format, or None if the model should write it"""
+        template = self.result_templates.get((tool_name, tool_result))
+        if template is None:
+            return None
+        try:
+            return template.format(**tool_args)
+        except (KeyError, IndexError):
+            return None
     
+    def format_intent_result(self, tool_name, tool_args, tool_result):
+        """Reply for a tool called by the intent router, or None to hand the prompt to the model"""
+        return None
+
+    @property
+    def store(self):
+        return get_connections_store(self.table)
+
     def get_app_headers(self, user_id):
-        response = self.table.get_item(Key={'userId': user_id})
-        item = response.get('Item')
+        access_token = provider_token_cache.get(user_id, self.service_name)
+        if access_token:
+            token_refresh_scheduler.track(user_id, self.service_name)
+            return {'Authorization': f'Bearer {access_token}'}
+
+        app_tokens = self.store.get_app_tokens(user_id, self.service_name)
 
-        if not item or self.service_name not in item.get('appTokens', {}):
+        if not app_tokens:
             return f"{self.service_name} is not connected"
 
-        print
-        app_tokens = item['appTokens'][self.service_name]
         access_token = app_tokens['access_token']
-        refresh_token = app_tokens.get('refresh_token')
         expires_at = app_tokens.get('expires_at', 0)
 
-        if time.time() > expires_at:
+        if time.time() > expires_at - TOKEN_EXPIRY_MARGIN:
             print("Access token expired. Refreshing...")
-            refreshed = self.refresh_access_token(refresh_token)
-            if not refreshed:
+            app_tokens = self.refresh_user_tokens(user_id, app_tokens)
+            if not app_tokens:
                 return "Failed to refresh Spotify token"
-            access_token = refreshed['access_token']
+            access_token = app_tokens['access_token']
+
+        provider_token_cache.set(user_id, self.service_name, access_token, app_tokens['expires_at'])
+        token_refresh_scheduler.track(user_id, self.service_name, app_tokens['expires_at'])
+        return {'Authorization': f'Bearer {access_token}'}
+
+    def refresh_user_tokens(self, user_id, app_tokens=None, lead_time=None):
+        """Refresh the user's tokens for this service, persist them and return them (None on failure).
+
+        Concurrent refreshes for the same user and service share one provider call.
+        Without app_tokens the stored ones are read; if they still have more than
+        lead_time seconds left (another worker refreshed them) they are returned as is.
+        """
+        return refresh_flights.do(
+            (user_id, self.service_name),
+            lambda: self._refresh_user_tokens(user_id, app_tokens, lead_time)
+        )
+
+    def _refresh_user_tokens(self, user_id, app_tokens, lead_time=None):
+        store = self.store
+        if app_tokens is None:
+            app_tokens = store.get_app_tokens_consistent(user_id, self.service_name)
+            if not app_tokens:
+                return None
+            if lead_time is not None and app_tokens.get('expires_at', 0) - time.time() > lead_time:
+                return app_tokens
+
+        app_tokens = dict(app_tokens)
+        stale_access_token = app_tokens['access_token']
+
+        # A refresh that finished just before this one started already replaced the stale token.
+        # Only a cached token that outlives the stored one is newer; an older one mustn't be
+        # paired with the stored refresh token and metadata
+        cached = provider_token_cache.get_entry(user_id, self.service_name)
+        if cached and cached[0] != stale_access_token and cached[1] > app_tokens.get('expires_at', 0):
+            return {**app_tokens, 'access_token': cached[0], 'expires_at': cached[1]}
+
+        lease_id = None
+        if refresh_lock is not None:
+            lease_id = store.acquire_refresh_lock(refresh_lock, user_id, self.service_name)
+            if lease_id is None:
+                return self._wait_for_refresh(user_id, stale_access_token)
+        return self._refresh_with_lease(store, user_id, app_tokens, stale_access_token, lease_id)
+
+    def _refresh_with_lease(self, store, user_id, app_tokens, stale_access_token, lease_id):
+        """Call the provider and store the result, releasing the refresh lock (if held) afterwards"""
+        try:
+            refreshed = self.refresh_access_token(app_tokens.get('refresh_token'))
+            if not refreshed:
+                return None
+
             app_tokens.update(refreshed)
             app_tokens['expires_at'] = int(time.time()) + refreshed['expires_in']
-            self.table.put_item(Item={
-                **item,
-                'appTokens': {**item['appTokens'], self.service_name: app_tokens}
-            })
+            app_tokens = self._store_refreshed_tokens(store, user_id, app_tokens, stale_access_token)
+        finally:
+            if lease_id is not None:
+                store.release_refresh_lock(refresh_lock, user_id, self.service_name, lease_id)
 
-        return {'Authorization': f'Bearer {access_token}'}
+        if not app_tokens:
+            return None
+        provider_token_cache.set(user_id, self.service_name, app_tokens['access_token'], app_tokens['expires_at'])
+
+        return app_tokens
+
+    def _store_refreshed_tokens(self, store, user_id, app_tokens, stale_access_token):
+        """Write only this service's tokens, and only if nobody replaced the stale token meanwhile.
+
+        Returns the tokens to use: ours, or the stored ones when another writer won
+        (None if the app was disconnected meanwhile).
+        """
+        response = store.store_refreshed_tokens(user_id, self.service_name, app_tokens, stale_access_token)
+        if response is None:
+            print(f"{self.service_name} token for {user_id} was replaced concurrently, keeping the stored one")
+            return store.get_app_tokens_consistent(user_id, self.service_name)
+
+        write_size = estimate_size({self.service_name: app_tokens})
+        consumed = response.get('ConsumedCapacity', {}).get('CapacityUnits')
+        print(f"Stored refreshed {self.service_name} token: ~{write_size} bytes, {consumed} WCU")
+        return app_tokens
+
+    def _wait_for_refresh(self, user_id, stale_access_token):
+        """Another worker holds the refresh lock: wait for its new token to land in the table.
+
+        If the lock goes away without a new token (the holder's refresh failed, or
+        it died and the lease expired), take the lock and refresh here instead of
+        waiting out the lease.
+        """
+        store = self.store
+        deadline = time.time() + refresh_lock.ttl
+        while time.time() < deadline:
+            time.sleep(refresh_lock.poll_interval)
+            app_tokens, locked = store.get_refresh_state(refresh_lock, user_id, self.service_name)
+            if not app_tokens:
+                return None
+            if app_tokens['access_token'] != stale_access_token:
+                provider_token_cache.set(user_id, self.service_name, app_tokens['access_token'], app_tokens['expires_at'])
+                return app_tokens
+            if not locked:
+                lease_id = store.acquire_refresh_lock(refresh_lock, user_id, self.service_name)
+                if lease_id is not None:
+                    return self._refresh_with_lease(store, user_id, dict(app_tokens), stale_access_token, lease_id)
+                # Another waiter took over the refresh: wait for that one instead
+
+        print(f"Timed out waiting for another worker to refresh the {self.service_name} token")
+        return None
     
     def refresh_access_token(self, refresh_token):
         response = requests.post(
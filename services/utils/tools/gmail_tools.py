@@ -11,6 +11,22 @@ class GmailAppTool(AppTool):
         self.client_secret = os.getenv('GMAIL_CLIENT_SECRET')
         self.refresh_url = 'https://oauth2.googleapis.com/token'
         self.service_name = 'gmail'
+        self.result_templates = {
+            ('gmail_send_email', 'Email sent successfully'): 'Your email to {to} has been sent.'
+        }
+        self.keywords = {'email', 'mail', 'inbox', 'message', 'send', 'reply', 'unread', 'subject', 'sender', 'wrote', 'write'}
+        self.intent_patterns = {
+            'gmail_list_messages': [
+                r"(?:list|show|get|give|display|see|check|read)(?: me)? my (?:(?:last|latest|recent|most recent|newest) )?"
+                r"(?:(?P<max_results>\d{1,2}|one|two|three|four|five|six|seven|eight|nine|ten) )?"
+                r"(?:(?:last|latest|recent|most recent|newest) )?(?:e ?mails?|messages|mail|inbox)",
+                r"what(?: is|s)? in my inbox",
+                r"(?:my )?(?:latest|recent|newest) (?:e ?mails|messages)"
+            ]
+        }
+        self.prefetch_rules = {
+            'gmail_list_messages': ({'email', 'inbox', 'mail', 'message'}, {'max_results': 5})
+        }
 
     def get_tools(self):
         """Get Gmail tool definitions for Bedrock"""
@@ -63,6 +79,15 @@ class GmailAppTool(AppTool):
             }
         ]
 
+    def format_intent_result(self, tool_name, tool_args, tool_result):
+        if tool_name != 'gmail_list_messages' or tool_result.startswith('Error'):
+            return None
+        emails = [line for line in tool_result.split("\n") if line]
+        if not emails:
+            return "Your inbox is empty."
+        lines = "\n".join(f"{index}. {email}" for index, email in enumerate(emails, 1))
+        return f"Here are your {len(emails)} most recent emails:\n\n{lines}"
+
     def call_tool(self, tool_name, tool_args, user_id):
         headers = self.get_app_headers(user_id)
 
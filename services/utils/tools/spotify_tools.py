@@ -10,6 +10,22 @@ class SpotifyAppTool(AppTool):
         self.client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
         self.refresh_url = 'https://accounts.spotify.com/api/token'
         self.service_name = 'spotify'
+        self.result_templates = {
+            ('spotify_add_to_playlist', 'Track added to playlist'): 'Added {track_name} to your {playlist_name} playlist.',
+            ('spotify_remove_from_playlist', 'Track removed from playlist'): 'Removed {track_name} from your {playlist_name} playlist.'
+        }
+        self.keywords = {'music', 'song', 'track', 'playlist', 'artist', 'album', 'band', 'singer', 'genre', 'play', 'listen', 'tune'}
+        self.intent_patterns = {
+            'spotify_get_user_playlists': [
+                r"(?:list|show|get|give|display|see)(?: me)?(?: all)?(?: of)? my (?:spotify )?playlists",
+                r"what(?: are| is|s)? my (?:spotify )?playlists",
+                r"what playlists do i have(?: on spotify)?",
+                r"my (?:spotify )?playlists"
+            ]
+        }
+        self.prefetch_rules = {
+            'spotify_get_user_playlists': ({'playlist'}, {})
+        }
 
     def get_tools(self):
         """Get Spotify tool definitions for Bedrock"""
@@ -150,6 +166,15 @@ class SpotifyAppTool(AppTool):
                     return p['id']
         return None
 
+    def format_intent_result(self, tool_name, tool_args, tool_result):
+        if tool_name != 'spotify_get_user_playlists' or tool_result.startswith('Error'):
+            return None
+        playlists = [name for name in tool_result.split("\n") if name]
+        if not playlists:
+            return "You don't have any Spotify playlists yet."
+        lines = "\n".join(f"{index}. {name}" for index, name in enumerate(playlists, 1))
+        return f"Here are your Spotify playlists:\n\n{lines}"
+
     def call_tool(self, tool_name, tool_args, user_id):
         headers = self.get_app_headers(user_id)
         print(f'Calling: {tool_name}')
@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from flask import has_request_context, request
+
+# USD per 1000 tokens; defaults are Claude 3 Haiku on-demand prices
+BEDROCK_INPUT_PRICE_PER_1K = float(os.getenv('BEDROCK_INPUT_PRICE_PER_1K', 0.00025))
+BEDROCK_OUTPUT_PRICE_PER_1K = float(os.getenv('BEDROCK_OUTPUT_PRICE_PER_1K', 0.00125))
+# Prompt cache reads and writes, as multiples of the input price
+BEDROCK_CACHE_READ_PRICE_RATIO = float(os.getenv('BEDROCK_CACHE_READ_PRICE_RATIO', 0.1))
+BEDROCK_CACHE_WRITE_PRICE_RATIO = float(os.getenv('BEDROCK_CACHE_WRITE_PRICE_RATIO', 1.25))
+
+# Per-user limits over a fixed window; 0 turns a limit off
+USER_TOKEN_BUDGET = int(os.getenv('USER_TOKEN_BUDGET', 0))
+USER_COST_BUDGET = float(os.getenv('USER_COST_BUDGET', 0))
+USAGE_WINDOW_SECONDS = int(os.getenv('USAGE_WINDOW_SECONDS', 3600))
+# Users kept in memory; the least recently active are forgotten first
+USAGE_MAX_USERS = int(os.getenv('USAGE_MAX_USERS', 10000))
+
+def _empty():
+    return {
+        'calls': 0,
+        'input_tokens': 0,
+        'output_tokens': 0,
+        'cache_read_tokens': 0,
+        'cache_write_tokens': 0,
+        'bedrock_latency_ms': 0,
+        'cost_usd': 0.0
+    }
+
+def call_cost(usage):
+    """Estimated USD cost of one model call's usage"""
+    input_price = BEDROCK_INPUT_PRICE_PER_1K / 1000
+    return (
+        usage.get('inputTokens', 0) * input_price
+        + usage.get('outputTokens', 0) * BEDROCK_OUTPUT_PRICE_PER_1K / 1000
+        + usage.get('cacheReadInputTokens', 0) * input_price * BEDROCK_CACHE_READ_PRICE_RATIO
+        + usage.get('cacheWriteInputTokens', 0) * input_price * BEDROCK_CACHE_WRITE_PRICE_RATIO
+    )
+
+def current_route():
+    """The request path a model call belongs to, or 'background' outside a request"""
+    return request.path if has_request_context() else 'background'
+
+class UsageTracker:
+    """Token, latency and cost totals of every model call, per stage, route and user.
+
+    A stage is why the model was called: 'first' for the prompt, 'tool_followup'
+    after tool results, 'format' for the format pass and 'summary' for session
+    summaries. Each user also has a fixed window that the token and cost
+    budgets are checked against. In memory and per worker process.
+    """
+
+    def __init__(self, token_budget=USER_TOKEN_BUDGET, cost_budget=USER_COST_BUDGET,
+                 window_seconds=USAGE_WINDOW_SECONDS, max_users=USAGE_MAX_USERS):
+        self.token_budget = token_budget
+        self.cost_budget = cost_budget
+        self.window_seconds = window_seconds
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.totals = _empty()
+            self.stages = {}
+            self.routes = {}
+            self.users = OrderedDict()
+
+    @staticmethod
+    def _add(stats, usage, cost, latency_ms):
+        stats['calls'] += 1
+        stats['input_tokens'] += usage.get('inputTokens', 0)
+        stats['output_tokens'] += usage.get('outputTokens', 0)
+        stats['cache_read_tokens'] += usage.get('cacheReadInputTokens', 0)
+        stats['cache_write_tokens'] += usage.get('cacheWriteInputTokens', 0)
+        stats['bedrock_latency_ms'] += latency_ms or 0
+        stats['cost_usd'] += cost
+
+    def _user(self, user_id, now):
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = {'total': _empty(), 'window': _empty(), 'window_start': now}
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        self.users.move_to_end(user_id)
+        if now - user['window_start'] >= self.window_seconds:
+            user['window'] = _empty()
+            user['window_start'] = now
+        return user
+
+    def record(self, user_id, stage, usage, latency_ms=None, route=None):
+        """Add one model call; latency_ms is the latency Bedrock reported for it"""
+        usage = usage or {}
+        cost = call_cost(usage)
+        route = route or current_route()
+        with self.lock:
+            self._add(self.totals, usage, cost, latency_ms)
+            self._add(self.stages.setdefault(stage, _empty()), usage, cost, latency_ms)
+            self._add(self.routes.setdefault(route, _empty()), usage, cost, latency_ms)
+            if user_id is not None:
+                user = self._user(user_id, time.time())
+                self._add(user['total'], usage, cost, latency_ms)
+                self._add(user['window'], usage, cost, latency_ms)
+
+    @staticmethod
+    def _tokens(stats):
+        return stats['input_tokens'] + stats['output_tokens'] + stats['cache_read_tokens'] + stats['cache_write_tokens']
+
+    def over_budget(self, user_id):
+        """Whether the user has used up their token or cost budget for the current window"""
+        if not self.token_budget and not self.cost_budget:
+            return False
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None or time.time() - user['window_start'] >= self.window_seconds:
+                return False
+            window = user['window']
+            return bool(
+                (self.token_budget and self._tokens(window) >= self.token_budget)
+                or (self.cost_budget and window['cost_usd'] >= self.cost_budget)
+            )
+
+    def retry_after(self, user_id):
+        """Seconds until the user's window restarts"""
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None:
+                return 0
+            return max(0, int(user['window_start'] + self.window_seconds - time.time()) + 1)
+
+    def user_snapshot(self, user_id):
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None:
+                return None
+            return {
+                'total': dict(user['total']),
+                'window': {**user['window'], 'tokens': self._tokens(user['window']), 'started_at': user['window_start']}
+            }
+
+    def snapshot(self, top_users=20):
+        """Totals per stage and route, and the users with the highest cost"""
+        with self.lock:
+            users = sorted(self.users.items(), key=lambda item: item[1]['total']['cost_usd'], reverse=True)[:top_users]
+            return {
+                'total': dict(self.totals),
+                'stages': {stage: dict(stats) for stage, stats in self.stages.items()},
+                'routes': {route: dict(stats) for route, stats in self.routes.items()},
+                'users_tracked': len(self.users),
+                'top_users': {user_id: dict(user['total']) for user_id, user in users},
+                'budgets': {
+                    'tokens': self.token_budget,
+                    'cost_usd': self.cost_budget,
+                    'window_seconds': self.window_seconds
+                }
+            }
+
+usage_tracker = UsageTracker()
@@ -1,11 +1,185 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class MemoryCacheBackend:
+    """In-process LRU store with per-entry expiry, local to one worker"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+
+            if entry[1] <= time.monotonic():
+                del self.cache[key]
+                return None
+
+            self.cache.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.cache[key] = (value, time.monotonic() + ttl)
+            self.cache.move_to_end(key)
+
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def size(self):
+        with self.lock:
+            return len(self.cache)
+
+class SQLiteCacheBackend:
+    """LRU store in a SQLite file shared by every worker process on the host.
+
+    Writes and deletes are visible to all workers immediately, so a connect or
+    disconnect handled by one gunicorn worker invalidates the entry for all of
+    them. Point `path` at /dev/shm to keep the file in shared memory. A hit only
+    moves an entry up the LRU order if it wasn't used in the last `touch_interval`
+    seconds, so most hits stay read-only instead of taking the write lock.
+    """
+
+    def __init__(self, path, max_size=1024, table='user_tools', touch_interval=30):
+        self.path = path
+        self.max_size = max_size
+        self.table = table
+        self.touch_interval = touch_interval
+        self.local = threading.local()
+        self.evictions = 0
+        self._connect().execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        # sqlite connections can't be shared across threads or forked processes
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(f"SELECT value, expires_at, accessed_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        if row[1] <= now:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ? AND expires_at <= ?", (key, now))
+            return None
+
+        if now - row[2] >= self.touch_interval:
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + ttl, now)
+        )
+
+        overflow = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_size
+        if overflow > 0:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                (overflow,)
+            )
+            self.evictions += overflow
+
+    def delete(self, key):
+        self._connect().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute(f"DELETE FROM {self.table}")
+
+    def size(self):
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
 class UserToolsCache:
-    def __init__(self):
-        self.cache = {}
-    
-    def set_user_tools(self, user_id, tools):
-        self.cache[user_id] = tools
-    
+    """Thread-safe cache of each user's Bedrock tool list with per-entry TTL.
+
+    An empty tool list is stored as a negative entry (the user has no connected
+    apps) and is returned as `[]`, while a miss returns `None`. Storage is
+    delegated to a backend, in-process by default.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, negative_ttl=60, backend=None):
+        self.backend = backend or MemoryCacheBackend(max_size)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def set_user_tools(self, user_id, tools, ttl=None):
+        if ttl is None:
+            ttl = self.ttl if tools else self.negative_ttl
+        self.backend.set(user_id, tools, ttl)
+
     def get_user_tools(self, user_id):
-        return self.cache.get(user_id, [])
+        """Return the cached tools, `[]` for a user without apps or `None` on a miss"""
+        tools = self.backend.get(user_id)
+
+        with self.lock:
+            if tools is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return tools
+
+    def invalidate(self, user_id):
+        self.backend.delete(user_id)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'backend': type(self.backend).__name__,
+                'size': self.backend.size(),
+                'max_size': self.backend.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.backend.evictions
+            }
+
+def create_cache_backend():
+    max_size = int(os.getenv('USER_TOOLS_CACHE_SIZE', 1024))
+    if os.getenv('USER_TOOLS_CACHE_BACKEND', 'memory') == 'sqlite':
+        default_path = '/dev/shm/link_user_tools.db' if os.path.isdir('/dev/shm') else '/tmp/link_user_tools.db'
+        return SQLiteCacheBackend(os.getenv('USER_TOOLS_CACHE_PATH', default_path), max_size)
+    return MemoryCacheBackend(max_size)
 
-user_tools_cache = UserToolsCache()
\ No newline at end of file
+user_tools_cache = UserToolsCache(
+    ttl=int(os.getenv('USER_TOOLS_CACHE_TTL', 300)),
+    negative_ttl=int(os.getenv('USER_TOOLS_CACHE_NEGATIVE_TTL', 60)),
+    backend=create_cache_backend()
+)
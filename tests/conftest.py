@@ -1,8 +1,22 @@
+import os
 import pytest
+
+# Tests drive the refresh scheduler explicitly instead of through a background thread
+os.environ.setdefault('PROACTIVE_TOKEN_REFRESH', 'false')
+# Tests that need the cross-process refresh lock patch one in
+os.environ.setdefault('TOKEN_REFRESH_LOCK', 'false')
+
 from server import app
+from services.utils.token_cache import provider_token_cache
 
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
     with app.test_client() as client:
-        yield client
\ No newline at end of file
+        yield client
+
+@pytest.fixture(autouse=True)
+def clear_provider_token_cache():
+    provider_token_cache.clear()
+    yield
+    provider_token_cache.clear()
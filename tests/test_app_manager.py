@@ -111,4 +111,15 @@ def test_call_app_tool_valid(patched_app_manager):
 def test_call_app_tool_invalid(patched_app_manager):
     manager, _, _ = patched_app_manager
     with pytest.raises(ValueError):
-        manager.call_app_tool('dropbox_send_file', {}, 'user')
\ No newline at end of file
+        manager.call_app_tool('dropbox_send_file', {}, 'user')
+
+
+def test_user_tools_are_in_a_stable_order(patched_app_manager):
+    manager, mock_spotify_tool, mock_gmail_tool = patched_app_manager
+    mock_spotify_tool.get_tools.return_value = TEST_SPOTIFY_TOOLS
+    mock_gmail_tool.get_tools.return_value = TEST_GMAIL_TOOLS
+
+    tools = manager.get_user_tools(connected_apps=['spotify', 'gmail'])
+
+    assert tools == TEST_GMAIL_TOOLS + TEST_SPOTIFY_TOOLS
+    assert manager.get_user_tools(connected_apps=['gmail', 'spotify']) == tools
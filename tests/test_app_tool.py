@@ -214,17 +214,21 @@ class TestAppTool:
             
             self.app_tool.get_app_headers(self.user_id)
             
-            # Verify put_item was called with updated data
-            mock_table.put_item.assert_called_once()
-            call_args = mock_table.put_item.call_args[1]['Item']
+            # Verify only the spotify token map was written, conditioned on the old token
+            mock_table.put_item.assert_not_called()
+            mock_table.update_item.assert_called_once()
+            call_args = mock_table.update_item.call_args[1]
+            assert call_args['UpdateExpression'] == 'SET appTokens.#svc = :tokens'
+            assert call_args['ExpressionAttributeNames'] == {'#svc': 'spotify'}
+            assert call_args['ExpressionAttributeValues'][':stale_token'] == 'expired_token'
             
-            spotify_tokens = call_args['appTokens']['spotify']
+            spotify_tokens = call_args['ExpressionAttributeValues'][':tokens']
             assert spotify_tokens['access_token'] == 'new_token'
             assert spotify_tokens['refresh_token'] == 'new_refresh_token'
             assert spotify_tokens['expires_at'] == 4600  # 1000 + 3600
             
             # Verify other services weren't affected
-            assert call_args['appTokens']['other_service']['access_token'] == 'other_token'
+            assert 'other_service' not in call_args['ExpressionAttributeValues'][':tokens']
 
     def test_get_app_headers_missing_expires_at(self):
         """Test get_app_headers when expires_at is missing (defaults to 0)"""
@@ -309,4 +313,72 @@ class TestAppTool:
         self.app_tool.table = mock_table
         
         result = self.app_tool.get_app_headers(self.user_id)
-        assert result == "spotify is not connected"
\ No newline at end of file
+        assert result == "spotify is not connected"
+
+    def test_get_app_headers_uses_token_cache(self):
+        """Test that a cached token is served without reading DynamoDB again"""
+        mock_table = Mock()
+        mock_table.get_item.return_value = {
+            'Item': {
+                'userId': self.user_id,
+                'appTokens': {
+                    'spotify': {
+                        'access_token': 'valid_token',
+                        'refresh_token': 'refresh_token',
+                        'expires_at': int(time.time()) + 3600
+                    }
+                }
+            }
+        }
+        self.app_tool.table = mock_table
+
+        assert self.app_tool.get_app_headers(self.user_id) == {'Authorization': 'Bearer valid_token'}
+        assert self.app_tool.get_app_headers(self.user_id) == {'Authorization': 'Bearer valid_token'}
+        mock_table.get_item.assert_called_once()
+
+    def test_get_app_headers_refreshes_token_close_to_expiry(self):
+        """Test that a token about to expire is refreshed instead of served"""
+        mock_table = Mock()
+        mock_table.get_item.return_value = {
+            'Item': {
+                'userId': self.user_id,
+                'appTokens': {
+                    'spotify': {
+                        'access_token': 'expiring_token',
+                        'refresh_token': 'refresh_token',
+                        'expires_at': int(time.time()) + 5
+                    }
+                }
+            }
+        }
+        self.app_tool.table = mock_table
+
+        with patch.object(self.app_tool, 'refresh_access_token') as mock_refresh:
+            mock_refresh.return_value = {'access_token': 'new_token', 'expires_in': 3600}
+            assert self.app_tool.get_app_headers(self.user_id) == {'Authorization': 'Bearer new_token'}
+            assert self.app_tool.get_app_headers(self.user_id) == {'Authorization': 'Bearer new_token'}
+
+        mock_refresh.assert_called_once_with('refresh_token')
+        mock_table.get_item.assert_called_once()
+
+    @patch('services.utils.tools.app_tool.time')
+    def test_get_app_headers_refresh_write_conflict(self, mock_time):
+        """Test that the stored token is used when another writer replaced it during our refresh"""
+        from botocore.exceptions import ClientError
+        mock_time.time.return_value = 1000
+
+        mock_table = Mock()
+        mock_table.get_item.side_effect = [
+            {'Item': {'appTokens': {'spotify': {'access_token': 'expired_token', 'refresh_token': 'refresh_token', 'expires_at': 500}}}},
+            {'Item': {'appTokens': {'spotify': {'access_token': 'other_token', 'refresh_token': 'refresh_token', 'expires_at': 4600}}}}
+        ]
+        mock_table.update_item.side_effect = ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'failed'}}, 'UpdateItem')
+        self.app_tool.table = mock_table
+
+        with patch.object(self.app_tool, 'refresh_access_token') as mock_refresh:
+            mock_refresh.return_value = {'access_token': 'new_token', 'expires_in': 3600}
+            assert self.app_tool.get_app_headers(self.user_id) == {'Authorization': 'Bearer other_token'}
+
+        assert mock_table.get_item.call_args.kwargs['ConsistentRead'] is True
+        mock_table.put_item.assert_not_called()
+
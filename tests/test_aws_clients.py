@@ -0,0 +1,56 @@
+import threading
+from unittest.mock import patch
+from services.utils.aws_clients import AWSClientFactory, LazyClient, LazyTable, AWS_MAX_POOL_CONNECTIONS
+
+def test_client_is_built_once():
+    factory = AWSClientFactory()
+    client = factory.client('cognito-idp', 'us-east-1')
+
+    assert factory.client('cognito-idp', 'us-east-1') is client
+    assert factory.client('cognito-idp', 'us-west-2') is not client
+
+def test_client_config():
+    factory = AWSClientFactory()
+    config = factory.client('bedrock-runtime', 'us-east-1', read_timeout=60).meta.config
+
+    assert config.max_pool_connections == AWS_MAX_POOL_CONNECTIONS
+    assert config.read_timeout == 60
+    assert config.retries['mode'] == 'standard'
+
+def test_concurrent_first_use_builds_one_client():
+    factory = AWSClientFactory()
+    clients = []
+
+    def get():
+        clients.append(factory.client('cognito-idp', 'us-east-1'))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(client) for client in clients}) == 1
+
+def test_new_process_gets_new_clients():
+    factory = AWSClientFactory()
+    client = factory.client('cognito-idp', 'us-east-1')
+    table = factory.table('link-connections-table', 'us-east-1')
+
+    with patch('services.utils.aws_clients.os.getpid', return_value=factory.pid + 1):
+        assert factory.client('cognito-idp', 'us-east-1') is not client
+        assert factory.table('link-connections-table', 'us-east-1') is not table
+
+def test_lazy_wrappers_build_nothing_until_used():
+    with patch('services.utils.aws_clients.aws_clients') as mock_factory:
+        client = LazyClient('bedrock-runtime', region_name='us-east-1', read_timeout=60)
+        table = LazyTable('link-connections-table')
+        mock_factory.client.assert_not_called()
+        mock_factory.table.assert_not_called()
+
+        client.converse(modelId='model')
+        table.get_item(Key={'userId': 'user'})
+
+    mock_factory.client.assert_called_once_with('bedrock-runtime', 'us-east-1', read_timeout=60)
+    mock_factory.client.return_value.converse.assert_called_once_with(modelId='model')
+    mock_factory.table.return_value.get_item.assert_called_once_with(Key={'userId': 'user'})
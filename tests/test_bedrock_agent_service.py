@@ -0,0 +1,522 @@
+import json
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+from server import app
+from services.bedrock_agent_service import BedrockAgent, LIMIT_REACHED_MESSAGE, SYSTEM_PROMPT, CACHE_POINT
+from services.utils.tool_selector import MORE_TOOLS_NAME
+from services.utils.request_context import request_cached
+from services.utils.agent_metrics import agent_metrics
+from services.utils.tool_executor import ToolExecutor
+from services.utils.tools.app_manager import AppManager
+
+TOOLS = [{'toolSpec': {'name': 'spotify_add_to_playlist', 'inputSchema': {'json': {}}}}]
+TOOL_USE = {
+    'toolUseId': 'tool-1',
+    'name': 'spotify_add_to_playlist',
+    'input': {'query': 'Hey Jude', 'track_name': 'Hey Jude', 'playlist_name': 'Road Trip'}
+}
+
+def converse_response(content, input_tokens=10, output_tokens=5):
+    return {
+        'output': {'message': {'role': 'assistant', 'content': content}},
+        'stopReason': 'tool_use' if any('toolUse' in block for block in content) else 'end_turn',
+        'usage': {'inputTokens': input_tokens, 'outputTokens': output_tokens, 'totalTokens': input_tokens + output_tokens}
+    }
+
+@pytest.fixture
+def agent():
+    app_manager = AppManager(MagicMock())
+    agent = BedrockAgent(app_manager)
+    agent.client = MagicMock()
+    agent.format_pass = False
+    agent.local_templates = False
+    agent_metrics.clear()
+    yield agent
+    agent_metrics.clear()
+
+def test_no_tool_turn_returns_first_completion(agent):
+    agent.client.converse.return_value = converse_response([{'text': 'Hi there!'}])
+
+    assert agent.call_bedrock('Hello', tools=TOOLS) == {'completion': 'Hi there!'}
+    assert agent.client.converse.call_count == 1
+
+    stats = agent_metrics.snapshot()['direct']
+    assert stats['requests'] == 1
+    assert stats['converse_calls'] == 1
+    assert (stats['input_tokens'], stats['output_tokens']) == (10, 5)
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_tool_turn_makes_one_follow_up(mock_get_user, agent):
+    agent.client.converse.side_effect = [
+        converse_response([{'toolUse': TOOL_USE}], 20, 8),
+        converse_response([{'text': 'Added Hey Jude to Road Trip.'}], 40, 12)
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='Track added to playlist'):
+        result = agent.call_bedrock('Add Hey Jude to Road Trip', auth_header='Bearer token', tools=TOOLS)
+
+    assert result == {'completion': 'Added Hey Jude to Road Trip.'}
+    assert agent.client.converse.call_count == 2
+
+    follow_up = agent.client.converse.call_args.kwargs['messages']
+    assert follow_up[-1]['content'][0]['toolResult']['content'] == [{'text': 'Track added to playlist'}]
+    assert not any('format this response' in block.get('text', '') for message in follow_up for block in message['content'])
+
+    stats = agent_metrics.snapshot()['tool']
+    assert stats['converse_calls'] == 2
+    assert (stats['input_tokens'], stats['output_tokens']) == (60, 20)
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_tool_with_template_skips_follow_up(mock_get_user, agent):
+    agent.local_templates = True
+    agent.client.converse.return_value = converse_response([{'toolUse': TOOL_USE}])
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='Track added to playlist'):
+        result = agent.call_bedrock('Add Hey Jude to Road Trip', tools=TOOLS)
+
+    assert result == {'completion': 'Added Hey Jude to your Road Trip playlist.'}
+    assert agent.client.converse.call_count == 1
+    assert 'template' in agent_metrics.snapshot()
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_tool_error_is_not_templated(mock_get_user, agent):
+    agent.local_templates = True
+    agent.client.converse.side_effect = [
+        converse_response([{'toolUse': TOOL_USE}]),
+        converse_response([{'text': 'Spotify returned an error.'}])
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='Error: 403'):
+        result = agent.call_bedrock('Add Hey Jude to Road Trip', tools=TOOLS)
+
+    assert result == {'completion': 'Spotify returned an error.'}
+    assert agent.client.converse.call_count == 2
+
+def test_format_pass_keeps_second_call(agent):
+    agent.format_pass = True
+    agent.client.converse.side_effect = [
+        converse_response([{'text': 'hi'}]),
+        converse_response([{'text': 'Hi there!'}])
+    ]
+
+    assert agent.call_bedrock('Hello', tools=TOOLS) == {'completion': 'Hi there!'}
+    assert agent.client.converse.call_count == 2
+    assert 'direct_formatted' in agent_metrics.snapshot()
+
+def stream_response(content, delay=0, input_tokens=10, output_tokens=5):
+    """Stubbed converse_stream response: text is sent in words, tool input in two JSON fragments"""
+    def events():
+        yield {'messageStart': {'role': 'assistant'}}
+        for index, block in enumerate(content):
+            if 'text' in block:
+                for word in block['text'].split(' '):
+                    time.sleep(delay)
+                    yield {'contentBlockDelta': {'contentBlockIndex': index, 'delta': {'text': word + ' '}}}
+            else:
+                tool_use = block['toolUse']
+                tool_input = json.dumps(tool_use['input'])
+                yield {'contentBlockStart': {'contentBlockIndex': index, 'start': {'toolUse': {'toolUseId': tool_use['toolUseId'], 'name': tool_use['name']}}}}
+                for fragment in (tool_input[:5], tool_input[5:]):
+                    yield {'contentBlockDelta': {'contentBlockIndex': index, 'delta': {'toolUse': {'input': fragment}}}}
+            yield {'contentBlockStop': {'contentBlockIndex': index}}
+        yield {'messageStop': {'stopReason': 'tool_use' if any('toolUse' in block for block in content) else 'end_turn'}}
+        yield {'metadata': {'usage': {'inputTokens': input_tokens, 'outputTokens': output_tokens}, 'metrics': {'latencyMs': 1}}}
+    return {'stream': events()}
+
+def test_stream_no_tool_turn(agent):
+    agent.client.converse_stream.return_value = stream_response([{'text': 'Hi there'}])
+
+    events = list(agent.stream_bedrock('Hello', tools=TOOLS))
+
+    assert [event['type'] for event in events] == ['token', 'token', 'done']
+    assert events[-1]['completion'] == 'Hi there '
+    assert agent.client.converse_stream.call_count == 1
+    assert agent_metrics.snapshot()['stream_direct']['input_tokens'] == 10
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_stream_tool_turn_emits_tool_events(mock_get_user, agent):
+    agent.client.converse_stream.side_effect = [
+        stream_response([{'toolUse': TOOL_USE}]),
+        stream_response([{'text': 'Added it'}])
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='Track added to playlist') as mock_call_tool:
+        events = list(agent.stream_bedrock('Add Hey Jude to Road Trip', tools=TOOLS))
+
+    mock_call_tool.assert_called_once_with('spotify_add_to_playlist', TOOL_USE['input'], 'user')
+    assert [event['type'] for event in events] == ['tool_start', 'tool_end', 'token', 'token', 'done']
+    assert events[0]['name'] == 'spotify_add_to_playlist'
+    assert events[-1]['completion'] == 'Added it '
+
+    follow_up = agent.client.converse_stream.call_args.kwargs['messages']
+    assert follow_up[1] == {'role': 'assistant', 'content': [{'toolUse': TOOL_USE}]}
+    assert follow_up[2]['content'][0]['toolResult']['toolUseId'] == 'tool-1'
+
+    stats = agent_metrics.snapshot()['stream_tool']
+    assert (stats['converse_calls'], stats['input_tokens']) == (2, 20)
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_stream_steps_are_kept_apart(mock_get_user, agent):
+    agent.client.converse_stream.side_effect = [
+        stream_response([{'text': 'Let me check.'}, {'toolUse': TOOL_USE}]),
+        stream_response([{'text': 'Added it.'}])
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='Track added to playlist'), app.app_context():
+        events = list(agent.stream_bedrock('Add Hey Jude to Road Trip', tools=TOOLS))
+        turn = request_cached('agent_turn', lambda: None)
+
+    assert events[-1]['completion'] == 'Let me check. \n\nAdded it. '
+    assert ''.join(event['text'] for event in events if event['type'] == 'token') == events[-1]['completion']
+    assert turn[-1]['content'] == [{'text': 'Added it. '}]
+
+def test_stream_text_of_a_dropped_fallback_step_is_not_stored(agent):
+    agent.tool_pruning = True
+    agent.client.converse_stream.side_effect = [
+        stream_response([{'text': 'One moment.'}, {'toolUse': {'toolUseId': 'more', 'name': MORE_TOOLS_NAME, 'input': {}}}]),
+        stream_response([{'text': 'Hi there!'}])
+    ]
+
+    with app.app_context():
+        events = list(agent.stream_bedrock('Hello', tools=TOOLS + GMAIL_TOOLS))
+        turn = request_cached('agent_turn', lambda: None)
+
+    assert events[-1]['completion'] == 'One moment. \n\nHi there! '
+    assert turn == [{'role': 'user', 'content': [{'text': 'Hello'}]}, {'role': 'assistant', 'content': [{'text': 'Hi there! '}]}]
+
+def test_stream_time_to_first_token(agent):
+    # 20 words, 10ms apart: the first token must arrive long before the last
+    text = ' '.join(f'word{i}' for i in range(20))
+    agent.client.converse_stream.return_value = stream_response([{'text': text}], delay=0.01)
+
+    start = time.perf_counter()
+    events = agent.stream_bedrock('Hello', tools=TOOLS)
+    next(events)
+    ttft = time.perf_counter() - start
+    list(events)
+    total = time.perf_counter() - start
+
+    assert ttft < total / 4
+    stats = agent_metrics.snapshot()['stream_direct']
+    assert stats['avg_ttft_ms'] < stats['avg_latency_ms'] / 4
+
+def tool_use(tool_use_id, name, tool_input=None):
+    return {'toolUse': {'toolUseId': tool_use_id, 'name': name, 'input': tool_input or {}}}
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_chained_tools(mock_get_user, agent):
+    agent.client.converse.side_effect = [
+        converse_response([tool_use('t1', 'spotify_get_artist_top_tracks', {'artist_name': 'Drake'})]),
+        converse_response([{'text': 'Sending them now.'}, tool_use('t2', 'gmail_send_email', {'to': 'me@example.com'})]),
+        converse_response([{'text': 'I emailed you the tracks.'}])
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', side_effect=['God\'s Plan', 'Email sent successfully']) as mock_call_tool, \
+         app.app_context():
+        result = agent.call_bedrock("Email me Drake's top tracks", tools=TOOLS)
+        trace = request_cached('agent_trace', lambda: None)
+
+    assert result == {'completion': 'I emailed you the tracks.'}
+    assert [c.args[0] for c in mock_call_tool.call_args_list] == ['spotify_get_artist_top_tracks', 'gmail_send_email']
+    assert agent.client.converse.call_count == 3
+
+    assert trace['stop_reason'] == 'end_turn'
+    assert [step['stop_reason'] for step in trace['steps']] == ['tool_use', 'tool_use', 'end_turn']
+    assert [call['name'] for step in trace['steps'] for call in step['tool_calls']] == ['spotify_get_artist_top_tracks', 'gmail_send_email']
+    assert all('latency_ms' in call for step in trace['steps'] for call in step['tool_calls'])
+    assert trace['tokens'] == 45
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_all_tool_uses_of_a_step_are_answered_together(mock_get_user, agent):
+    agent.client.converse.side_effect = [
+        converse_response([tool_use('t1', 'spotify_get_artist_info'), tool_use('t2', 'spotify_get_artist_info')]),
+        converse_response([{'text': 'Both artists.'}])
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', side_effect=['Drake', 'Adele']):
+        agent.call_bedrock('Tell me about Drake and Adele', tools=TOOLS)
+
+    results = agent.client.converse.call_args.kwargs['messages'][-1]['content']
+    assert [r['toolResult']['toolUseId'] for r in results] == ['t1', 't2']
+    assert [r['toolResult']['content'][0]['text'] for r in results] == ['Drake', 'Adele']
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_tool_error_is_sent_to_the_model(mock_get_user, agent):
+    agent.client.converse.side_effect = [
+        converse_response([tool_use('t1', 'spotify_get_user_playlists')]),
+        converse_response([{'text': 'Spotify is unavailable.'}])
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', side_effect=Exception('timeout')):
+        assert agent.call_bedrock('List my playlists', tools=TOOLS) == {'completion': 'Spotify is unavailable.'}
+
+    tool_result = agent.client.converse.call_args.kwargs['messages'][-1]['content'][0]['toolResult']
+    assert tool_result['status'] == 'error'
+
+@pytest.mark.parametrize('limit, value, converse_calls', [
+    ('max_iterations', 2, 3),
+    ('token_budget', 25, 2),
+    ('deadline_seconds', 0, 1)
+])
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_loop_stops_at_limits(mock_get_user, agent, limit, value, converse_calls):
+    setattr(agent, limit, value)
+    agent.client.converse.side_effect = lambda **kwargs: converse_response([tool_use('t', 'spotify_search_tracks')])
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='a track'), app.app_context():
+        result = agent.call_bedrock('Keep searching', tools=TOOLS)
+        trace = request_cached('agent_trace', lambda: None)
+
+    assert result == {'completion': LIMIT_REACHED_MESSAGE}
+    assert agent.client.converse.call_count == converse_calls
+    assert trace['stop_reason'] == {'deadline_seconds': 'deadline'}.get(limit, limit)
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_stream_loop_stops_at_limit(mock_get_user, agent):
+    agent.max_iterations = 1
+    agent.client.converse_stream.side_effect = lambda **kwargs: stream_response([{'text': 'Searching'}, tool_use('t', 'spotify_search_tracks')])
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='a track'), app.app_context():
+        events = list(agent.stream_bedrock('Keep searching', tools=TOOLS))
+        turn = request_cached('agent_turn', lambda: None)
+
+    assert [event['type'] for event in events].count('tool_start') == 1
+    # Both steps streamed their text before the notice, each step apart
+    assert events[-1]['completion'] == f'Searching \n\nSearching \n\n{LIMIT_REACHED_MESSAGE}'
+    assert ''.join(event['text'] for event in events if event['type'] == 'token') == events[-1]['completion']
+    # Only the last step's text is stored for the session
+    assert turn[-1]['content'] == [{'text': f'Searching \n\n{LIMIT_REACHED_MESSAGE}'}]
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_tool_uses_of_a_step_run_in_parallel(mock_get_user, agent):
+    agent.client.converse.side_effect = [
+        converse_response([tool_use(f't{i}', 'spotify_get_artist_info', {'artist_name': name}) for i, name in enumerate(['Drake', 'Adele', 'Queen'])]),
+        converse_response([{'text': 'Three artists.'}])
+    ]
+
+    def call_app_tool(tool_name, tool_args, user_id):
+        # Later calls finish first, results must still come back in request order
+        time.sleep({'Drake': 0.3, 'Adele': 0.2, 'Queen': 0.1}[tool_args['artist_name']])
+        return tool_args['artist_name']
+
+    with patch.object(agent.app_manager, 'call_app_tool', side_effect=call_app_tool):
+        start = time.perf_counter()
+        agent.call_bedrock('Tell me about Drake, Adele and Queen', tools=TOOLS)
+        elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.5
+    results = agent.client.converse.call_args.kwargs['messages'][-1]['content']
+    assert [r['toolResult']['content'][0]['text'] for r in results] == ['Drake', 'Adele', 'Queen']
+
+def slow_result(latency):
+    time.sleep(latency)
+    return 'done'
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_tools_past_the_deadline_time_out(mock_get_user, agent):
+    agent.deadline_seconds = 0.2
+    agent.client.converse.side_effect = [
+        converse_response([tool_use('fast', 'spotify_get_artist_info', {'latency': 0}), tool_use('slow', 'spotify_get_artist_info', {'latency': 1})]),
+        converse_response([{'text': 'Only one answer.'}])
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', side_effect=lambda name, args, user: slow_result(args['latency'])):
+        agent.call_bedrock('Two artists', tools=TOOLS)
+
+    results = agent.client.converse.call_args.kwargs['messages'][-1]['content']
+    assert [r['toolResult'].get('status') for r in results] == [None, 'error']
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_tools_waiting_for_a_slot_past_the_deadline_time_out(mock_get_user, agent):
+    agent.deadline_seconds = 0.2
+    agent.tool_executor = ToolExecutor(max_workers=2, per_user_limit=1)
+    agent.client.converse.side_effect = [
+        converse_response([tool_use('slow', 'spotify_get_artist_info', {'latency': 1}), tool_use('queued', 'spotify_get_artist_info', {'latency': 0})]),
+        converse_response([{'text': 'No answers.'}])
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', side_effect=lambda name, args, user: slow_result(args['latency'])):
+        start = time.perf_counter()
+        agent.call_bedrock('Two artists', tools=TOOLS)
+
+    assert time.perf_counter() - start < 0.8
+    results = agent.client.converse.call_args.kwargs['messages'][-1]['content']
+    assert [r['toolResult'].get('status') for r in results] == ['error', 'error']
+
+def test_history_is_sent_as_messages(agent):
+    agent.client.converse.return_value = converse_response([{'text': 'Sure.'}])
+    history = [{'user': 'Hi', 'assistant': 'Hello!'}, {'user': 'Play something', 'assistant': 'x' * 20000}]
+
+    agent.call_bedrock('Thanks', history, tools=TOOLS)
+
+    messages = agent.client.converse.call_args.kwargs['messages']
+    assert [message['role'] for message in messages] == ['user', 'assistant', 'user', 'assistant', 'user']
+    assert messages[-1]['content'] == [{'text': 'Thanks'}]
+    assert 'characters truncated' in messages[3]['content'][0]['text']
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_session_turns_replace_history(mock_get_user, agent):
+    agent.client.converse.side_effect = [
+        converse_response([{'toolUse': TOOL_USE}]),
+        converse_response([{'text': 'Added it.'}])
+    ]
+    turns = [[{'role': 'user', 'content': [{'text': 'Hi'}]}, {'role': 'assistant', 'content': [{'text': 'Hello!'}]}]]
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='Track added to playlist'), app.app_context():
+        agent.call_bedrock('Add Hey Jude', auth_header='Bearer token', tools=TOOLS, turns=turns)
+        turn = request_cached('agent_turn', lambda: None)
+
+    first_call = agent.client.converse.call_args_list[0].kwargs['messages']
+    assert [message['content'][0] for message in first_call[:3]] == [{'text': 'Hi'}, {'text': 'Hello!'}, {'text': 'Add Hey Jude'}]
+    # The stored turn starts at the prompt and ends with the answer, tool messages in between
+    assert [message['role'] for message in turn] == ['user', 'assistant', 'user', 'assistant']
+    assert turn[0]['content'] == [{'text': 'Add Hey Jude'}]
+    assert 'toolResult' in turn[2]['content'][0]
+    assert turn[-1]['content'] == [{'text': 'Added it.'}]
+
+def test_session_summary_is_sent_as_system_prompt(agent):
+    agent.client.converse.return_value = converse_response([{'text': 'Sure.'}])
+
+    agent.call_bedrock('And the second one?', tools=TOOLS, turns=[], summary='The user asked about two playlists.')
+
+    request = agent.client.converse.call_args.kwargs
+    assert request['system'] == [
+        {'text': SYSTEM_PROMPT},
+        {'text': 'Summary of the earlier conversation:\nThe user asked about two playlists.'}
+    ]
+    assert request['messages'] == [{'role': 'user', 'content': [{'text': 'And the second one?'}]}]
+
+def test_summarize_conversation(agent):
+    agent.client.converse.return_value = converse_response([{'text': 'The user made a Road Trip playlist.'}])
+    turns = [[
+        {'role': 'user', 'content': [{'text': 'Make a Road Trip playlist'}]},
+        {'role': 'assistant', 'content': [{'text': 'Done.'}]}
+    ]]
+
+    summary = agent.summarize_conversation('The user said hi.', turns)
+
+    assert summary == 'The user made a Road Trip playlist.'
+    request = agent.client.converse.call_args.kwargs
+    assert 'toolConfig' not in request
+    text = request['messages'][0]['content'][0]['text']
+    assert 'The user said hi.' in text and 'User: Make a Road Trip playlist' in text
+    assert agent_metrics.snapshot()['summary']['converse_calls'] == 1
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_prompt_cache_points_close_the_static_prefix(mock_get_user, agent):
+    agent.prompt_cache = True
+    cached_usage = {'inputTokens': 30, 'outputTokens': 5, 'cacheReadInputTokens': 1200, 'cacheWriteInputTokens': 0}
+    agent.client.converse.side_effect = [
+        {**converse_response([{'toolUse': TOOL_USE}]), 'usage': cached_usage},
+        {**converse_response([{'text': 'Added it.'}]), 'usage': cached_usage}
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='Track added to playlist'):
+        agent.call_bedrock('Add Hey Jude', auth_header='Bearer token', tools=TOOLS, summary='Earlier chat')
+
+    first, second = [c.kwargs for c in agent.client.converse.call_args_list]
+    assert first['toolConfig']['tools'] == TOOLS + [CACHE_POINT]
+    # The summary changes between turns, so it goes after the cache point
+    assert first['system'] == [{'text': SYSTEM_PROMPT}, CACHE_POINT, {'text': 'Summary of the earlier conversation:\nEarlier chat'}]
+    assert second['toolConfig'] == first['toolConfig'] and second['system'] == first['system']
+    # The conversation so far is checkpointed too, without changing the messages kept for the next step
+    assert second['messages'][-1]['content'][-1] == CACHE_POINT
+    assert [message['content'][-1] for message in second['messages'][:2]] == [{'text': 'Add Hey Jude'}, {'toolUse': TOOL_USE}]
+    assert TOOLS == [{'toolSpec': {'name': 'spotify_add_to_playlist', 'inputSchema': {'json': {}}}}]
+
+    stats = agent_metrics.snapshot()['tool']
+    assert stats['cache_read_tokens'] == 2400
+    assert stats['cache_read_ratio'] == 2400 / 2460
+
+def test_no_cache_points_by_default(agent):
+    agent.client.converse.return_value = converse_response([{'text': 'Hi'}])
+
+    agent.call_bedrock('Hello', tools=TOOLS)
+
+    request = agent.client.converse.call_args.kwargs
+    assert request['toolConfig'] == {'tools': TOOLS}
+    assert request['system'] == [{'text': SYSTEM_PROMPT}]
+
+GMAIL_TOOLS = [{'toolSpec': {'name': 'gmail_send_email', 'description': 'Send an email', 'inputSchema': {'json': {}}}}]
+
+def test_pruned_tools_fall_back_to_the_full_set(agent):
+    agent.tool_pruning = True
+    agent.client.converse.side_effect = [
+        converse_response([{'toolUse': {'toolUseId': 'more', 'name': MORE_TOOLS_NAME, 'input': {}}}]),
+        converse_response([{'text': 'Hi there!'}])
+    ]
+
+    with app.app_context():
+        result = agent.call_bedrock('Hello', tools=TOOLS + GMAIL_TOOLS)
+        trace = request_cached('agent_trace', lambda: None)
+
+    first, second = [c.kwargs for c in agent.client.converse.call_args_list]
+    assert [tool['toolSpec']['name'] for tool in first['toolConfig']['tools']] == [MORE_TOOLS_NAME]
+    assert second['toolConfig']['tools'] == TOOLS + GMAIL_TOOLS
+    # The step that asked for more tools is not part of the conversation
+    assert second['messages'] == [{'role': 'user', 'content': [{'text': 'Hello'}]}]
+    assert result == {'completion': 'Hi there!'}
+    assert trace['tools'] == {'offered': 1, 'total': 2, 'fallback': True}
+
+PLAYLIST_TOOLS = [{'toolSpec': {'name': 'spotify_get_user_playlists', 'inputSchema': {'json': {}}}}]
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_routed_prompt_skips_the_model(mock_get_user, agent):
+    agent.intent_routing = True
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='Road Trip\nWorkout') as mock_tool, app.app_context():
+        result = agent.call_bedrock('List my playlists', auth_header='Bearer token', tools=PLAYLIST_TOOLS)
+        turn = request_cached('agent_turn', lambda: None)
+        trace = request_cached('agent_trace', lambda: None)
+
+    assert result == {'completion': 'Here are your Spotify playlists:\n\n1. Road Trip\n2. Workout'}
+    agent.client.converse.assert_not_called()
+    mock_tool.assert_called_once_with('spotify_get_user_playlists', {}, 'user')
+    assert [message['role'] for message in turn] == ['user', 'assistant', 'user', 'assistant']
+    assert trace['stop_reason'] == 'router' and trace['route']['status'] == 'success'
+    assert agent_metrics.snapshot()['router']['converse_calls'] == 0
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_routed_prompt_falls_through_when_the_tool_fails(mock_get_user, agent):
+    agent.intent_routing = True
+    agent.client.converse.return_value = converse_response([{'text': 'Spotify is not responding.'}])
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='Error getting playlists: 503'):
+        result = agent.call_bedrock('List my playlists', auth_header='Bearer token', tools=PLAYLIST_TOOLS)
+
+    assert result == {'completion': 'Spotify is not responding.'}
+    assert agent.intent_router.stats()['fallthroughs'] == 1
+    # The model answers from the routed result instead of calling the tool again
+    messages = agent.client.converse.call_args.kwargs['messages']
+    assert [message['role'] for message in messages] == ['user', 'assistant', 'user']
+    assert messages[1]['content'][0]['toolUse']['name'] == 'spotify_get_user_playlists'
+    assert messages[2]['content'][0]['toolResult']['content'] == [{'text': 'Error getting playlists: 503'}]
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_stream_routed_prompt(mock_get_user, agent):
+    agent.intent_routing = True
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value=''):
+        events = list(agent.stream_bedrock('show my playlists', auth_header='Bearer token', tools=PLAYLIST_TOOLS))
+
+    assert [event['type'] for event in events] == ['tool_start', 'tool_end', 'token', 'done']
+    assert events[-1]['completion'] == "You don't have any Spotify playlists yet."
+
+@patch('services.bedrock_agent_service.get_request_user_id', return_value='user')
+def test_prefetched_tool_data_is_used(mock_get_user, agent):
+    agent.prefetch = True
+    agent.client.converse.side_effect = [
+        converse_response([{'toolUse': {'toolUseId': 't1', 'name': 'spotify_get_user_playlists', 'input': {}}}]),
+        converse_response([{'text': 'You have Road Trip.'}])
+    ]
+
+    with patch.object(agent.app_manager, 'call_app_tool', return_value='Road Trip') as mock_tool, app.app_context():
+        result = agent.call_bedrock('What playlists do I have?', auth_header='Bearer token', tools=PLAYLIST_TOOLS)
+        trace = request_cached('agent_trace', lambda: None)
+
+    assert result == {'completion': 'You have Road Trip.'}
+    # Started before the first converse call, and the model's call reused it
+    mock_tool.assert_called_once_with('spotify_get_user_playlists', {}, 'user')
+    assert trace['steps'][0]['tool_calls'][0]['prefetched'] is True
+    assert trace['prefetch'] == {'started': ['spotify_get_user_playlists'], 'used': 1, 'wasted': 0, 'cancelled': 0}
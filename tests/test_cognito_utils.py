@@ -0,0 +1,160 @@
+import json
+import time
+import pytest
+import jwt
+from unittest.mock import Mock, patch
+from cryptography.hazmat.primitives.asymmetric import rsa
+from werkzeug.exceptions import Unauthorized
+from services.utils import cognito_utils
+from services.utils.cognito_utils import CognitoJWKS, CognitoTokenVerifier, JWKSUnavailableError, get_user_from_token, create_token_verifier
+
+REGION = 'us-east-1'
+USER_POOL_ID = 'us-east-1_testpool'
+CLIENT_ID = 'test_client_id'
+ISSUER = f"https://cognito-idp.{REGION}.amazonaws.com/{USER_POOL_ID}"
+
+def make_key_pair():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+def make_jwk(private_key, kid):
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({'kid': kid, 'alg': 'RS256', 'use': 'sig'})
+    return jwk
+
+def make_token(private_key, kid='key-1', **overrides):
+    claims = {
+        'sub': 'sub-uuid',
+        'username': 'test_user',
+        'iss': ISSUER,
+        'client_id': CLIENT_ID,
+        'token_use': 'access',
+        'exp': int(time.time()) + 3600,
+        'iat': int(time.time())
+    }
+    claims.update(overrides)
+    return jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': kid})
+
+def jwks_response(*jwks):
+    response = Mock()
+    response.status_code = 200
+    response.json.return_value = {'keys': list(jwks)}
+    return response
+
+@pytest.fixture(scope='module')
+def private_key():
+    return make_key_pair()
+
+@pytest.fixture
+def verifier(private_key):
+    with patch('services.utils.cognito_utils.requests.get', return_value=jwks_response(make_jwk(private_key, 'key-1'))) as mock_get:
+        yield CognitoTokenVerifier(USER_POOL_ID, CLIENT_ID, region=REGION), mock_get
+
+def test_verify_valid_token(verifier, private_key):
+    token_verifier, _ = verifier
+    claims = token_verifier.verify(make_token(private_key))
+    assert claims['username'] == 'test_user'
+
+def test_jwks_fetched_once(verifier, private_key):
+    token_verifier, mock_get = verifier
+    for _ in range(5):
+        token_verifier.verify(make_token(private_key))
+    mock_get.assert_called_once_with(f"{ISSUER}/.well-known/jwks.json", timeout=5)
+
+def test_verify_expired_token(verifier, private_key):
+    token_verifier, _ = verifier
+    with pytest.raises(jwt.ExpiredSignatureError):
+        token_verifier.verify(make_token(private_key, exp=int(time.time()) - 10))
+
+def test_verify_wrong_issuer(verifier, private_key):
+    token_verifier, _ = verifier
+    with pytest.raises(jwt.InvalidIssuerError):
+        token_verifier.verify(make_token(private_key, iss='https://cognito-idp.us-east-1.amazonaws.com/other'))
+
+def test_verify_wrong_client_id(verifier, private_key):
+    token_verifier, _ = verifier
+    with pytest.raises(jwt.InvalidTokenError):
+        token_verifier.verify(make_token(private_key, client_id='other_client'))
+
+def test_verify_id_token_rejected(verifier, private_key):
+    token_verifier, _ = verifier
+    with pytest.raises(jwt.InvalidTokenError):
+        token_verifier.verify(make_token(private_key, token_use='id'))
+
+def test_verify_bad_signature(verifier, private_key):
+    token_verifier, _ = verifier
+    forged = make_token(make_key_pair(), kid='key-1')
+    with pytest.raises(jwt.InvalidSignatureError):
+        token_verifier.verify(forged)
+
+def test_jwks_refetched_on_key_rotation(private_key):
+    rotated_key = make_key_pair()
+    responses = [
+        jwks_response(make_jwk(private_key, 'key-1')),
+        jwks_response(make_jwk(private_key, 'key-1'), make_jwk(rotated_key, 'key-2'))
+    ]
+    with patch('services.utils.cognito_utils.requests.get', side_effect=responses) as mock_get:
+        token_verifier = CognitoTokenVerifier(USER_POOL_ID, CLIENT_ID, region=REGION, jwks=CognitoJWKS('url', refresh_interval=0))
+        token_verifier.verify(make_token(private_key, kid='key-1'))
+        claims = token_verifier.verify(make_token(rotated_key, kid='key-2'))
+
+    assert claims['username'] == 'test_user'
+    assert mock_get.call_count == 2
+
+def test_unknown_kid_refetch_is_rate_limited(private_key):
+    with patch('services.utils.cognito_utils.requests.get', return_value=jwks_response(make_jwk(private_key, 'key-1'))) as mock_get:
+        token_verifier = CognitoTokenVerifier(USER_POOL_ID, CLIENT_ID, region=REGION)
+        for _ in range(3):
+            with pytest.raises(jwt.InvalidTokenError):
+                token_verifier.verify(make_token(make_key_pair(), kid='unknown'))
+
+    assert mock_get.call_count == 1
+
+def test_get_user_from_token_local(verifier, private_key):
+    token_verifier, _ = verifier
+    with patch.object(cognito_utils, 'token_verifier', token_verifier), \
+         patch('services.utils.cognito_utils.get_client') as mock_get_client:
+        assert get_user_from_token(f"Bearer {make_token(private_key)}") == 'test_user'
+        mock_get_client.assert_not_called()
+
+def test_get_user_from_token_invalid_local(verifier, private_key):
+    token_verifier, _ = verifier
+    with patch.object(cognito_utils, 'token_verifier', token_verifier), \
+         patch('services.utils.cognito_utils.get_client') as mock_get_client:
+        with pytest.raises(Unauthorized):
+            get_user_from_token(f"Bearer {make_token(private_key, exp=int(time.time()) - 10)}")
+        mock_get_client.assert_not_called()
+
+def test_token_without_sub_is_unauthorized(verifier, private_key):
+    token_verifier, _ = verifier
+    token = make_token(private_key)
+    claims = jwt.decode(token, options={'verify_signature': False})
+    del claims['sub']
+    with patch.object(cognito_utils, 'token_verifier', token_verifier):
+        with pytest.raises(Unauthorized):
+            get_user_from_token(f"Bearer {jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': 'key-1'})}")
+
+def test_no_local_verifier_without_client_id():
+    assert create_token_verifier(USER_POOL_ID, None) is None
+    assert create_token_verifier(None, CLIENT_ID) is None
+    assert isinstance(create_token_verifier(USER_POOL_ID, CLIENT_ID), CognitoTokenVerifier)
+    with pytest.raises(ValueError):
+        CognitoTokenVerifier(USER_POOL_ID, None)
+
+def test_get_user_from_token_falls_back_when_jwks_unavailable(private_key):
+    token_verifier = Mock()
+    token_verifier.verify.side_effect = JWKSUnavailableError('timeout')
+    with patch.object(cognito_utils, 'token_verifier', token_verifier), \
+         patch('services.utils.cognito_utils.get_client') as mock_get_client:
+        mock_get_client.return_value.get_user.return_value = {'Username': 'remote_user'}
+        assert get_user_from_token('Bearer some_token') == 'remote_user'
+
+def test_get_user_from_token_without_user_pool():
+    with patch.object(cognito_utils, 'token_verifier', None), \
+         patch('services.utils.cognito_utils.get_client') as mock_get_client:
+        mock_get_client.return_value.get_user.return_value = {'Username': 'remote_user'}
+        assert get_user_from_token('Bearer some_token') == 'remote_user'
+        mock_get_client.return_value.get_user.assert_called_once_with(AccessToken='some_token')
+
+def test_get_user_from_token_missing_header():
+    with pytest.raises(Unauthorized):
+        get_user_from_token(None)
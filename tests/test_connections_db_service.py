@@ -0,0 +1,216 @@
+import pytest
+import json
+import threading
+import boto3
+from moto import mock_aws
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+import services.connections_db_service as connections_db_service
+from server import app, agent
+from services.connections_db_service import connect_app, remove_app
+from services.utils.connections_store import UserItemStore
+from services.utils.user_cache import user_tools_cache
+from services.utils.tools.app_manager import AppManager
+
+USER_ID = 'connections_user'
+TOKENS = {'access_token': 'token', 'refresh_token': 'refresh', 'expires_in': 3600}
+
+class LocalTable:
+    """Stand-in for the DynamoDB table: each call is atomic, like a single-item write in DynamoDB.
+
+    Counts calls per operation so tests can check round trips.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.lock = threading.RLock()
+        self.calls = {}
+
+    def __getattr__(self, name):
+        method = getattr(self.table, name)
+
+        def call(*args, **kwargs):
+            with self.lock:
+                self.calls[name] = self.calls.get(name, 0) + 1
+                return method(*args, **kwargs)
+        return call
+
+def add_app_connection(user_id, app_name, app_token=None):
+    return UserItemStore(connections_db_service.table).add_app(user_id, app_name, app_token)
+
+def remove_app_connection(user_id, app_name):
+    return UserItemStore(connections_db_service.table).remove_app(user_id, app_name)
+
+def tool_names(tools):
+    return {tool['toolSpec']['name'] for tool in tools}
+
+@pytest.fixture
+def local_table():
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        table = dynamodb.create_table(
+            TableName='link-connections-table',
+            KeySchema=[{'AttributeName': 'userId', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'userId', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        local = LocalTable(table)
+        with patch('services.connections_db_service.table', local), \
+             patch('services.connections_db_service.get_user_from_token', return_value=USER_ID):
+            yield local
+    user_tools_cache.invalidate(USER_ID)
+
+def get_item(local_table):
+    return local_table.table.get_item(Key={'userId': USER_ID}).get('Item', {})
+
+def test_connect_app_single_round_trip(local_table):
+    local_table.table.put_item(Item={'userId': USER_ID, 'connectedApps': [], 'appTokens': {}})
+
+    with app.app_context():
+        connect_app('Spotify', 'Bearer testtoken', TOKENS)
+
+    item = get_item(local_table)
+    assert item['connectedApps'] == ['spotify']
+    assert item['appTokens']['spotify']['access_token'] == 'token'
+    assert item['version'] == 1
+    assert local_table.calls == {'update_item': 1}
+
+def test_connect_app_new_user(local_table):
+    assert add_app_connection(USER_ID, 'spotify', {'access_token': 'token'}) == ['spotify']
+
+    item = get_item(local_table)
+    assert item['appTokens'] == {'spotify': {'access_token': 'token'}}
+    assert item['version'] == 1
+
+def test_connect_second_app_keeps_existing_tokens(local_table):
+    add_app_connection(USER_ID, 'spotify', {'access_token': 'spotify_token'})
+    local_table.calls.clear()
+
+    assert add_app_connection(USER_ID, 'gmail', {'access_token': 'gmail_token'}) == ['spotify', 'gmail']
+
+    item = get_item(local_table)
+    assert item['appTokens']['spotify']['access_token'] == 'spotify_token'
+    assert item['appTokens']['gmail']['access_token'] == 'gmail_token'
+    assert local_table.calls == {'update_item': 1}
+
+def test_reconnect_updates_tokens_without_duplicating(local_table):
+    add_app_connection(USER_ID, 'spotify', {'access_token': 'old'})
+    assert add_app_connection(USER_ID, 'spotify', {'access_token': 'new'}) == ['spotify']
+
+    item = get_item(local_table)
+    assert item['connectedApps'] == ['spotify']
+    assert item['appTokens']['spotify']['access_token'] == 'new'
+
+def test_connect_legacy_item_without_token_map(local_table):
+    local_table.table.put_item(Item={'userId': USER_ID, 'connectedApps': ['gmail']})
+
+    assert add_app_connection(USER_ID, 'spotify', {'access_token': 'token'}) == ['gmail', 'spotify']
+    assert get_item(local_table)['appTokens'] == {'spotify': {'access_token': 'token'}}
+
+def test_remove_app_keeps_other_tokens(local_table):
+    add_app_connection(USER_ID, 'spotify', {'access_token': 'spotify_token'})
+    add_app_connection(USER_ID, 'gmail', {'access_token': 'gmail_token'})
+
+    assert remove_app_connection(USER_ID, 'spotify') == ['gmail']
+
+    item = get_item(local_table)
+    assert item['connectedApps'] == ['gmail']
+    assert item['appTokens'] == {'gmail': {'access_token': 'gmail_token'}}
+
+def test_remove_app_not_connected_skips_write(local_table):
+    add_app_connection(USER_ID, 'gmail', {'access_token': 'gmail_token'})
+    local_table.calls.clear()
+
+    assert remove_app_connection(USER_ID, 'spotify') == ['gmail']
+    assert local_table.calls == {'get_item': 1}
+
+def test_remove_app_retries_on_concurrent_write(local_table):
+    add_app_connection(USER_ID, 'spotify', {'access_token': 'spotify_token'})
+    update_item = local_table.table.update_item
+
+    def connect_gmail_first(**kwargs):
+        # Another worker connects gmail between our read and our write
+        local_table.table.update_item = update_item
+        add_app_connection(USER_ID, 'gmail', {'access_token': 'gmail_token'})
+        return update_item(**kwargs)
+
+    local_table.table.update_item = connect_gmail_first
+    assert remove_app_connection(USER_ID, 'spotify') == ['gmail']
+
+    item = get_item(local_table)
+    assert item['connectedApps'] == ['gmail']
+    assert item['appTokens'] == {'gmail': {'access_token': 'gmail_token'}}
+
+def test_concurrent_connects_lose_no_updates(local_table):
+    apps = [f'app{i}' for i in range(10)]
+    threads = [threading.Thread(target=add_app_connection, args=(USER_ID, name, {'access_token': name})) for name in apps]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    item = get_item(local_table)
+    assert sorted(item['connectedApps']) == sorted(apps)
+    assert set(item['appTokens']) == set(apps)
+    assert item['version'] == len(apps)
+
+def test_concurrent_connects_and_removes(local_table):
+    for name in ['app0', 'app1', 'app2']:
+        add_app_connection(USER_ID, name, {'access_token': name})
+
+    threads = [threading.Thread(target=remove_app_connection, args=(USER_ID, name)) for name in ['app0', 'app1', 'app2']]
+    threads += [threading.Thread(target=add_app_connection, args=(USER_ID, name, {'access_token': name})) for name in ['app3', 'app4']]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    item = get_item(local_table)
+    assert sorted(item['connectedApps']) == ['app3', 'app4']
+    assert set(item['appTokens']) == {'app3', 'app4'}
+
+def test_connect_app_rebuilds_cached_tools(local_table):
+    add_app_connection(USER_ID, 'spotify', {'access_token': 'spotify_token'})
+    user_tools_cache.set_user_tools(USER_ID, [])
+
+    with app.app_context():
+        connect_app('gmail', 'Bearer testtoken', TOKENS)
+
+    names = tool_names(user_tools_cache.get_user_tools(USER_ID))
+    assert 'gmail_send_email' in names
+    assert 'spotify_get_user_playlists' in names
+    # Same order as a rebuild through AppManager, so the toolConfig prefix doesn't depend on which path filled the cache
+    assert user_tools_cache.get_user_tools(USER_ID) == AppManager(local_table).get_user_tools(connected_apps=['spotify', 'gmail'])
+
+def test_remove_app_rebuilds_cached_tools(local_table):
+    add_app_connection(USER_ID, 'spotify', {'access_token': 'spotify_token'})
+    user_tools_cache.set_user_tools(USER_ID, [{'toolSpec': {'name': 'spotify_get_user_playlists'}}])
+
+    with app.test_request_context('/api/remove/spotify', method='POST', headers={'Authorization': 'Bearer testtoken'}):
+        remove_app('spotify')
+
+    assert user_tools_cache.get_user_tools(USER_ID) == []
+
+def test_failed_remove_leaves_no_stale_tools(local_table):
+    add_app_connection(USER_ID, 'spotify', {'access_token': 'spotify_token'})
+    user_tools_cache.set_user_tools(USER_ID, [{'toolSpec': {'name': 'spotify_get_user_playlists'}}])
+
+    with patch.object(local_table.table, 'update_item', side_effect=ClientError({'Error': {'Code': '500', 'Message': 'boom'}}, 'UpdateItem')), \
+         app.test_request_context('/api/remove/spotify', method='POST', headers={'Authorization': 'Bearer testtoken'}):
+        _, status = remove_app('spotify')
+
+    assert status == 500
+    assert user_tools_cache.get_user_tools(USER_ID) is None
+
+@patch('server.get_user_from_token', return_value=USER_ID)
+@patch.object(agent, 'call_bedrock', return_value={'completion': 'ok'})
+def test_generate_reads_tools_written_by_remove(mock_bedrock, mock_get_user, local_table):
+    client = app.test_client()
+    add_app_connection(USER_ID, 'spotify', {'access_token': 'spotify_token'})
+    user_tools_cache.set_user_tools(USER_ID, [{'toolSpec': {'name': 'spotify_get_user_playlists'}}])
+
+    client.post('/api/remove/spotify', headers={'Authorization': 'Bearer testtoken'})
+    response = client.post('/generate', json={'prompt': 'Hi'}, headers={'Authorization': 'Bearer testtoken'})
+
+    assert json.loads(response.data) == {'completion': 'ok'}
+    assert mock_bedrock.call_args[0][3] == []
@@ -0,0 +1,219 @@
+import time
+import pytest
+import boto3
+from moto import mock_aws
+from unittest.mock import patch
+from services.utils.connections_store import UserItemStore, AppItemStore, migrate_all_users
+from services.utils.single_flight import DynamoDBLock
+from services.utils.tools.app_tool import AppTool
+
+USER_ID = 'store_user'
+SPOTIFY_TOKENS = {'access_token': 'spotify_token', 'refresh_token': 'spotify_refresh', 'expires_at': 2 ** 40}
+GMAIL_TOKENS = {'access_token': 'gmail_token', 'refresh_token': 'gmail_refresh', 'expires_at': 2 ** 40}
+
+class CountingTable:
+    """Counts the calls made to a table"""
+
+    def __init__(self, table):
+        self.table = table
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.table, name)
+
+        def call(*args, **kwargs):
+            self.calls.append((name, kwargs))
+            return method(*args, **kwargs)
+        return call
+
+@pytest.fixture
+def tables():
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        legacy_table = dynamodb.create_table(
+            TableName='link-connections-table',
+            KeySchema=[{'AttributeName': 'userId', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'userId', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        app_table = dynamodb.create_table(
+            TableName='link-app-connections-table',
+            KeySchema=[
+                {'AttributeName': 'userId', 'KeyType': 'HASH'},
+                {'AttributeName': 'appName', 'KeyType': 'RANGE'}
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'userId', 'AttributeType': 'S'},
+                {'AttributeName': 'appName', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        yield legacy_table, CountingTable(app_table)
+
+@pytest.fixture
+def store(tables):
+    legacy_table, app_table = tables
+    return AppItemStore(app_table, legacy_store=UserItemStore(legacy_table))
+
+def test_user_item_reads_are_projected(tables):
+    legacy_table, _ = tables
+    legacy_table.put_item(Item={
+        'userId': USER_ID,
+        'connectedApps': ['spotify', 'gmail'],
+        'appTokens': {'spotify': SPOTIFY_TOKENS, 'gmail': GMAIL_TOKENS}
+    })
+    table = CountingTable(legacy_table)
+    store = UserItemStore(table)
+
+    assert store.get_connected_apps(USER_ID) == ['spotify', 'gmail']
+    assert store.get_app_tokens(USER_ID, 'gmail') == GMAIL_TOKENS
+    assert store.get_app_tokens(USER_ID, 'dropbox') is None
+
+    assert [kwargs['ProjectionExpression'] for _, kwargs in table.calls] == [
+        'connectedApps', 'appTokens.#app', 'appTokens.#app'
+    ]
+
+def test_add_and_read_apps(store):
+    assert store.add_app(USER_ID, 'spotify', SPOTIFY_TOKENS) == ['spotify']
+    assert store.add_app(USER_ID, 'gmail', GMAIL_TOKENS) == ['gmail', 'spotify']
+
+    assert sorted(store.get_connected_apps(USER_ID)) == ['gmail', 'spotify']
+    assert store.get_app_tokens(USER_ID, 'spotify') == SPOTIFY_TOKENS
+    assert store.get_app_tokens(USER_ID, 'dropbox') is None
+
+def test_reconnect_without_tokens_keeps_tokens(store):
+    store.add_app(USER_ID, 'spotify', SPOTIFY_TOKENS)
+    store.add_app(USER_ID, 'spotify')
+    assert store.get_app_tokens(USER_ID, 'spotify') == SPOTIFY_TOKENS
+
+def test_remove_app_only_touches_its_row(store):
+    store.add_app(USER_ID, 'spotify', SPOTIFY_TOKENS)
+    store.add_app(USER_ID, 'gmail', GMAIL_TOKENS)
+
+    assert store.remove_app(USER_ID, 'spotify') == ['gmail']
+    assert store.get_app_tokens(USER_ID, 'gmail') == GMAIL_TOKENS
+    assert store.get_app_tokens(USER_ID, 'spotify') is None
+
+def test_connected_apps_read_is_keys_only(store, tables):
+    store.add_app(USER_ID, 'spotify', SPOTIFY_TOKENS)
+    _, app_table = tables
+    app_table.calls.clear()
+
+    store.get_connected_apps(USER_ID)
+
+    name, kwargs = app_table.calls[0]
+    assert name == 'query'
+    assert kwargs['ProjectionExpression'] == 'appName'
+
+def test_store_refreshed_tokens_is_conditional(store):
+    store.add_app(USER_ID, 'spotify', SPOTIFY_TOKENS)
+    new_tokens = {**SPOTIFY_TOKENS, 'access_token': 'new_token'}
+
+    assert store.store_refreshed_tokens(USER_ID, 'spotify', new_tokens, 'spotify_token') is not None
+    assert store.store_refreshed_tokens(USER_ID, 'spotify', SPOTIFY_TOKENS, 'spotify_token') is None
+    assert store.get_app_tokens_consistent(USER_ID, 'spotify')['access_token'] == 'new_token'
+
+def test_refresh_lock_on_app_row(store):
+    store.add_app(USER_ID, 'spotify', SPOTIFY_TOKENS)
+    lock = DynamoDBLock()
+
+    lease_id = store.acquire_refresh_lock(lock, USER_ID, 'spotify')
+    assert lease_id is not None
+    assert store.acquire_refresh_lock(lock, USER_ID, 'spotify') is None
+    assert store.get_refresh_state(lock, USER_ID, 'spotify') == (SPOTIFY_TOKENS, True)
+
+    store.release_refresh_lock(lock, USER_ID, 'spotify', lease_id)
+    assert store.get_refresh_state(lock, USER_ID, 'spotify') == (SPOTIFY_TOKENS, False)
+    assert store.acquire_refresh_lock(lock, USER_ID, 'spotify') is not None
+
+def test_lazy_migration_from_user_item(store, tables):
+    legacy_table, _ = tables
+    legacy_table.put_item(Item={
+        'userId': USER_ID,
+        'connectedApps': ['spotify', 'gmail'],
+        'appTokens': {'spotify': SPOTIFY_TOKENS, 'gmail': GMAIL_TOKENS}
+    })
+
+    assert sorted(store.get_connected_apps(USER_ID)) == ['gmail', 'spotify']
+    assert store.get_app_tokens(USER_ID, 'gmail') == GMAIL_TOKENS
+    assert 'migratedToPerApp' in legacy_table.get_item(Key={'userId': USER_ID})['Item']
+
+def test_lazy_migration_on_token_read(store, tables):
+    legacy_table, _ = tables
+    legacy_table.put_item(Item={'userId': USER_ID, 'connectedApps': ['spotify'], 'appTokens': {'spotify': SPOTIFY_TOKENS}})
+    assert store.get_app_tokens(USER_ID, 'spotify') == SPOTIFY_TOKENS
+
+def test_removed_apps_are_not_migrated_again(store, tables):
+    legacy_table, _ = tables
+    legacy_table.put_item(Item={'userId': USER_ID, 'connectedApps': ['spotify'], 'appTokens': {'spotify': SPOTIFY_TOKENS}})
+
+    assert store.remove_app(USER_ID, 'spotify') == []
+    assert store.get_connected_apps(USER_ID) == []
+    assert store.get_app_tokens(USER_ID, 'spotify') is None
+
+def test_migrated_users_only_get_a_projected_legacy_read(tables):
+    legacy_table, app_table = tables
+    legacy_table.put_item(Item={'userId': USER_ID, 'connectedApps': ['spotify'], 'appTokens': {'spotify': SPOTIFY_TOKENS}})
+    counting_legacy = CountingTable(legacy_table)
+    store = AppItemStore(app_table, legacy_store=UserItemStore(counting_legacy))
+    store.remove_app(USER_ID, 'spotify')
+    counting_legacy.calls.clear()
+
+    assert AppItemStore(app_table, legacy_store=UserItemStore(counting_legacy)).get_connected_apps(USER_ID) == []
+    store.add_app(USER_ID, 'gmail', GMAIL_TOKENS)
+
+    assert [kwargs.get('ProjectionExpression') for name, kwargs in counting_legacy.calls if name == 'get_item'] == [
+        'userId, migratedToPerApp', 'userId, migratedToPerApp'
+    ]
+
+def test_connect_migrates_existing_apps_first(store, tables):
+    legacy_table, _ = tables
+    legacy_table.put_item(Item={'userId': USER_ID, 'connectedApps': ['spotify'], 'appTokens': {'spotify': SPOTIFY_TOKENS}})
+
+    assert store.add_app(USER_ID, 'gmail', GMAIL_TOKENS) == ['gmail', 'spotify']
+
+def test_migration_does_not_overwrite_newer_rows(store, tables):
+    legacy_table, app_table = tables
+    app_table.put_item(Item={'userId': USER_ID, 'appName': 'spotify', 'tokens': {**SPOTIFY_TOKENS, 'access_token': 'newer'}})
+    legacy_table.put_item(Item={'userId': USER_ID, 'connectedApps': ['spotify'], 'appTokens': {'spotify': SPOTIFY_TOKENS}})
+
+    store.migrate_user(USER_ID)
+    assert store.get_app_tokens(USER_ID, 'spotify')['access_token'] == 'newer'
+
+def test_migrate_all_users(store, tables):
+    legacy_table, _ = tables
+    for i in range(3):
+        legacy_table.put_item(Item={'userId': f'user-{i}', 'connectedApps': ['spotify'], 'appTokens': {'spotify': SPOTIFY_TOKENS}})
+    legacy_table.put_item(Item={'userId': 'no-apps', 'connectedApps': []})
+
+    assert migrate_all_users(store) == 3
+    assert migrate_all_users(store) == 0
+    assert store.get_connected_apps('user-2') == ['spotify']
+
+def test_app_tool_reads_one_row(store, tables):
+    _, app_table = tables
+    store.add_app(USER_ID, 'spotify', SPOTIFY_TOKENS)
+    store.add_app(USER_ID, 'gmail', GMAIL_TOKENS)
+    app_table.calls.clear()
+
+    app_tool = AppTool(None)
+    app_tool.service_name = 'spotify'
+    with patch('services.utils.tools.app_tool.get_connections_store', return_value=store):
+        assert app_tool.get_app_headers(USER_ID) == {'Authorization': 'Bearer spotify_token'}
+
+    assert [name for name, _ in app_table.calls] == ['get_item']
+    assert app_table.calls[0][1]['Key'] == {'userId': USER_ID, 'appName': 'spotify'}
+
+def test_app_tool_refresh_writes_one_row(store, tables):
+    _, app_table = tables
+    store.add_app(USER_ID, 'spotify', {**SPOTIFY_TOKENS, 'expires_at': 0})
+    store.add_app(USER_ID, 'gmail', GMAIL_TOKENS)
+
+    app_tool = AppTool(None)
+    app_tool.service_name = 'spotify'
+    with patch('services.utils.tools.app_tool.get_connections_store', return_value=store), \
+         patch.object(app_tool, 'refresh_access_token', return_value={'access_token': 'new_token', 'expires_in': 3600}):
+        assert app_tool.get_app_headers(USER_ID) == {'Authorization': 'Bearer new_token'}
+
+    assert store.get_app_tokens_consistent(USER_ID, 'spotify')['expires_at'] > time.time()
+    assert store.get_app_tokens_consistent(USER_ID, 'gmail') == GMAIL_TOKENS
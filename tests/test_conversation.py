@@ -0,0 +1,73 @@
+import json
+from benchmarks.bench_history_tokens import TRANSCRIPTS, flattened_tokens, budgeted_tokens
+from services.utils.conversation import (
+    estimate_tokens, truncate_text, truncate_message, pairs_to_turns, history_messages, message_tokens, HISTORY_TOKEN_BUDGET
+)
+
+def make_history(count, length=20):
+    return [{'user': f'question {i} ' + 'q' * length, 'assistant': f'answer {i} ' + 'a' * length} for i in range(count)]
+
+def test_truncate_text_keeps_both_ends():
+    text = 'start ' + 'x' * 1000 + ' end'
+    truncated = truncate_text(text, 50)
+
+    assert truncated.startswith('start ')
+    assert truncated.endswith(' end')
+    assert 'characters truncated' in truncated
+    assert estimate_tokens(truncated) < 70
+
+def test_short_text_is_unchanged():
+    assert truncate_text('hello', 50) == 'hello'
+
+def test_pairs_become_alternating_messages():
+    messages = history_messages(pairs_to_turns([{'user': 'Hi', 'assistant': 'Hello!'}, {'user': 'Thanks', 'assistant': 'Anytime'}]))
+
+    assert [message['role'] for message in messages] == ['user', 'assistant', 'user', 'assistant']
+    assert messages[0]['content'] == [{'text': 'Hi'}]
+    assert messages[-1]['content'] == [{'text': 'Anytime'}]
+
+def test_incomplete_turns_are_skipped():
+    turns = pairs_to_turns([{'user': 'Hi', 'assistant': ''}, {'user': 'Hello', 'assistant': 'Hey'}, {}])
+    assert len(turns) == 1
+
+def test_budget_keeps_most_recent_turns():
+    turns = pairs_to_turns(make_history(50))
+    messages = history_messages(turns, token_budget=200, max_message_tokens=100)
+
+    assert sum(message_tokens(message) for message in messages) <= 200
+    assert messages[-1]['content'][0]['text'].startswith('answer 49')
+    assert messages[0]['role'] == 'user'
+    assert 0 < len(messages) < 100
+
+def test_budget_is_not_a_fixed_turn_count():
+    short = history_messages(pairs_to_turns(make_history(20, length=10)), token_budget=1000)
+    long = history_messages(pairs_to_turns(make_history(20, length=400)), token_budget=1000)
+    assert len(short) > len(long)
+
+def test_long_turn_is_truncated_not_dropped():
+    history = [{'user': 'List my emails', 'assistant': 'email ' * 5000}]
+    messages = history_messages(pairs_to_turns(history), token_budget=1000, max_message_tokens=300)
+
+    assert len(messages) == 2
+    assert 'characters truncated' in messages[1]['content'][0]['text']
+
+def test_tool_results_are_truncated():
+    message = {'role': 'user', 'content': [{'toolResult': {'toolUseId': 't1', 'content': [{'text': 'x' * 10000}], 'status': 'success'}}]}
+    truncated = truncate_message(message, 100)
+
+    tool_result = truncated['content'][0]['toolResult']
+    assert tool_result['toolUseId'] == 't1'
+    assert tool_result['status'] == 'success'
+    assert 'characters truncated' in tool_result['content'][0]['text']
+    assert len(message['content'][0]['toolResult']['content'][0]['text']) == 10000
+
+def test_sample_transcript_uses_fewer_input_tokens():
+    with open(TRANSCRIPTS) as f:
+        turns = json.load(f)['inbox_and_playlists']
+
+    before = sum(flattened_tokens(turn['user'], turns[:index]) for index, turn in enumerate(turns))
+    after = sum(budgeted_tokens(turn['user'], turns[:index]) for index, turn in enumerate(turns))
+
+    assert after < before * 0.6
+    for index, turn in enumerate(turns):
+        assert sum(message_tokens(m) for m in history_messages(pairs_to_turns(turns[:index]))) <= HISTORY_TOKEN_BUDGET
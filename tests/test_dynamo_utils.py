@@ -0,0 +1,20 @@
+from decimal import Decimal
+from services.utils.dynamo_utils import estimate_size
+
+def test_estimate_size_scalars():
+    assert estimate_size('abc') == 3
+    assert estimate_size('é') == 2
+    assert estimate_size(True) == 1
+    assert estimate_size(None) == 1
+    assert estimate_size(Decimal('1700000000')) == 2
+    assert estimate_size(123456) == 4
+
+def test_estimate_size_nested():
+    tokens = {'access_token': 'a' * 100, 'expires_at': 1700000000}
+    assert estimate_size(tokens) == 3 + (12 + 100 + 1) + (10 + 2 + 1)
+    assert estimate_size(['spotify', 'gmail']) == 3 + 8 + 6
+
+def test_single_service_write_is_smaller_than_full_item():
+    token = {'access_token': 'a' * 300, 'refresh_token': 'r' * 130, 'expires_at': 1700000000}
+    item = {'userId': 'user', 'connectedApps': ['spotify', 'gmail'], 'appTokens': {'spotify': token, 'gmail': token}}
+    assert estimate_size({'spotify': token}) < estimate_size(item) / 2
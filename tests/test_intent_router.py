@@ -0,0 +1,48 @@
+import pytest
+from unittest.mock import MagicMock
+from services.utils.tools.app_manager import AppManager
+from services.utils.intent_router import IntentRouter, normalize
+
+@pytest.fixture
+def app_manager():
+    return AppManager(MagicMock())
+
+@pytest.fixture
+def router(app_manager):
+    return IntentRouter(app_manager.intent_patterns())
+
+@pytest.fixture
+def tools(app_manager):
+    return app_manager.get_user_tools(connected_apps=['spotify', 'gmail'])
+
+@pytest.mark.parametrize('prompt, route', [
+    ('list my playlists', ('spotify_get_user_playlists', {})),
+    ('Can you show me all my Spotify playlists, please?', ('spotify_get_user_playlists', {})),
+    ("What're my playlists", None),
+    ('Show my last 5 emails', ('gmail_list_messages', {'max_results': 5})),
+    ('show me my three latest e-mails', ('gmail_list_messages', {'max_results': 3})),
+    ("What's in my inbox?", ('gmail_list_messages', {})),
+    ('Show my last 50 emails', None),
+    ('Add Hey Jude to my Road Trip playlist', None),
+    ('show my emails from GitHub', None),
+    ('list my playlists and email them to sam', None)
+])
+def test_routes_only_exact_simple_commands(router, tools, prompt, route):
+    assert router.match(prompt, tools) == route
+
+def test_only_routes_to_tools_the_user_has(router, app_manager):
+    gmail_tools = app_manager.get_user_tools(connected_apps=['gmail'])
+
+    assert router.match('list my playlists', gmail_tools) is None
+
+def test_normalize():
+    assert normalize('Hey Link, could you list my playlists for me please!') == 'list my playlists'
+
+def test_stats(router, tools):
+    router.match('list my playlists', tools)
+    router.match('hello', tools)
+    router.record('spotify_get_user_playlists', answered=True)
+
+    stats = router.stats()
+    assert (stats['requests'], stats['hits'], stats['hit_rate']) == (2, 1, 0.5)
+    assert stats['routes'] == {'spotify_get_user_playlists': {'hits': 1, 'fallthroughs': 0}}
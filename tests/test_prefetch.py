@@ -0,0 +1,87 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+from services.utils.tools.app_manager import AppManager
+from services.utils.tool_executor import ToolExecutor
+from services.utils.prefetch import Prefetcher
+
+@pytest.fixture
+def app_manager():
+    app_manager = AppManager(MagicMock())
+    app_manager.call_app_tool = MagicMock(return_value='Road Trip\nWorkout')
+    app_manager.warm_app_headers = MagicMock(return_value={'Authorization': 'Bearer token'})
+    return app_manager
+
+@pytest.fixture
+def tools(app_manager):
+    return app_manager.get_user_tools(connected_apps=['spotify', 'gmail'])
+
+@pytest.fixture
+def prefetcher(app_manager):
+    return Prefetcher(app_manager, executor=ToolExecutor(max_workers=2, per_user_limit=2))
+
+@pytest.mark.parametrize('prompt, calls', [
+    ('Add Hey Jude to my Road Trip playlist', [('spotify_get_user_playlists', {})]),
+    ('Any new emails?', [('gmail_list_messages', {'max_results': 5})]),
+    ('Who is the singer of Yellow?', [('headers', 'spotify')]),
+    ('Hello!', [])
+])
+def test_predict(prefetcher, tools, prompt, calls):
+    assert prefetcher.predict(prompt, tools) == calls
+
+def test_only_connected_apps_are_prefetched(prefetcher, app_manager):
+    gmail_tools = app_manager.get_user_tools(connected_apps=['gmail'])
+
+    assert prefetcher.predict('Email my playlists to Sam', gmail_tools) == [('gmail_list_messages', {'max_results': 5})]
+
+def test_used_prefetch_is_not_wasted(prefetcher, tools, app_manager):
+    prefetch = prefetcher.start('Show my playlists', tools, 'user')
+
+    assert prefetch.take('spotify_get_user_playlists', {}).result() == 'Road Trip\nWorkout'
+    assert prefetch.take('spotify_get_user_playlists', {'limit': 5}) is None
+    assert prefetcher.finish(prefetch) == {'started': ['spotify_get_user_playlists'], 'used': 1, 'wasted': 0, 'cancelled': 0}
+    app_manager.call_app_tool.assert_called_once_with('spotify_get_user_playlists', {}, 'user')
+
+def test_unused_prefetch_is_cancelled_or_wasted(prefetcher, tools, app_manager):
+    release = threading.Event()
+    app_manager.call_app_tool.side_effect = lambda *args: release.wait(5) and 'emails'
+
+    # Both calls hold the user's two slots, so the header warm-up is over budget
+    prefetch = prefetcher.start('Add the song from my latest email to my playlist', tools, 'user')
+    summary = prefetcher.finish(prefetch)
+    release.set()
+
+    assert summary['used'] == 0
+    assert summary['wasted'] + summary['cancelled'] == 2
+    stats = prefetcher.stats()
+    assert stats['started'] == 2
+    assert stats['waste_rate'] == summary['wasted'] / 2
+
+def test_prefetch_never_waits_for_a_busy_user(app_manager, tools):
+    executor = ToolExecutor(max_workers=2, per_user_limit=1)
+    release = threading.Event()
+    executor.submit('user', release.wait, 5)
+    prefetcher = Prefetcher(app_manager, executor=executor)
+
+    prefetch = prefetcher.start('Show my playlists', tools, 'user')
+    release.set()
+
+    assert prefetch.futures == {}
+    assert prefetcher.stats()['over_budget'] == 1
+
+def test_queued_prefetch_cancel_releases_the_user_slot(app_manager, tools):
+    executor = ToolExecutor(max_workers=1, per_user_limit=2)
+    release = threading.Event()
+    app_manager.call_app_tool.side_effect = lambda *args: release.wait(5) and 'emails'
+    prefetcher = Prefetcher(app_manager, executor=executor)
+
+    # One worker: the first call holds it, the second waits in the queue
+    prefetch = prefetcher.start('Add the song from my latest email to my playlist', tools, 'user')
+    summary = prefetcher.finish(prefetch)
+    release.set()
+    for future in prefetch.futures.values():
+        if not future.cancelled():
+            future.result()
+
+    assert summary['cancelled'] == 1
+    assert executor.user_slots == {}
@@ -1,7 +1,12 @@
 import pytest
 import json
-from unittest.mock import patch
+import time
+from unittest.mock import patch, call
+import server
 from server import app, agent
+from services.utils.user_cache import user_tools_cache
+from services.utils.session_store import session_store
+from services.utils.usage_tracker import usage_tracker
 
 class TestFlaskServer:    
     def test_options_request(self, client):
@@ -73,4 +78,171 @@ class TestFlaskServer:
     
     def test_generate_no_content_type(self, client):
         response = client.post('/generate', data=json.dumps({'prompt': 'Hello'}), headers={'Authorization': 'Bearer testtoken'})
-        assert response.status_code == 415
\ No newline at end of file
+        assert response.status_code == 415
+
+class TestRequestContext:
+    @patch('services.utils.tools.spotify_tools.requests')
+    @patch('services.utils.cognito_utils._get_user_from_cognito')
+    @patch('services.utils.cognito_utils.token_verifier', None)
+    def test_generate_single_auth_and_projected_reads(self, mock_cognito, mock_requests, client):
+        mock_cognito.return_value = 'context_user'
+        user_tools_cache.invalidate('context_user')
+
+        mock_requests.get.return_value.status_code = 200
+        mock_requests.get.return_value.json.return_value = {'items': [{'name': 'Road Trip'}]}
+
+        item = {
+            'userId': 'context_user',
+            'connectedApps': ['spotify'],
+            'appTokens': {'spotify': {'access_token': 'token', 'expires_at': int(time.time()) + 3600}}
+        }
+        tool_use = {'toolUseId': 'tool-1', 'name': 'spotify_get_user_playlists', 'input': {}}
+
+        with patch.object(server.connections_table, 'get_item', return_value={'Item': item}) as mock_get_item, \
+             patch.object(agent, 'client') as mock_bedrock:
+            mock_bedrock.converse.side_effect = [
+                {'output': {'message': {'content': [{'toolUse': tool_use}]}}, 'stopReason': 'tool_use'},
+                {'output': {'message': {'content': [{'text': 'Your playlists: Road Trip'}]}}}
+            ]
+            response = client.post('/generate', json={'prompt': 'list my playlists'}, headers={'Authorization': 'Bearer testtoken'})
+
+        assert response.status_code == 200
+        assert json.loads(response.data) == {'completion': 'Your playlists: Road Trip'}
+        mock_cognito.assert_called_once_with('testtoken')
+        # One lean read for the connected apps and one for the Spotify tokens, never the whole item
+        assert mock_get_item.call_args_list == [
+            call(Key={'userId': 'context_user'}, ProjectionExpression='connectedApps'),
+            call(Key={'userId': 'context_user'}, ProjectionExpression='appTokens.#app',
+                 ExpressionAttributeNames={'#app': 'spotify'}, ConsistentRead=False)
+        ]
+
+class TestGenerateStream:
+    @patch('server.get_user_from_token', return_value='test_user_id')
+    @patch.object(agent, 'stream_bedrock')
+    def test_generate_stream_sends_events(self, mock_stream, mock_get_user, client):
+        mock_stream.return_value = iter([
+            {'type': 'tool_start', 'name': 'spotify_get_user_playlists', 'toolUseId': 'tool-1'},
+            {'type': 'tool_end', 'name': 'spotify_get_user_playlists', 'toolUseId': 'tool-1', 'latency_ms': 3},
+            {'type': 'token', 'text': 'Road Trip'},
+            {'type': 'done', 'completion': 'Road Trip'}
+        ])
+
+        with patch.object(user_tools_cache, 'get_user_tools', return_value=[]):
+            response = client.post('/generate/stream', json={'prompt': 'list my playlists'}, headers={'Authorization': 'Bearer testtoken'})
+
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        events = [line for line in response.get_data(as_text=True).split('\n\n') if line]
+        assert events[0].startswith('event: tool_start\ndata: ')
+        assert json.loads(events[2].split('data: ')[1]) == {'type': 'token', 'text': 'Road Trip'}
+        assert events[-1].startswith('event: done')
+        mock_stream.assert_called_once_with('list my playlists', [], 'Bearer testtoken', [])
+
+    @patch('server.get_user_from_token', return_value='test_user_id')
+    @patch.object(agent, 'stream_bedrock')
+    def test_generate_stream_reports_errors(self, mock_stream, mock_get_user, client):
+        mock_stream.side_effect = Exception('Agent error')
+
+        with patch.object(user_tools_cache, 'get_user_tools', return_value=[]):
+            response = client.post('/generate/stream', json={'prompt': 'Hello'}, headers={'Authorization': 'Bearer testtoken'})
+
+        assert 'event: error' in response.get_data(as_text=True)
+
+    def test_generate_stream_requires_auth(self, client):
+        response = client.post('/generate/stream', json={'prompt': 'Hello'})
+        assert response.status_code == 401
+
+class TestSessions:
+    @pytest.fixture(autouse=True)
+    def clear_sessions(self):
+        session_store.backend.clear()
+        yield
+        session_store.backend.clear()
+
+    def post(self, client, body):
+        with patch.object(user_tools_cache, 'get_user_tools', return_value=[]):
+            return client.post('/generate', json=body, headers={'Authorization': 'Bearer testtoken'})
+
+    @patch('server.get_user_from_token', return_value='test_user_id')
+    def test_session_history_is_kept_server_side(self, mock_get_user, client):
+        with patch.object(agent, 'client') as mock_client:
+            mock_client.converse.return_value = {
+                'output': {'message': {'role': 'assistant', 'content': [{'text': 'Hello!'}]}},
+                'stopReason': 'end_turn'
+            }
+            first = json.loads(self.post(client, {'prompt': 'Hi', 'session_id': ''}).data)
+            second = json.loads(self.post(client, {'prompt': 'Again', 'session_id': first['session_id']}).data)
+
+        assert first['completion'] == 'Hello!'
+        assert second['session_id'] == first['session_id']
+        messages = mock_client.converse.call_args.kwargs['messages']
+        assert [message['content'][0]['text'] for message in messages] == ['Hi', 'Hello!', 'Again']
+
+    @patch('server.get_user_from_token')
+    def test_reset_clears_only_the_callers_session(self, mock_get_user, client):
+        session_store.append_turn('alice', 'chat', [{'role': 'user', 'content': [{'text': 'Hi'}]}])
+        session_store.append_turn('bob', 'chat', [{'role': 'user', 'content': [{'text': 'Hi'}]}])
+        mock_get_user.return_value = 'alice'
+
+        response = self.post(client, {'reset': True, 'session_id': 'chat'})
+
+        assert json.loads(response.data) == {'message': 'Persona reset'}
+        assert session_store.get_turns('alice', 'chat') == []
+        assert len(session_store.get_turns('bob', 'chat')) == 1
+
+    @patch('server.get_user_from_token', return_value='test_user_id')
+    def test_invalid_session_id(self, mock_get_user, client):
+        response = self.post(client, {'prompt': 'Hi', 'session_id': '../other'})
+        assert response.status_code == 400
+
+class TestUsage:
+    @pytest.fixture(autouse=True)
+    def clear_usage(self):
+        usage_tracker.clear()
+        yield
+        usage_tracker.clear()
+
+    @patch('server.get_user_from_token', return_value='test_user_id')
+    def test_model_calls_are_accounted_per_user_and_stage(self, mock_get_user, client):
+        with patch.object(agent, 'client') as mock_client, patch.object(user_tools_cache, 'get_user_tools', return_value=[]):
+            mock_client.converse.return_value = {
+                'output': {'message': {'role': 'assistant', 'content': [{'text': 'Hello!'}]}},
+                'stopReason': 'end_turn',
+                'usage': {'inputTokens': 120, 'outputTokens': 8},
+                'metrics': {'latencyMs': 350}
+            }
+            client.post('/generate', json={'prompt': 'Hi'}, headers={'Authorization': 'Bearer testtoken'})
+
+        snapshot = usage_tracker.snapshot()
+        assert snapshot['stages']['first']['input_tokens'] == 120
+        assert snapshot['stages']['first']['bedrock_latency_ms'] == 350
+        assert snapshot['routes']['/generate']['calls'] == 1
+        assert snapshot['top_users']['test_user_id']['output_tokens'] == 8
+
+    @patch('server.get_user_from_token', return_value='test_user_id')
+    def test_over_budget_users_get_429(self, mock_get_user, client):
+        with patch.object(usage_tracker, 'over_budget', return_value=True), \
+             patch.object(usage_tracker, 'retry_after', return_value=120), \
+             patch.object(agent, 'call_bedrock') as mock_bedrock:
+            response = client.post('/generate', json={'prompt': 'Hi'}, headers={'Authorization': 'Bearer testtoken'})
+
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '120'
+        assert json.loads(response.data) == {'error': 'Rate limit exceeded. Please wait and try again.'}
+        mock_bedrock.assert_not_called()
+
+    def test_metrics_endpoint_needs_its_token(self, client, monkeypatch):
+        assert client.get('/metrics').status_code == 404
+
+        monkeypatch.setenv('METRICS_TOKEN', 'secret')
+        assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+        usage_tracker.record('alice', 'first', {'inputTokens': 10}, route='/generate')
+        response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['usage']['total']['input_tokens'] == 10
+        assert {'agent_paths', 'intent_router', 'prefetch', 'sessions', 'user_tools_cache'} <= set(data)
+
+        response = client.get('/metrics?user_id=alice', headers={'Authorization': 'Bearer secret'})
+        assert json.loads(response.data)['usage']['total']['calls'] == 1
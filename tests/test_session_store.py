@@ -0,0 +1,112 @@
+import pytest
+from services.utils.user_cache import MemoryCacheBackend, SQLiteCacheBackend
+from services.utils.session_store import SessionStore, InvalidSessionError
+
+def turn(prompt, answer):
+    return [
+        {'role': 'user', 'content': [{'text': prompt}]},
+        {'role': 'assistant', 'content': [{'text': answer}]}
+    ]
+
+def test_turns_are_kept_per_user_and_session():
+    store = SessionStore()
+    store.append_turn('alice', 'chat', turn('Hi', 'Hello!'))
+
+    assert store.get_turns('alice', 'chat') == [turn('Hi', 'Hello!')]
+    assert store.get_turns('alice', 'other') == []
+    # Knowing someone else's session id is not enough to read it
+    assert store.get_turns('bob', 'chat') == []
+
+def test_only_the_newest_turns_are_kept():
+    store = SessionStore(max_turns=2)
+    for i in range(3):
+        store.append_turn('alice', 'chat', turn(f'q{i}', f'a{i}'))
+
+    assert store.get_turns('alice', 'chat') == [turn('q1', 'a1'), turn('q2', 'a2')]
+
+def test_tool_blocks_are_stored_as_text():
+    store = SessionStore()
+    store.append_turn('alice', 'chat', [
+        {'role': 'user', 'content': [{'text': 'List my playlists'}]},
+        {'role': 'assistant', 'content': [{'toolUse': {'toolUseId': 't1', 'name': 'spotify_get_user_playlists', 'input': {}}}]},
+        {'role': 'user', 'content': [{'toolResult': {'toolUseId': 't1', 'content': [{'text': 'x' * 5000}]}}]},
+        {'role': 'assistant', 'content': [{'text': 'You have one playlist.'}]}
+    ])
+
+    stored = store.get_turns('alice', 'chat')[0]
+    assert stored[1]['content'] == [{'text': '[Called spotify_get_user_playlists with {}]'}]
+    assert stored[2]['content'][0]['text'].startswith('[Tool result]')
+    assert 'characters truncated' in stored[2]['content'][0]['text']
+
+def test_reset_and_expiry():
+    store = SessionStore(ttl=0)
+    store.append_turn('alice', 'chat', turn('Hi', 'Hello!'))
+    assert store.get_turns('alice', 'chat') == []
+
+    store = SessionStore()
+    store.append_turn('alice', 'chat', turn('Hi', 'Hello!'))
+    store.reset('alice', 'chat')
+    assert store.get_turns('alice', 'chat') == []
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(backend=MemoryCacheBackend(max_size=2))
+    for session_id in ('a', 'b', 'c'):
+        store.append_turn('alice', session_id, turn('Hi', 'Hello!'))
+
+    assert store.get_turns('alice', 'a') == []
+    assert store.stats()['evictions'] == 1
+
+def test_sqlite_backend_shares_sessions(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    SessionStore(backend=SQLiteCacheBackend(path, table='sessions')).append_turn('alice', 'chat', turn('Hi', 'Hello!'))
+
+    assert SessionStore(backend=SQLiteCacheBackend(path, table='sessions')).get_turns('alice', 'chat') == [turn('Hi', 'Hello!')]
+
+@pytest.mark.parametrize('session_id', ['', 'a' * 65, 'has space', 'slash/id', None])
+def test_invalid_session_ids_are_rejected(session_id):
+    with pytest.raises(InvalidSessionError):
+        SessionStore().get_turns('alice', session_id)
+
+def test_old_turns_are_folded_into_the_summary():
+    store = SessionStore(keep_turns=2, batch_turns=2)
+    seen = []
+
+    def summarizer(summary, turns):
+        seen.append((summary, [t[0]['content'][0]['text'] for t in turns]))
+        return f"summary of {len(turns)} turns"
+
+    for i in range(3):
+        store.append_turn('alice', 'chat', turn(f'q{i}', f'a{i}'))
+    assert store.maybe_summarize('alice', 'chat', summarizer) is None
+
+    store.append_turn('alice', 'chat', turn('q3', 'a3'))
+    store.maybe_summarize('alice', 'chat', summarizer).result()
+
+    assert seen == [(None, ['q0', 'q1'])]
+    assert store.get_session('alice', 'chat') == ('summary of 2 turns', [turn('q2', 'a2'), turn('q3', 'a3')])
+
+def test_turns_added_while_summarizing_are_kept():
+    store = SessionStore(keep_turns=2, batch_turns=2)
+    for i in range(4):
+        store.append_turn('alice', 'chat', turn(f'q{i}', f'a{i}'))
+
+    def summarizer(summary, turns):
+        store.append_turn('alice', 'chat', turn('q4', 'a4'))
+        return 'summary'
+
+    store.maybe_summarize('alice', 'chat', summarizer).result()
+
+    assert store.get_session('alice', 'chat') == ('summary', [turn('q2', 'a2'), turn('q3', 'a3'), turn('q4', 'a4')])
+
+def test_failed_summary_keeps_the_turns():
+    store = SessionStore(keep_turns=1, batch_turns=1)
+    store.append_turn('alice', 'chat', turn('q0', 'a0'))
+    store.append_turn('alice', 'chat', turn('q1', 'a1'))
+
+    def summarizer(summary, turns):
+        raise Exception('Bedrock error')
+
+    store.maybe_summarize('alice', 'chat', summarizer).result()
+
+    assert store.get_session('alice', 'chat') == (None, [turn('q0', 'a0'), turn('q1', 'a1')])
+    assert store.stats()['summary_errors'] == 1
@@ -0,0 +1,205 @@
+import time
+import threading
+import pytest
+import boto3
+from moto import mock_aws
+from unittest.mock import Mock, patch
+from services.utils.single_flight import SingleFlight, DynamoDBLock
+from services.utils.tools.app_tool import AppTool
+from services.utils.token_cache import provider_token_cache
+
+USER_ID = 'test_user_123'
+CALLERS = 10
+
+def run_concurrently(fn, n=CALLERS):
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = fn()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def slow(result, delay=0.2):
+    def fn(*args, **kwargs):
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return Mock(side_effect=fn)
+
+def test_single_flight_runs_once():
+    flights = SingleFlight()
+    fn = slow('result')
+    assert run_concurrently(lambda: flights.do('key', fn)) == ['result'] * CALLERS
+    fn.assert_called_once()
+    assert flights.calls == {}
+
+def test_single_flight_shares_errors():
+    flights = SingleFlight()
+    fn = slow(ValueError('boom'))
+    results = run_concurrently(lambda: flights.do('key', fn))
+    assert all(isinstance(r, ValueError) for r in results)
+    fn.assert_called_once()
+
+def test_single_flight_keys_are_independent():
+    flights = SingleFlight()
+    fn = slow('result')
+    run_concurrently(lambda: flights.do(threading.get_ident(), fn), n=3)
+    assert fn.call_count == 3
+
+@pytest.fixture
+def spotify_tool():
+    app_tool = AppTool(Mock())
+    app_tool.service_name = 'spotify'
+    app_tool.table.get_item.return_value = {
+        'Item': {
+            'userId': USER_ID,
+            'appTokens': {'spotify': {'access_token': 'expired_token', 'refresh_token': 'refresh', 'expires_at': 0}}
+        }
+    }
+    return app_tool
+
+def test_concurrent_requests_refresh_once(spotify_tool):
+    with patch.object(spotify_tool, 'refresh_access_token', slow({'access_token': 'new_token', 'expires_in': 3600})) as mock_refresh:
+        results = run_concurrently(lambda: spotify_tool.get_app_headers(USER_ID))
+
+    assert results == [{'Authorization': 'Bearer new_token'}] * CALLERS
+    mock_refresh.assert_called_once_with('refresh')
+    spotify_tool.table.update_item.assert_called_once()
+
+def test_late_caller_reuses_finished_refresh(spotify_tool):
+    with patch.object(spotify_tool, 'refresh_access_token', return_value={'access_token': 'new_token', 'expires_in': 3600}) as mock_refresh:
+        stale_tokens = spotify_tool.table.get_item.return_value['Item']['appTokens']['spotify']
+        spotify_tool.refresh_user_tokens(USER_ID, stale_tokens)
+        tokens = spotify_tool.refresh_user_tokens(USER_ID, stale_tokens)
+
+    assert tokens['access_token'] == 'new_token'
+    mock_refresh.assert_called_once()
+
+def test_older_cached_token_is_not_merged_over_newer_stored_tokens(spotify_tool):
+    # This process cached a token before another process stored a fresher one with a rotated refresh token
+    provider_token_cache.set(USER_ID, 'spotify', 'cached_token', int(time.time()) + 600)
+    stored_tokens = {'access_token': 'stored_token', 'refresh_token': 'rotated_refresh', 'expires_at': int(time.time()) + 1200}
+
+    with patch.object(spotify_tool, 'refresh_access_token', return_value={'access_token': 'new_token', 'expires_in': 3600}) as mock_refresh:
+        tokens = spotify_tool.refresh_user_tokens(USER_ID, stored_tokens)
+
+    assert tokens['access_token'] == 'new_token'
+    mock_refresh.assert_called_once_with('rotated_refresh')
+
+@pytest.fixture
+def local_table():
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        table = dynamodb.create_table(
+            TableName='link-connections-table',
+            KeySchema=[{'AttributeName': 'userId', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'userId', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        table.put_item(Item={
+            'userId': USER_ID,
+            'connectedApps': ['spotify'],
+            'appTokens': {'spotify': {'access_token': 'expired_token', 'refresh_token': 'refresh', 'expires_at': 0}}
+        })
+        yield table
+
+def test_dynamodb_lock_is_exclusive(local_table):
+    lock = DynamoDBLock()
+    lease_id = lock.acquire(local_table, {'userId': USER_ID}, 'lock_spotify')
+
+    assert lease_id is not None
+    assert lock.acquire(local_table, {'userId': USER_ID}, 'lock_spotify') is None
+    assert lock.acquire(local_table, {'userId': USER_ID}, 'lock_gmail') is not None
+
+    lock.release(local_table, {'userId': USER_ID}, 'lock_spotify', lease_id)
+    assert lock.acquire(local_table, {'userId': USER_ID}, 'lock_spotify') is not None
+
+def test_dynamodb_lock_expires(local_table):
+    lock = DynamoDBLock(ttl=-1)
+    stale_lease = lock.acquire(local_table, {'userId': USER_ID}, 'lock_spotify')
+    new_lease = lock.acquire(local_table, {'userId': USER_ID}, 'lock_spotify')
+
+    assert new_lease is not None
+    lock.release(local_table, {'userId': USER_ID}, 'lock_spotify', stale_lease)
+    assert local_table.get_item(Key={'userId': USER_ID})['Item']['lock_spotify']['owner'] == new_lease
+
+def test_dynamodb_lock_needs_existing_user(local_table):
+    assert DynamoDBLock().acquire(local_table, {'userId': 'unknown_user'}, 'lock_spotify') is None
+    assert 'Item' not in local_table.get_item(Key={'userId': 'unknown_user'})
+
+def test_waits_for_refresh_by_other_process(local_table):
+    lock = DynamoDBLock(ttl=5, poll_interval=0.05)
+    app_tool = AppTool(local_table)
+    app_tool.service_name = 'spotify'
+
+    # Another worker process holds the lock and writes the new token shortly after
+    other_lease = lock.acquire(local_table, {'userId': USER_ID}, 'lock_spotify')
+
+    def other_process_refresh():
+        time.sleep(0.2)
+        local_table.update_item(
+            Key={'userId': USER_ID},
+            UpdateExpression='SET appTokens.spotify = :tokens',
+            ExpressionAttributeValues={':tokens': {'access_token': 'new_token', 'refresh_token': 'refresh', 'expires_at': int(time.time()) + 3600}}
+        )
+        lock.release(local_table, {'userId': USER_ID}, 'lock_spotify', other_lease)
+
+    other = threading.Thread(target=other_process_refresh)
+    with patch('services.utils.tools.app_tool.refresh_lock', lock), \
+         patch.object(app_tool, 'refresh_access_token') as mock_refresh:
+        other.start()
+        headers = app_tool.get_app_headers(USER_ID)
+        other.join()
+
+    assert headers == {'Authorization': 'Bearer new_token'}
+    mock_refresh.assert_not_called()
+
+def test_waiter_takes_over_when_other_process_refresh_fails(local_table):
+    lock = DynamoDBLock(ttl=3, poll_interval=0.05)
+    app_tool = AppTool(local_table)
+    app_tool.service_name = 'spotify'
+
+    # Another worker process holds the lock, its provider refresh fails and it releases without writing
+    other_lease = lock.acquire(local_table, {'userId': USER_ID}, 'lock_spotify')
+
+    def other_process_fails():
+        time.sleep(0.1)
+        lock.release(local_table, {'userId': USER_ID}, 'lock_spotify', other_lease)
+
+    other = threading.Thread(target=other_process_fails)
+    with patch('services.utils.tools.app_tool.refresh_lock', lock), \
+         patch.object(app_tool, 'refresh_access_token', return_value={'access_token': 'new_token', 'expires_in': 3600}) as mock_refresh:
+        other.start()
+        start = time.perf_counter()
+        headers = app_tool.get_app_headers(USER_ID)
+        elapsed = time.perf_counter() - start
+        other.join()
+
+    assert headers == {'Authorization': 'Bearer new_token'}
+    assert elapsed < 1
+    mock_refresh.assert_called_once_with('refresh')
+    assert 'lock_spotify' not in local_table.get_item(Key={'userId': USER_ID})['Item']
+
+def test_refresh_takes_and_releases_lock(local_table):
+    lock = DynamoDBLock()
+    app_tool = AppTool(local_table)
+    app_tool.service_name = 'spotify'
+
+    with patch('services.utils.tools.app_tool.refresh_lock', lock), \
+         patch.object(app_tool, 'refresh_access_token', return_value={'access_token': 'new_token', 'expires_in': 3600}):
+        assert app_tool.get_app_headers(USER_ID) == {'Authorization': 'Bearer new_token'}
+
+    item = local_table.get_item(Key={'userId': USER_ID})['Item']
+    assert item['appTokens']['spotify']['access_token'] == 'new_token'
+    assert 'lock_spotify' not in item
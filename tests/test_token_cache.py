@@ -0,0 +1,64 @@
+import threading
+from unittest.mock import patch
+from services.utils.token_cache import ProviderTokenCache
+
+@patch('services.utils.token_cache.time')
+def test_get_returns_token_until_margin(mock_time):
+    mock_time.time.return_value = 1000
+    cache = ProviderTokenCache(expiry_margin=60)
+    cache.set('user', 'spotify', 'token', 2000)
+
+    mock_time.time.return_value = 1939
+    assert cache.get('user', 'spotify') == 'token'
+
+    mock_time.time.return_value = 1940
+    assert cache.get('user', 'spotify') is None
+
+def test_keyed_by_user_and_service():
+    cache = ProviderTokenCache()
+    cache.set('user', 'spotify', 'spotify_token', 2 ** 40)
+    cache.set('user', 'gmail', 'gmail_token', 2 ** 40)
+    cache.set('other', 'spotify', 'other_token', 2 ** 40)
+
+    assert cache.get('user', 'spotify') == 'spotify_token'
+    assert cache.get('user', 'gmail') == 'gmail_token'
+    assert cache.get('other', 'spotify') == 'other_token'
+    assert cache.get('other', 'gmail') is None
+
+def test_invalidate_service_and_user():
+    cache = ProviderTokenCache()
+    cache.set('user', 'spotify', 'spotify_token', 2 ** 40)
+    cache.set('user', 'gmail', 'gmail_token', 2 ** 40)
+
+    cache.invalidate('user', 'spotify')
+    assert cache.get('user', 'spotify') is None
+    assert cache.get('user', 'gmail') == 'gmail_token'
+
+    cache.invalidate('user')
+    assert cache.get('user', 'gmail') is None
+
+def test_size_bound():
+    cache = ProviderTokenCache(max_size=2)
+    for user in ['a', 'b', 'c']:
+        cache.set(user, 'spotify', user, 2 ** 40)
+
+    assert cache.get('a', 'spotify') is None
+    assert cache.get('c', 'spotify') == 'c'
+
+def test_concurrent_access():
+    cache = ProviderTokenCache(max_size=100)
+
+    def worker(n):
+        for i in range(500):
+            cache.set(f'user-{i % 150}', 'spotify', str(n), 2 ** 40)
+            cache.get(f'user-{(i * 7) % 150}', 'spotify')
+            if i % 10 == 0:
+                cache.invalidate(f'user-{i % 150}')
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(cache.tokens) <= 100
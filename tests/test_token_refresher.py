@@ -0,0 +1,115 @@
+import time
+import pytest
+from unittest.mock import Mock, patch
+from services.utils.token_cache import provider_token_cache
+from services.utils.token_refresher import TokenRefreshScheduler
+from services.utils.tools.app_tool import AppTool
+
+@pytest.fixture
+def spotify_tool():
+    tool = Mock()
+    tool.refresh_user_tokens.return_value = {'access_token': 'new_token', 'expires_at': int(time.time()) + 3600}
+    return tool
+
+@pytest.fixture
+def scheduler(spotify_tool):
+    scheduler = TokenRefreshScheduler(lead_time=300, spread=60, interval=3600, min_spacing=0)
+    scheduler.start({'spotify': spotify_tool})
+    yield scheduler
+    scheduler.stop()
+
+def test_track_is_noop_when_not_running():
+    scheduler = TokenRefreshScheduler()
+    scheduler.track('user', 'spotify', time.time())
+    assert scheduler.tracked == {}
+
+def test_refresh_time_is_jittered_within_spread(scheduler):
+    expires_at = time.time() + 3600
+    for i in range(50):
+        scheduler.track(f'user-{i}', 'spotify', expires_at)
+
+    refresh_times = [entry['refresh_at'] for entry in scheduler.tracked.values()]
+    assert all(expires_at - 360 <= t <= expires_at - 300 for t in refresh_times)
+    assert len(set(refresh_times)) > 1
+
+def test_due_only_returns_tokens_close_to_expiry(scheduler):
+    now = time.time()
+    scheduler.track('soon', 'spotify', now + 100)
+    scheduler.track('later', 'spotify', now + 3600)
+    assert scheduler.due() == [('soon', 'spotify')]
+
+def test_due_is_bounded_and_ordered(scheduler):
+    scheduler.max_refreshes_per_run = 2
+    scheduler.spread = 0
+    now = time.time()
+    for i, offset in enumerate([30, 10, 20]):
+        scheduler.track(f'user-{i}', 'spotify', now + offset)
+    assert scheduler.due(now + 400) == [('user-1', 'spotify'), ('user-2', 'spotify')]
+
+def test_inactive_users_are_not_refreshed(scheduler):
+    scheduler.track('idle', 'spotify', time.time() + 100)
+    scheduler.tracked[('idle', 'spotify')]['last_active'] -= scheduler.active_window + 1
+    assert scheduler.due() == []
+    assert scheduler.tracked == {}
+
+def test_run_once_refreshes_due_tokens(scheduler, spotify_tool):
+    scheduler.track('user', 'spotify', time.time() + 100)
+    scheduler.track('user', 'gmail', time.time() + 100)
+    scheduler.run_once()
+
+    spotify_tool.refresh_user_tokens.assert_called_once_with('user', lead_time=300)
+    assert scheduler.refreshed == 1
+    assert scheduler.due() == []
+    assert ('user', 'spotify') in scheduler.tracked
+
+def test_run_once_counts_failures(scheduler, spotify_tool):
+    spotify_tool.refresh_user_tokens.side_effect = Exception('provider down')
+    scheduler.track('user', 'spotify', time.time() + 100)
+    scheduler.run_once()
+    assert scheduler.failed == 1
+
+def test_request_path_uses_token_refreshed_in_background():
+    app_tool = AppTool(Mock())
+    app_tool.service_name = 'spotify'
+    app_tool.table.get_item.return_value = {
+        'Item': {
+            'userId': 'user',
+            'appTokens': {'spotify': {'access_token': 'old_token', 'refresh_token': 'refresh', 'expires_at': int(time.time()) + 200}}
+        }
+    }
+
+    scheduler = TokenRefreshScheduler(lead_time=300, spread=0, interval=3600)
+    with patch('services.utils.tools.app_tool.token_refresh_scheduler', scheduler), \
+         patch.object(app_tool, 'refresh_access_token', return_value={'access_token': 'new_token', 'expires_in': 3600}) as mock_refresh:
+        scheduler.start({'spotify': app_tool})
+        try:
+            assert app_tool.get_app_headers('user') == {'Authorization': 'Bearer old_token'}
+            scheduler.run_once()
+            assert app_tool.get_app_headers('user') == {'Authorization': 'Bearer new_token'}
+        finally:
+            scheduler.stop()
+
+    mock_refresh.assert_called_once_with('refresh')
+    assert provider_token_cache.get('user', 'spotify') == 'new_token'
+
+def test_token_refreshed_by_another_worker_is_not_refreshed_again():
+    app_tool = AppTool(Mock())
+    app_tool.service_name = 'spotify'
+    # This worker tracked the old expiry; the stored token was since refreshed elsewhere
+    app_tool.table.get_item.return_value = {
+        'Item': {'appTokens': {'spotify': {'access_token': 'other_token', 'refresh_token': 'refresh', 'expires_at': int(time.time()) + 3600}}}
+    }
+
+    scheduler = TokenRefreshScheduler(lead_time=300, spread=0, interval=3600)
+    with patch.object(app_tool, 'refresh_access_token') as mock_refresh:
+        scheduler.start({'spotify': app_tool})
+        try:
+            scheduler.track('user', 'spotify', time.time() + 100)
+            scheduler.run_once()
+            tracked = dict(scheduler.tracked)
+        finally:
+            scheduler.stop()
+
+    mock_refresh.assert_not_called()
+    app_tool.table.update_item.assert_not_called()
+    assert tracked[('user', 'spotify')]['refresh_at'] > time.time() + 3000
@@ -0,0 +1,96 @@
+import time
+import threading
+import pytest
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from server import app
+from services.utils.request_context import get_request_context, request_cached
+from services.utils.tool_executor import ToolExecutor
+
+def slow_tool(latency, result):
+    time.sleep(latency)
+    return result
+
+def test_calls_run_concurrently():
+    executor = ToolExecutor(max_workers=4, per_user_limit=4)
+
+    start = time.perf_counter()
+    futures = [executor.submit('user', slow_tool, 0.2, i) for i in range(3)]
+    results = [future.result() for future in futures]
+
+    assert results == [0, 1, 2]
+    assert time.perf_counter() - start < 0.45
+
+def test_per_user_limit():
+    executor = ToolExecutor(max_workers=4, per_user_limit=1)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def tool():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    futures = [executor.submit('user', tool) for _ in range(3)]
+    for future in futures:
+        future.result()
+
+    assert max(peak) == 1
+    assert executor.user_slots == {}
+
+def test_users_do_not_share_a_limit():
+    executor = ToolExecutor(max_workers=4, per_user_limit=1)
+
+    start = time.perf_counter()
+    futures = [executor.submit(user, slow_tool, 0.2, user) for user in ('alice', 'bob')]
+    assert [future.result() for future in futures] == ['alice', 'bob']
+    assert time.perf_counter() - start < 0.35
+
+def test_errors_release_the_user_slot():
+    executor = ToolExecutor(max_workers=2, per_user_limit=1)
+
+    def failing_tool():
+        raise ValueError('provider error')
+
+    future = executor.submit('user', failing_tool)
+    assert isinstance(future.exception(), ValueError)
+    assert executor.submit('user', slow_tool, 0, 'ok').result() == 'ok'
+
+def test_calls_see_the_request_context():
+    executor = ToolExecutor()
+
+    with app.app_context():
+        context = get_request_context()
+        context.set_user('context_user')
+        request_cached('connected_apps', lambda: ['spotify'])
+
+        future = executor.submit('context_user', lambda: (get_request_context() is context, request_cached('connected_apps', lambda: [])))
+        assert future.result() == (True, ['spotify'])
+
+def test_cancelled_queued_calls_release_the_user_slot():
+    executor = ToolExecutor(max_workers=1, per_user_limit=2)
+    release = threading.Event()
+    running = executor.submit('user', release.wait, 5)
+    queued = executor.submit('user', slow_tool, 0, 'never')
+
+    assert queued.cancel()
+    release.set()
+    running.result()
+
+    assert executor.user_slots == {}
+    assert [executor.submit('user', slow_tool, 0, i).result() for i in range(2)] == [0, 1]
+
+def test_submit_gives_up_waiting_for_a_slot():
+    executor = ToolExecutor(max_workers=2, per_user_limit=1)
+    release = threading.Event()
+    running = executor.submit('user', release.wait, 5)
+
+    with pytest.raises(FuturesTimeoutError):
+        executor.submit('user', slow_tool, 0, 'late', timeout=0.05)
+    release.set()
+    running.result()
+
+    assert executor.user_slots == {}
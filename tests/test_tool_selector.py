@@ -0,0 +1,47 @@
+import pytest
+from unittest.mock import MagicMock
+from services.utils.tools.app_manager import AppManager
+from services.utils.tool_selector import ToolSelector, MORE_TOOLS_SPEC, context_text
+
+@pytest.fixture
+def app_manager():
+    return AppManager(MagicMock())
+
+@pytest.fixture
+def tools(app_manager):
+    return app_manager.get_user_tools(connected_apps=['spotify', 'gmail'])
+
+@pytest.fixture
+def selector(app_manager):
+    return ToolSelector(app_manager.app_keywords())
+
+def names(tools):
+    return {tool['toolSpec']['name'].split('_')[0] for tool in tools}
+
+@pytest.mark.parametrize('prompt, apps', [
+    ('Add Hey Jude to my Road Trip playlist', {'spotify', 'request'}),
+    ('Show me my latest 10 emails', {'gmail', 'request'}),
+    ('Email my Road Trip playlist to sam@example.com', {'spotify', 'gmail'}),
+    ('Thanks!', {'request'})
+])
+def test_selects_the_apps_a_prompt_is_about(selector, tools, prompt, apps):
+    assert names(selector.select(prompt, '', tools)) == apps
+
+def test_nothing_pruned_returns_the_same_list(selector, tools):
+    assert selector.select('Email my playlist to sam', '', tools) is tools
+
+def test_recent_messages_count_for_follow_ups(selector, tools):
+    offered = selector.select('And the second one?', 'Check my inbox', tools)
+
+    assert names(offered) == {'gmail', 'request'}
+    assert offered[-1] is MORE_TOOLS_SPEC
+
+def test_context_leaves_out_stored_tool_results():
+    messages = [
+        {'role': 'user', 'content': [{'text': 'Check my inbox'}]},
+        {'role': 'assistant', 'content': [{'text': '[Called gmail_list_messages with {}]'}]},
+        {'role': 'user', 'content': [{'text': '[Tool result]\nSubject: New playlist for you'}]},
+        {'role': 'assistant', 'content': [{'text': 'You have one email.'}]}
+    ]
+
+    assert context_text(messages) == 'Check my inbox'
@@ -0,0 +1,59 @@
+import pytest
+from unittest.mock import patch
+from services.utils.usage_tracker import UsageTracker, call_cost
+
+USAGE = {'inputTokens': 1000, 'outputTokens': 200, 'cacheReadInputTokens': 2000, 'cacheWriteInputTokens': 0}
+
+def test_call_cost():
+    # 1000 input, 200 output and 2000 cache-read tokens at Claude 3 Haiku prices
+    assert call_cost(USAGE) == pytest.approx(0.00025 + 0.00025 + 0.00005)
+
+def test_totals_per_stage_route_and_user():
+    tracker = UsageTracker()
+    tracker.record('alice', 'first', USAGE, 420, route='/generate')
+    tracker.record('alice', 'tool_followup', USAGE, 380, route='/generate')
+    tracker.record('bob', 'first', USAGE, 400, route='/generate/stream')
+
+    snapshot = tracker.snapshot()
+    assert snapshot['total']['calls'] == 3
+    assert snapshot['stages']['first']['input_tokens'] == 2000
+    assert snapshot['stages']['tool_followup']['bedrock_latency_ms'] == 380
+    assert snapshot['routes']['/generate']['calls'] == 2
+    assert list(snapshot['top_users']) == ['alice', 'bob']
+    assert tracker.user_snapshot('alice')['window']['tokens'] == 6400
+
+def test_route_outside_a_request_is_background():
+    tracker = UsageTracker()
+    tracker.record(None, 'summary', USAGE)
+
+    assert tracker.snapshot()['routes'] == {'background': tracker.snapshot()['total']}
+    assert tracker.snapshot()['users_tracked'] == 0
+
+def test_token_budget_and_window():
+    tracker = UsageTracker(token_budget=3000, window_seconds=60)
+    assert not tracker.over_budget('alice')
+
+    with patch('services.utils.usage_tracker.time.time', return_value=1000):
+        tracker.record('alice', 'first', USAGE, route='/generate')
+        assert tracker.over_budget('alice')
+        assert not tracker.over_budget('bob')
+        assert tracker.retry_after('alice') == 61
+
+    with patch('services.utils.usage_tracker.time.time', return_value=1060):
+        assert not tracker.over_budget('alice')
+
+def test_cost_budget():
+    tracker = UsageTracker(cost_budget=0.001)
+    tracker.record('alice', 'first', USAGE, route='/generate')
+    assert not tracker.over_budget('alice')
+
+    tracker.record('alice', 'first', USAGE, route='/generate')
+    assert tracker.over_budget('alice')
+
+def test_least_recently_active_users_are_forgotten():
+    tracker = UsageTracker(max_users=2)
+    for user_id in ('alice', 'bob', 'carol'):
+        tracker.record(user_id, 'first', USAGE, route='/generate')
+
+    assert tracker.user_snapshot('alice') is None
+    assert tracker.snapshot()['users_tracked'] == 2
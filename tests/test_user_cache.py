@@ -0,0 +1,161 @@
+import pytest
+import threading
+import multiprocessing
+from unittest.mock import patch
+from services.utils.user_cache import UserToolsCache, SQLiteCacheBackend
+
+TOOLS = [{"toolSpec": {"name": "spotify_get_user_playlists"}}]
+
+def test_miss_returns_none():
+    cache = UserToolsCache()
+    assert cache.get_user_tools('user') is None
+    assert cache.stats()['misses'] == 1
+
+def test_set_and_get():
+    cache = UserToolsCache()
+    cache.set_user_tools('user', TOOLS)
+    assert cache.get_user_tools('user') == TOOLS
+    assert cache.stats()['hits'] == 1
+
+def test_negative_entry_is_a_hit():
+    cache = UserToolsCache()
+    cache.set_user_tools('user', [])
+    assert cache.get_user_tools('user') == []
+    assert cache.stats()['hits'] == 1
+
+@patch('services.utils.user_cache.time')
+def test_entry_expires(mock_time):
+    mock_time.monotonic.return_value = 1000
+    cache = UserToolsCache(ttl=10)
+    cache.set_user_tools('user', TOOLS)
+
+    mock_time.monotonic.return_value = 1009
+    assert cache.get_user_tools('user') == TOOLS
+
+    mock_time.monotonic.return_value = 1010
+    assert cache.get_user_tools('user') is None
+    assert cache.stats()['size'] == 0
+
+@patch('services.utils.user_cache.time')
+def test_negative_entry_uses_negative_ttl(mock_time):
+    mock_time.monotonic.return_value = 1000
+    cache = UserToolsCache(ttl=300, negative_ttl=5)
+    cache.set_user_tools('user', [])
+
+    mock_time.monotonic.return_value = 1006
+    assert cache.get_user_tools('user') is None
+
+def test_lru_eviction():
+    cache = UserToolsCache(max_size=2)
+    cache.set_user_tools('a', TOOLS)
+    cache.set_user_tools('b', TOOLS)
+    cache.get_user_tools('a')
+    cache.set_user_tools('c', TOOLS)
+
+    assert cache.get_user_tools('b') is None
+    assert cache.get_user_tools('a') == TOOLS
+    assert cache.get_user_tools('c') == TOOLS
+    assert cache.stats()['evictions'] == 1
+
+def test_invalidate():
+    cache = UserToolsCache()
+    cache.set_user_tools('user', TOOLS)
+    cache.invalidate('user')
+    assert cache.get_user_tools('user') is None
+
+def test_concurrent_access_stays_bounded():
+    cache = UserToolsCache(max_size=50)
+
+    def worker(n):
+        for i in range(200):
+            cache.set_user_tools(f'user-{n}-{i}', TOOLS)
+            cache.get_user_tools(f'user-{n}-{i}')
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = cache.stats()
+    assert stats['size'] == 50
+    assert stats['hits'] + stats['misses'] == 1600
+    assert stats['evictions'] == 1600 - 50
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    return str(tmp_path / 'user_tools.db')
+
+def test_sqlite_set_and_get(sqlite_path):
+    cache = UserToolsCache(backend=SQLiteCacheBackend(sqlite_path))
+    cache.set_user_tools('user', TOOLS)
+    cache.set_user_tools('empty_user', [])
+    assert cache.get_user_tools('user') == TOOLS
+    assert cache.get_user_tools('empty_user') == []
+    assert cache.get_user_tools('missing') is None
+
+@patch('services.utils.user_cache.time')
+def test_sqlite_entry_expires(mock_time, sqlite_path):
+    mock_time.time.return_value = 1000
+    cache = UserToolsCache(ttl=10, backend=SQLiteCacheBackend(sqlite_path))
+    cache.set_user_tools('user', TOOLS)
+
+    mock_time.time.return_value = 1010
+    assert cache.get_user_tools('user') is None
+    assert cache.stats()['size'] == 0
+
+@patch('services.utils.user_cache.time')
+def test_sqlite_lru_eviction(mock_time, sqlite_path):
+    mock_time.time.return_value = 1000
+    cache = UserToolsCache(backend=SQLiteCacheBackend(sqlite_path, max_size=2))
+    cache.set_user_tools('a', TOOLS)
+    mock_time.time.return_value = 1001
+    cache.set_user_tools('b', TOOLS)
+    mock_time.time.return_value = 1100
+    cache.get_user_tools('a')
+    mock_time.time.return_value = 1101
+    cache.set_user_tools('c', TOOLS)
+
+    assert cache.get_user_tools('b') is None
+    assert cache.get_user_tools('a') == TOOLS
+    assert cache.stats()['evictions'] == 1
+
+@patch('services.utils.user_cache.time')
+def test_sqlite_recent_hits_are_read_only(mock_time, sqlite_path):
+    mock_time.time.return_value = 1000
+    backend = SQLiteCacheBackend(sqlite_path, touch_interval=30)
+    backend.set('user', TOOLS, 300)
+    statements = []
+    backend._connect().set_trace_callback(statements.append)
+
+    mock_time.time.return_value = 1010
+    assert backend.get('user') == TOOLS
+    assert not any(statement.startswith('UPDATE') for statement in statements)
+
+    mock_time.time.return_value = 1040
+    assert backend.get('user') == TOOLS
+    assert any(statement.startswith('UPDATE') for statement in statements)
+
+def test_sqlite_invalidation_is_shared(sqlite_path):
+    worker_a = UserToolsCache(backend=SQLiteCacheBackend(sqlite_path))
+    worker_b = UserToolsCache(backend=SQLiteCacheBackend(sqlite_path))
+
+    worker_a.set_user_tools('user', TOOLS)
+    assert worker_b.get_user_tools('user') == TOOLS
+
+    worker_b.invalidate('user')
+    assert worker_a.get_user_tools('user') is None
+
+def _set_tools_in_other_process(path):
+    UserToolsCache(backend=SQLiteCacheBackend(path)).set_user_tools('user', TOOLS)
+
+def test_sqlite_shared_across_processes(sqlite_path):
+    cache = UserToolsCache(backend=SQLiteCacheBackend(sqlite_path))
+    assert cache.get_user_tools('user') is None
+
+    process = multiprocessing.get_context('fork').Process(target=_set_tools_in_other_process, args=(sqlite_path,))
+    process.start()
+    process.join()
+
+    assert process.exitcode == 0
+    assert cache.get_user_tools('user') == TOOLS